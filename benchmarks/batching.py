@@ -0,0 +1,130 @@
+"""Benchmark batching many small commits into large batches.
+
+Run with:
+
+```bash
+uv run python benchmarks/batching.py
+```
+
+This compares `batch_chunks_by_token_limit` against its previous implementation, which
+re-joined and re-dedented the whole batch every time a chunk was added, and checks that
+both produce the same batches.
+"""
+
+import argparse
+import random
+import string
+import timeit
+from collections.abc import Callable, Iterable, Iterator
+from functools import partial
+
+from brag.batching import batch_chunks_by_token_limit
+from brag.models import TokenCount
+from brag.text_formatters import promptify
+from brag.tokens import estimate_token_count
+
+
+def quadratic_batch_chunks_by_token_limit(
+    chunks: Iterable[str],
+    max_tokens_per_batch: TokenCount,
+    joiner: str = "\n\n---\n\n",
+) -> Iterator[str]:
+    """Batch chunks like the previous implementation of `batch_chunks_by_token_limit`."""
+    joiner_token_count = estimate_token_count(joiner, approximation_mode="overestimate")
+    current_batch: str = ""
+    current_batch_token_count = 0
+
+    for chunk in chunks:
+        chunk_token_count = estimate_token_count(
+            chunk, approximation_mode="overestimate"
+        )
+        additional_token_count = joiner_token_count if current_batch else 0
+        if current_batch and (
+            current_batch_token_count + additional_token_count + chunk_token_count
+            > max_tokens_per_batch
+        ):
+            yield current_batch
+            current_batch = chunk
+            current_batch_token_count = chunk_token_count
+        else:
+            current_batch = promptify(current_batch, chunk, joiner=joiner)
+            current_batch_token_count += additional_token_count + chunk_token_count
+
+    if current_batch:
+        yield current_batch
+
+
+def synthetic_commits(count: int, *, seed: int = 0) -> list[str]:
+    """Generate commits formatted like the output of `git show`."""
+    rng = random.Random(seed)
+
+    def word() -> str:
+        return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10)))
+
+    commits = []
+    for _ in range(count):
+        sha = "".join(rng.choices("0123456789abcdef", k=40))
+        message = " ".join(word() for _ in range(rng.randint(3, 12)))
+        diff = "\n".join(
+            f"{rng.choice('+- ')}{' '.join(word() for _ in range(rng.randint(1, 8)))}"
+            for _ in range(rng.randint(1, 20))
+        )
+        commits.append(
+            f"commit {sha}\n"
+            "Author: Octocat <octocat@example.com>\n"
+            "Date:   Mon Jan 1 00:00:00 2024 +0000\n"
+            "\n"
+            f"    {message}\n"
+            "\n"
+            f"diff --git a/{word()}.py b/{word()}.py\n"
+            f"{diff}\n"
+        )
+    return commits
+
+
+def _batch_all(
+    function: Callable[[Iterable[str], TokenCount], Iterator[str]],
+    chunks: Iterable[str],
+    max_tokens_per_batch: TokenCount,
+) -> None:
+    for _ in function(chunks, max_tokens_per_batch):
+        pass
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--commits", type=int, default=10_000)
+    parser.add_argument("--max-tokens-per-batch", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    commits = synthetic_commits(args.commits)
+    batches = list(batch_chunks_by_token_limit(commits, args.max_tokens_per_batch))
+    if batches != list(
+        quadratic_batch_chunks_by_token_limit(commits, args.max_tokens_per_batch)
+    ):
+        raise AssertionError("The implementations produced different batches")
+
+    print(
+        f"Batching {len(commits)} commits into {len(batches)} batches"
+        f" of up to {args.max_tokens_per_batch} tokens"
+    )
+    timings: dict[str, float] = {}
+    for name, function in (
+        ("previous", quadratic_batch_chunks_by_token_limit),
+        ("current", batch_chunks_by_token_limit),
+    ):
+        timings[name] = min(
+            timeit.repeat(
+                partial(_batch_all, function, commits, args.max_tokens_per_batch),
+                number=1,
+                repeat=args.repeat,
+            )
+        )
+        print(f"  {name:>8}: {timings[name] * 1000:10.1f} ms")
+    print(f"  Speedup: {timings['previous'] / timings['current']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
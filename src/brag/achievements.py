@@ -0,0 +1,205 @@
+"""Extract achievements from contributions, and combine them into a brag document.
+
+Instead of reading and rewriting the brag document for every chunk of contributions, each
+chunk can be turned into a list of typed achievements, independently of the others. The
+achievements of all the chunks are then deduplicated locally, and rendered into the brag
+document at once.
+
+Achievements extracted from different chunks are duplicates when they have the same
+title once normalized, when they come from the same commit, for example a commit split
+across several chunks, or when they mostly changed the same files.
+"""
+
+from __future__ import annotations
+
+import re
+from collections.abc import Callable, Iterable, Sequence
+from datetime import date
+from typing import Final
+
+from pydantic import BaseModel, Field
+
+# The minimum Jaccard similarity of the changed files of two duplicate achievements
+_MIN_FILE_OVERLAP: Final = 0.5
+# The minimum number of changed files two duplicate achievements have in common, so that
+# achievements changing the same single file, such as a changelog, are not merged
+_MIN_SHARED_FILES: Final = 2
+_SHORT_SHA_LENGTH: Final = 7
+_NON_ALPHANUMERIC_PATTERN = re.compile(r"[\W_]+")
+
+
+class Achievement(BaseModel):
+    """An accomplishment worth mentioning in a brag document."""
+
+    title: str = Field(
+        description="A short title of the achievement, such as 'Added full-text search'."
+    )
+    impact: str = Field(
+        description="What the achievement changed, with quantifiable results if available."
+    )
+    skills: list[str] = Field(
+        default_factory=list,
+        description="The technical skills demonstrated, such as languages, frameworks or practices.",
+    )
+    commit_shas: list[str] = Field(
+        default_factory=list,
+        description="The SHAs of the commits the achievement comes from, if mentioned.",
+    )
+    files: list[str] = Field(
+        default_factory=list,
+        description="The paths of the files changed by the achievement.",
+    )
+    dates: list[date] = Field(
+        default_factory=list,
+        description="The dates of the commits the achievement comes from, if mentioned.",
+    )
+
+
+class ExtractedAchievements(BaseModel):
+    """The achievements found in a chunk of contributions."""
+
+    achievements: list[Achievement] = Field(
+        description="The achievements, or an empty list if nothing is worth mentioning."
+    )
+
+
+def merge_achievements(achievements: Iterable[Achievement]) -> list[Achievement]:
+    """Merge duplicate achievements, keeping the order of their first occurrence.
+
+    Each achievement is merged into the first earlier achievement it duplicates, see the
+    module documentation. Merged achievements keep the title of the first one, and
+    combine the impacts, skills, commits, files and dates of all of them.
+
+    Args:
+        achievements: The achievements to merge, in the order of the chunks they were
+            extracted from.
+
+    Returns:
+        The achievements without duplicates.
+    """
+    merged: list[Achievement] = []
+    # Index the merged achievements, so that duplicates are found without comparing
+    # every pair of achievements
+    indices_by_title: dict[str, int] = {}
+    indices_by_commit: dict[str, int] = {}
+    indices_by_file: dict[str, set[int]] = {}
+
+    for achievement in achievements:
+        index = _find_duplicate(
+            achievement, merged, indices_by_title, indices_by_commit, indices_by_file
+        )
+        if index is None:
+            index = len(merged)
+            merged.append(achievement)
+        else:
+            merged[index] = _merge_pair(merged[index], achievement)
+
+        if title := _normalize_title(achievement.title):
+            indices_by_title.setdefault(title, index)
+        for sha in filter(None, map(_normalize_sha, achievement.commit_shas)):
+            indices_by_commit.setdefault(sha, index)
+        for file in achievement.files:
+            indices_by_file.setdefault(file, set()).add(index)
+    return merged
+
+
+def render_achievements(achievements: Sequence[Achievement]) -> str:
+    """Render achievements as Markdown, with one section per achievement.
+
+    This is a local alternative to having an LLM write the brag document. The sections
+    have second-level headings, so that they can be appended to an existing brag
+    document.
+    """
+    return "\n\n".join(_render_achievement(achievement) for achievement in achievements)
+
+
+def _find_duplicate(
+    achievement: Achievement,
+    merged: Sequence[Achievement],
+    indices_by_title: dict[str, int],
+    indices_by_commit: dict[str, int],
+    indices_by_file: dict[str, set[int]],
+) -> int | None:
+    """Return the index of the first merged achievement duplicated by an achievement."""
+    candidates = {
+        index
+        for index in (
+            indices_by_title.get(_normalize_title(achievement.title)),
+            *map(indices_by_commit.get, map(_normalize_sha, achievement.commit_shas)),
+        )
+        if index is not None
+    }
+    files = set(achievement.files)
+    for index in sorted(
+        {index for file in files for index in indices_by_file.get(file, ())}
+        - candidates
+    ):
+        other_files = set(merged[index].files)
+        shared_files = len(files & other_files)
+        if (
+            shared_files >= _MIN_SHARED_FILES
+            and shared_files / len(files | other_files) >= _MIN_FILE_OVERLAP
+        ):
+            candidates.add(index)
+    return min(candidates, default=None)
+
+
+def _merge_pair(first: Achievement, second: Achievement) -> Achievement:
+    """Merge an achievement into an earlier duplicate."""
+    impacts = _unique([first.impact, second.impact], key=_normalize_title)
+    return Achievement(
+        title=first.title,
+        impact=" ".join(impact.strip() for impact in impacts if impact.strip()),
+        skills=_unique([*first.skills, *second.skills], key=str.casefold),
+        commit_shas=_unique(
+            [*first.commit_shas, *second.commit_shas], key=_normalize_sha
+        ),
+        files=_unique([*first.files, *second.files], key=str),
+        dates=sorted({*first.dates, *second.dates}),
+    )
+
+
+def _render_achievement(achievement: Achievement) -> str:
+    details = []
+    if achievement.skills:
+        details.append(f"- **Skills:** {', '.join(achievement.skills)}")
+    if achievement.dates:
+        first_date, last_date = min(achievement.dates), max(achievement.dates)
+        details.append(
+            f"- **Dates:** {first_date.isoformat()}"
+            if first_date == last_date
+            else f"- **Dates:** {first_date.isoformat()} to {last_date.isoformat()}"
+        )
+    if achievement.commit_shas:
+        commits = ", ".join(sha[:_SHORT_SHA_LENGTH] for sha in achievement.commit_shas)
+        details.append(f"- **Commits:** {commits}")
+    return "\n\n".join(
+        block
+        for block in (
+            f"## {achievement.title.strip()}",
+            achievement.impact.strip(),
+            "\n".join(details),
+        )
+        if block
+    )
+
+
+def _normalize_title(title: str) -> str:
+    """Normalize a title, so that titles differing only in case or punctuation match."""
+    return " ".join(_NON_ALPHANUMERIC_PATTERN.sub(" ", title).split()).casefold()
+
+
+def _normalize_sha(sha: str) -> str:
+    """Normalize a commit SHA to its short form, since models often abbreviate them."""
+    return sha.strip().casefold()[:_SHORT_SHA_LENGTH]
+
+
+def _unique[T](values: Iterable[T], *, key: Callable[[T], object]) -> list[T]:
+    """Return the values without duplicates according to a key, in order."""
+    seen: set[object] = set()
+    unique_values: list[T] = []
+    for value in values:
+        if (value_key := key(value)) not in seen:
+            seen.add(value_key)
+            unique_values.append(value)
+    return unique_values
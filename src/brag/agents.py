@@ -1,22 +1,70 @@
 """A model for generating a brag document from a list of documents."""
 
-from collections.abc import Iterable, Iterator
-from functools import cache
-from typing import TypeVar
+from __future__ import annotations
 
+import asyncio
+from collections.abc import AsyncIterable, AsyncIterator, Callable, Iterable, Sequence
+from dataclasses import dataclass
+from functools import cache, reduce
+from itertools import batched
+from typing import Any, Final, Literal, assert_never
+
+from loguru import logger
+from pydantic import BaseModel
 from pydantic_ai import Agent
+from pydantic_ai.agent import AgentRunResult
+from pydantic_ai.exceptions import UnexpectedModelBehavior
+from pydantic_ai.messages import ModelResponse
 from pydantic_ai.models import KnownModelName
+from pydantic_ai.result import StreamedRunResult
+from pydantic_ai.settings import ModelSettings
 
+from brag.achievements import (
+    Achievement,
+    ExtractedAchievements,
+    merge_achievements,
+    render_achievements,
+)
+from brag.cache import ResponseCache
+from brag.checkpoints import (
+    INITIAL_CHUNKS_DIGEST,
+    CheckpointFile,
+    chain_chunks_digest,
+)
+from brag.edits import BragDocumentEdits, EditError, apply_edits
+from brag.models import TokenCount
+from brag.pipeline import aiterate, map_async
+from brag.scheduling import LLMScheduler
 from brag.text_formatters import promptify
 
-_T = TypeVar("_T")
+type GenerationStrategy = Literal["refine", "tree", "extract"]
+type UpdateMode = Literal["rewrite", "edits"]
+type RenderMode = Literal["model", "template"]
+
+MIN_MERGE_ARITY = 2
+
+_MODEL_SETTINGS: Final[ModelSettings] = {"temperature": 0.0}
+_ANTHROPIC_MODEL_PREFIX: Final = "anthropic:"
+_PROMPT_PREFIX_SEPARATOR: Final = "\n\n"
+# The number of chunks waiting to be summarized per concurrent request, when using the
+# "tree" or "extract" strategies. Bounds how many chunks are held in memory.
+_PENDING_CHUNKS_PER_REQUEST: Final = 2
 
 
 async def generate_brag_document(
     model_name: KnownModelName,
-    chunks: Iterable[str],
+    chunks: Iterable[str] | AsyncIterable[str],
     language: str = "english",
     input_brag_document: str | None = None,
+    *,
+    strategy: GenerationStrategy = "refine",
+    merge_arity: int = 2,
+    update_mode: UpdateMode = "rewrite",
+    render_mode: RenderMode = "model",
+    scheduler: LLMScheduler | None = None,
+    cache: ResponseCache | None = None,
+    checkpoint: CheckpointFile | None = None,
+    on_text: Callable[[str], object] | None = None,
 ) -> str:
     """Generate a brag document from a list of text chunks.
 
@@ -35,70 +83,428 @@ async def generate_brag_document(
     The caller is responsible for providing the chunks in the correct order and formatted in
     a sensible manner.
 
+    Chunks may be provided asynchronously, for example while they are still being
+    extracted. Chunks are then processed as they arrive, instead of once all of them are
+    available.
+
     Args:
         model_name: The name of the AI model to use for generating the brag document.
-        chunks: An iterable of strings, where each string is a chunk of text
-            representing a contribution or achievement. This is expected to contain at
-            least one chunk.
+        chunks: An iterable or an asynchronous iterable of strings, where each string is
+            a chunk of text representing a contribution or achievement. This is expected
+            to contain at least one chunk.
         language: The language in which to generate the brag document.
         input_brag_document: An optional existing brag document to update with new
             contributions. If provided, the function will update this document.
             Otherwise, a new document will be generated from scratch.
+        strategy: How the chunks are combined into the brag document.
+            - "refine": Generate the document from the first chunk and refine it with each
+              subsequent chunk, one at a time. This makes one sequential LLM call per chunk.
+            - "tree": Summarize every chunk concurrently and merge the partial documents
+              until a single one remains. This reduces the critical path from one call
+              per chunk to a logarithmic number of merge rounds.
+            - "extract": Extract a list of achievements from every chunk concurrently,
+              remove the duplicate achievements locally, and render them into the brag
+              document at once. This makes one small LLM call per chunk, plus at most
+              one call for the brag document.
+        merge_arity: The number of partial brag documents merged by each LLM call when
+            using the "tree" strategy. Must be at least 2.
+        update_mode: How the brag document is refined with each chunk when using the
+            "refine" strategy.
+            - "rewrite": The LLM rewrites the whole brag document, so that each call
+              generates as many tokens as the document is long.
+            - "edits": The LLM returns a list of edits, such as bullet points to insert,
+              which are applied locally. Each call then generates a number of tokens
+              that does not grow with the document. If the edits do not apply, the
+              brag document is rewritten instead.
+        render_mode: How the achievements are rendered into the brag document when
+            using the "extract" strategy.
+            - "model": The LLM writes the brag document from the achievements, in a
+              single call.
+            - "template": The achievements are rendered with a local Markdown template,
+              without any LLM call. The brag document then lists every achievement in
+              its own section, after the input brag document if any.
+        scheduler: The scheduler used to run the LLM requests within the provider's
+            rate limits. If not provided, a scheduler with default settings is used.
+        cache: An optional persistent cache of LLM responses. Requests found in the
+            cache are not sent to the provider.
+        checkpoint: An optional checkpoint file used to save the progress after every
+            chunk and to resume an interrupted run. Only used by the "refine" strategy,
+            since the other strategies have no sequential progress to save; completed
+            requests of their interrupted runs are reused from the response cache.
+        on_text: An optional function called with the brag document, piece by piece,
+            as the final LLM call generates it, so that it can be shown before the call
+            returns. Earlier calls are not streamed, since their output is not the brag
+            document. If the brag document does not come from an LLM call, for example
+            when it is cached or edited, it is passed at once.
 
     Returns:
         A string containing the generated brag document.
     """
-    if input_brag_document:
-        # If an existing brag document is provided, use it as the starting point
-        brag_document = input_brag_document
-        # When using an existing document, we need to process all input chunks
-        # including the first one
-        chunks_to_process = chunks
-    else:
-        # If no existing document is provided, generate a new one from the first chunk
-        first_chunk, remaining_chunks = _head_and_tail(chunks)
-        # Generate initial summary from the first chunk.
-        initial_brag_document_generator_agent = _build_agent_from_system_prompt(
-            model_name,
-            system_prompt=f"""
-                You are an expert in creating compelling brag documents that highlight a person's achievements and skills.
-                Your task is to analyze a document and extract key accomplishments, technical skills demonstrated, and contributions made.
-                Focus on quantifiable results and impactful contributions.
-                Present the information in a concise and engaging manner, suitable for showcasing the individual's value.
-                Return only the generated brag document without extra comments or code fences.
-                Generate the brag document in {language}.
-            """,
-        )
-        brag_document = await _generate_initial_brag_document(
-            initial_brag_document_generator_agent,
-            first_chunk,
+    build_agent = _BragAgentFactory(
+        model_name=model_name,
+        scheduler=scheduler or LLMScheduler(),
+        cache=cache,
+    )
+
+    match strategy:
+        case "refine":
+            return await _generate_brag_document_by_refinement(
+                build_agent,
+                aiterate(chunks),
+                language=language,
+                input_brag_document=input_brag_document,
+                update_mode=update_mode,
+                checkpoint=checkpoint,
+                on_text=on_text,
+            )
+        case "tree":
+            return await _generate_brag_document_by_tree_reduction(
+                build_agent,
+                aiterate(chunks),
+                language=language,
+                input_brag_document=input_brag_document,
+                merge_arity=merge_arity,
+                on_text=on_text,
+            )
+        case "extract":
+            return await _generate_brag_document_by_extraction(
+                build_agent,
+                aiterate(chunks),
+                language=language,
+                input_brag_document=input_brag_document,
+                render_mode=render_mode,
+                on_text=on_text,
+            )
+        case never:
+            assert_never(never)
+
+
+async def _generate_brag_document_by_refinement(
+    build_agent: _BragAgentFactory,
+    chunks: AsyncIterator[str],
+    *,
+    language: str,
+    input_brag_document: str | None,
+    update_mode: UpdateMode,
+    checkpoint: CheckpointFile | None,
+    on_text: Callable[[str], object] | None,
+) -> str:
+    """Generate a brag document by refining it sequentially, one chunk at a time.
+
+    Each chunk requires one LLM call, and each call depends on the result of the
+    previous one. If a checkpoint file is provided, the progress is saved after every
+    chunk, and chunks already covered by a matching checkpoint are skipped.
+
+    With the "edits" update mode, refining the brag document requires a second LLM call
+    whenever the edits of the first one do not apply.
+
+    If the output is streamed, the next chunk is awaited before refining the brag
+    document with the current one, so that the call for the last chunk is known.
+    Chunks are usually extracted ahead of the LLM calls, so this seldom delays a call.
+    """
+    # If an existing brag document is provided, use it as the starting point.
+    # Otherwise, a new one is generated from the first chunk.
+    brag_document = input_brag_document or None
+    completed_chunks = 0
+    chunks_digest = INITIAL_CHUNKS_DIGEST
+
+    if checkpoint is not None and (saved := checkpoint.load()) is not None:
+        skipped_chunks = await _take(chunks, saved.completed_chunks)
+        skipped_chunks_digest = reduce(
+            chain_chunks_digest, skipped_chunks, INITIAL_CHUNKS_DIGEST
         )
-        # We've already processed the first chunk, so only process the remaining ones
-        chunks_to_process = remaining_chunks
-
-    # Iteratively refine the brag document with the chunks
-    for chunk in chunks_to_process:
-        brag_document_updater_agent = _build_agent_from_system_prompt(
-            model_name,
-            system_prompt=f"""
-                You are an expert in refining existing brag documents by incorporating new information.
-                Your task is to integrate new context into an existing brag document, ensuring that the document remains concise, engaging, and highlights the individual's key achievements and skills.
-                Focus on seamlessly weaving in new accomplishments, technical skills, and contributions, while maintaining a consistent tone and style.
-                Feel free to modify and re-arrange existing content to better reflect the new information.
-                Return only the generated brag document without extra comments or code fences.
-                Generate the brag document in {language}.
-            """,
+        if (
+            len(skipped_chunks) == saved.completed_chunks
+            and skipped_chunks_digest == saved.chunks_digest
+        ):
+            logger.info(
+                "Resuming from checkpoint after {completed_chunks} completed chunks",
+                completed_chunks=saved.completed_chunks,
+            )
+            brag_document = saved.brag_document
+            completed_chunks = saved.completed_chunks
+            chunks_digest = saved.chunks_digest
+        else:
+            logger.warning(
+                "Ignoring checkpoint `{path}` because it does not match the input chunks",
+                path=checkpoint.path,
+            )
+            chunks = _chain(skipped_chunks, chunks)
+
+    generated = False
+    async for chunk, is_last in _flag_last(chunks, peek=on_text is not None):
+        generated = True
+        final_on_text = on_text if is_last else None
+        if brag_document is None:
+            initial_brag_document_generator_agent = build_agent(
+                _INITIAL_BRAG_DOCUMENT_SYSTEM_PROMPT
+            )
+            brag_document = await _generate_initial_brag_document(
+                initial_brag_document_generator_agent,
+                chunk,
+                language=language,
+                on_text=final_on_text,
+            )
+        elif update_mode == "edits":
+            brag_document = await _edit_brag_document(
+                build_agent(_EDIT_BRAG_DOCUMENT_SYSTEM_PROMPT),
+                build_agent(_UPDATE_BRAG_DOCUMENT_SYSTEM_PROMPT),
+                brag_document,
+                chunk,
+                language=language,
+                on_text=final_on_text,
+            )
+        else:
+            brag_document_updater_agent = build_agent(
+                _UPDATE_BRAG_DOCUMENT_SYSTEM_PROMPT
+            )
+            brag_document = await _update_brag_document(
+                brag_document_updater_agent,
+                brag_document,
+                chunk,
+                language=language,
+                on_text=final_on_text,
+            )
+
+        completed_chunks += 1
+        chunks_digest = chain_chunks_digest(chunks_digest, chunk)
+        if checkpoint is not None:
+            checkpoint.save(
+                completed_chunks=completed_chunks,
+                chunks_digest=chunks_digest,
+                brag_document=brag_document,
+            )
+
+    if brag_document is None:
+        raise ValueError("Expected at least one chunk to generate a brag document")
+
+    if not generated:
+        # The brag document comes from the input or the checkpoint, not from an LLM call
+        _pass_text(on_text, brag_document)
+    return brag_document
+
+
+async def _generate_brag_document_by_tree_reduction(
+    build_agent: _BragAgentFactory,
+    chunks: AsyncIterator[str],
+    *,
+    language: str,
+    input_brag_document: str | None,
+    merge_arity: int,
+    on_text: Callable[[str], object] | None,
+) -> str:
+    """Generate a brag document by summarizing chunks independently and merging the results.
+
+    Every chunk is summarized into a partial brag document concurrently. Partial brag
+    documents are then merged in groups of `merge_arity` until a single document remains.
+    The input brag document, if any, is only folded in at the final merge, so that its
+    structure is preserved.
+
+    This makes one LLM call per chunk plus the merge calls, but the calls in each round
+    are independent of each other, so the critical path is `O(log(n))` rounds instead of
+    `O(n)` sequential calls. The scheduler bounds how many of them run at the same time.
+    Chunks are summarized as they arrive, and only a few of them wait for a request at
+    any time.
+    """
+    if merge_arity < MIN_MERGE_ARITY:
+        raise ValueError(f"merge_arity must be at least {MIN_MERGE_ARITY}")
+
+    initial_brag_document_generator_agent = build_agent(
+        _INITIAL_BRAG_DOCUMENT_SYSTEM_PROMPT
+    )
+    pending_chunks = asyncio.Semaphore(
+        _PENDING_CHUNKS_PER_REQUEST * build_agent.scheduler.max_concurrency
+    )
+
+    async def summarize(chunk: str) -> str:
+        try:
+            return await _generate_initial_brag_document(
+                initial_brag_document_generator_agent, chunk, language=language
+            )
+        finally:
+            pending_chunks.release()
+
+    async with asyncio.TaskGroup() as task_group:
+        summaries: list[asyncio.Task[str]] = []
+        async for chunk in chunks:
+            await pending_chunks.acquire()
+            summaries.append(task_group.create_task(summarize(chunk)))
+    brag_documents = [summary.result() for summary in summaries]
+
+    if not brag_documents:
+        if input_brag_document:
+            _pass_text(on_text, input_brag_document)
+            return input_brag_document
+        raise ValueError("Expected at least one chunk to generate a brag document")
+
+    brag_document_merger_agent = build_agent(_MERGE_BRAG_DOCUMENTS_SYSTEM_PROMPT)
+
+    # Reserve a slot in the final merge for the input brag document
+    reserved_slots = 1 if input_brag_document else 0
+    while len(brag_documents) + reserved_slots > merge_arity:
+        brag_documents = list(
+            await asyncio.gather(
+                *(
+                    _merge_brag_documents(
+                        brag_document_merger_agent, group, language=language
+                    )
+                    if len(group) > 1
+                    else _identity(group[0])
+                    for group in batched(brag_documents, merge_arity)
+                )
+            )
         )
-        brag_document = await _update_brag_document(
-            brag_document_updater_agent, brag_document, chunk
+
+    if not input_brag_document and len(brag_documents) == 1:
+        # The only summary was generated before it was known to be the final one
+        _pass_text(on_text, brag_documents[0])
+        return brag_documents[0]
+
+    return await _merge_brag_documents(
+        brag_document_merger_agent,
+        brag_documents,
+        existing_brag_document=input_brag_document,
+        language=language,
+        on_text=on_text,
+    )
+
+
+async def _generate_brag_document_by_extraction(
+    build_agent: _BragAgentFactory,
+    chunks: AsyncIterator[str],
+    *,
+    language: str,
+    input_brag_document: str | None,
+    render_mode: RenderMode,
+    on_text: Callable[[str], object] | None,
+) -> str:
+    """Generate a brag document from the achievements extracted from every chunk.
+
+    Every chunk is turned into a list of achievements concurrently. The achievements are
+    merged locally, see `merge_achievements`, and rendered into the brag document at
+    once, either by a single LLM call or with a local template.
+
+    Unlike the other strategies, no LLM call reads or writes the brag document before
+    the final one, so that extraction calls stay small whatever the size of the brag
+    document. Chunks are processed as they arrive, and only a few of them wait for a
+    request at any time.
+    """
+    achievements_extractor_agent = build_agent(_EXTRACT_ACHIEVEMENTS_SYSTEM_PROMPT)
+
+    async def extract(chunk: str) -> list[Achievement]:
+        return await _extract_achievements(
+            achievements_extractor_agent, chunk, language=language
         )
 
-    return brag_document
+    chunk_count = 0
+    extracted_achievements: list[Achievement] = []
+    async for achievements in map_async(
+        extract,
+        chunks,
+        concurrency=_PENDING_CHUNKS_PER_REQUEST * build_agent.scheduler.max_concurrency,
+    ):
+        chunk_count += 1
+        extracted_achievements.extend(achievements)
+
+    if not chunk_count and not input_brag_document:
+        raise ValueError("Expected at least one chunk to generate a brag document")
+
+    achievements = merge_achievements(extracted_achievements)
+    logger.info(
+        "Extracted {extracted} achievements, {merged} of them after removing duplicates",
+        extracted=len(extracted_achievements),
+        merged=len(achievements),
+    )
+    if not achievements:
+        # There is nothing to render, so the model is not called
+        if not input_brag_document:
+            logger.warning(
+                "No achievements were found in the contributions, the brag document is empty"
+            )
+        brag_document = input_brag_document or ""
+        _pass_text(on_text, brag_document)
+        return brag_document
+
+    match render_mode:
+        case "model":
+            return await _render_brag_document(
+                build_agent(_RENDER_BRAG_DOCUMENT_SYSTEM_PROMPT),
+                achievements,
+                existing_brag_document=input_brag_document,
+                language=language,
+                on_text=on_text,
+            )
+        case "template":
+            brag_document = promptify(
+                input_brag_document, render_achievements(achievements)
+            )
+            _pass_text(on_text, brag_document)
+            return brag_document
+        case never:
+            assert_never(never)
+
+
+# The system prompts are the same for every run, so that providers can cache them
+_INITIAL_BRAG_DOCUMENT_SYSTEM_PROMPT: Final = """
+    You are an expert in creating compelling brag documents that highlight a person's achievements and skills.
+    Your task is to analyze a document and extract key accomplishments, technical skills demonstrated, and contributions made.
+    Focus on quantifiable results and impactful contributions.
+    Present the information in a concise and engaging manner, suitable for showcasing the individual's value.
+    Return only the generated brag document without extra comments or code fences.
+"""
+
+
+_UPDATE_BRAG_DOCUMENT_SYSTEM_PROMPT: Final = """
+    You are an expert in refining existing brag documents by incorporating new information.
+    Your task is to integrate new context into an existing brag document, ensuring that the document remains concise, engaging, and highlights the individual's key achievements and skills.
+    Focus on seamlessly weaving in new accomplishments, technical skills, and contributions, while maintaining a consistent tone and style.
+    Feel free to modify and re-arrange existing content to better reflect the new information.
+    Return only the generated brag document without extra comments or code fences.
+"""
+
+
+_EDIT_BRAG_DOCUMENT_SYSTEM_PROMPT: Final = """
+    You are an expert in refining existing brag documents by incorporating new information.
+    Your task is to describe how to integrate new context into an existing brag document as a short list of edits, ensuring that the document remains concise, engaging, and highlights the individual's key achievements and skills.
+    Add new accomplishments as bullet points under the most relevant existing section, or in a new section if none fits.
+    Replace existing lines to combine related accomplishments or to update them with new results, rather than adding duplicates.
+    Refer to sections by their exact headings and to lines by their exact content.
+    Return an empty list of edits if the new context adds nothing worth mentioning.
+"""
+
+
+_EXTRACT_ACHIEVEMENTS_SYSTEM_PROMPT: Final = """
+    You are an expert in identifying the achievements and skills demonstrated by a person's contributions.
+    Your task is to analyze a document and extract its key accomplishments as a list of achievements, along with the technical skills demonstrated and the commits and files they come from.
+    Focus on quantifiable results and impactful contributions, and group related changes into a single achievement.
+    Return an empty list of achievements if the document contains nothing worth mentioning.
+"""
+
+
+_RENDER_BRAG_DOCUMENT_SYSTEM_PROMPT: Final = """
+    You are an expert in creating compelling brag documents that highlight a person's achievements and skills.
+    Your task is to write a brag document from a list of achievements extracted from their contributions.
+    Group related achievements, focus on quantifiable results and impactful contributions, and present them in a concise and engaging manner, suitable for showcasing the individual's value.
+    When an existing brag document is provided, preserve its structure, tone and style, and weave the new achievements into it.
+    Return only the generated brag document without extra comments or code fences.
+"""
+
+
+_MERGE_BRAG_DOCUMENTS_SYSTEM_PROMPT: Final = """
+    You are an expert in consolidating brag documents that highlight a person's achievements and skills.
+    Your task is to merge several partial brag documents into a single one, ensuring that the document remains concise, engaging, and highlights the individual's key achievements and skills.
+    Combine related accomplishments, remove duplicates, and keep the most quantifiable and impactful contributions.
+    When an existing brag document is provided, preserve its structure, tone and style, and weave the new content into it.
+    Return only the generated brag document without extra comments or code fences.
+"""
 
 
 async def _generate_initial_brag_document(
-    agent: Agent,
+    agent: _BragAgent,
     chunk: str,
+    *,
+    language: str,
+    on_text: Callable[[str], object] | None = None,
 ) -> str:
     """Generate an initial version of the brag document.
 
@@ -108,17 +514,19 @@ async def _generate_initial_brag_document(
     Args:
         agent: The AI agent to use for generating the initial brag document.
         chunk: A string of text representing the first contribution or achievement.
+        language: The language of the brag document.
+        on_text: An optional function called with the brag document, piece by piece,
+            as it is generated.
 
     Returns:
         A string containing the initial version of the brag document.
 
     """
-    prompt = _generate_initial_brag_document_prompt(chunk)
-    result = await agent.run(prompt)
-    return result.output
+    prompt = _generate_initial_brag_document_prompt(chunk, language)
+    return await agent.run(prompt, on_text=on_text)
 
 
-def _generate_initial_brag_document_prompt(chunk: str) -> str:
+def _generate_initial_brag_document_prompt(chunk: str, language: str) -> _Prompt:
     """Generate the prompt for the initial version of the brag document.
 
     This function generates the prompt that will be used to generate the initial
@@ -127,25 +535,34 @@ def _generate_initial_brag_document_prompt(chunk: str) -> str:
 
     Args:
         chunk: A string of text representing the first contribution or achievement.
+        language: The language of the brag document.
 
     Returns:
-        A string containing the prompt for generating the initial brag document.
+        The prompt for generating the initial brag document.
 
     """
-    return promptify(
-        """
-            Generate a brag document from the following context:
-            <context>
-            {context}
-            </context>
-        """
-    ).format(context=chunk)
+    return _Prompt(
+        prefix=promptify(
+            "Generate a brag document from the following context.",
+            f"Generate the brag document in {language}.",
+        ),
+        content=promptify(
+            """
+                <context>
+                {context}
+                </context>
+            """
+        ).format(context=chunk),
+    )
 
 
 async def _update_brag_document(
-    agent: Agent,
+    agent: _BragAgent,
     current_brag_document: str,
     new_context: str,
+    *,
+    language: str,
+    on_text: Callable[[str], object] | None = None,
 ) -> str:
     """Refine a brag document with new context.
 
@@ -157,20 +574,25 @@ async def _update_brag_document(
         agent: The AI agent to use for refining the brag document.
         current_brag_document: A string containing the existing brag document.
         new_context: A string of text representing the new contribution or achievement to incorporate.
+        language: The language of the brag document.
+        on_text: An optional function called with the brag document, piece by piece,
+            as it is generated.
 
     Returns:
         A string containing the refined brag document.
 
     """
-    prompt = _generate_update_brag_document_prompt(current_brag_document, new_context)
-    result = await agent.run(prompt)
-    return result.output
+    prompt = _generate_update_brag_document_prompt(
+        current_brag_document, new_context, language
+    )
+    return await agent.run(prompt, on_text=on_text)
 
 
 def _generate_update_brag_document_prompt(
     current_brag_document: str,
     new_context: str,
-) -> str:
+    language: str,
+) -> _Prompt:
     """Refine a summary with a new document.
 
     This function generates the prompt that will be used to refine the brag
@@ -182,59 +604,581 @@ def _generate_update_brag_document_prompt(
         current_brag_document: A string containing the existing brag document.
         new_context: A string of text representing the new contribution or
             achievement to incorporate.
+        language: The language of the brag document.
+
+    Returns:
+        The prompt for refining the brag document.
+
+    """
+    return _Prompt(
+        prefix=promptify(
+            "Produce a refined brag document.",
+            "Given the new context, refine the existing brag document up to this point.",
+            f"Generate the brag document in {language}.",
+        ),
+        content=promptify(
+            """
+                Existing brag document up to this point:
+                <brag_document>
+                {brag_document}
+                </brag_document>
+
+                New context:
+                <context>
+                {context}
+                </context>
+            """
+        ).format(brag_document=current_brag_document, context=new_context),
+    )
+
+
+async def _edit_brag_document(
+    editor_agent: _BragAgent,
+    rewriter_agent: _BragAgent,
+    current_brag_document: str,
+    new_context: str,
+    *,
+    language: str,
+    on_text: Callable[[str], object] | None = None,
+) -> str:
+    """Refine a brag document with new context, by applying edits generated by an agent.
+
+    The edits only describe what changes, so that the number of generated tokens does
+    not grow with the brag document. If the agent does not return valid edits, or if
+    they do not apply to the brag document, the brag document is rewritten instead.
+
+    Args:
+        editor_agent: The AI agent to use for generating the edits.
+        rewriter_agent: The AI agent to use for rewriting the brag document, if the
+            edits do not apply.
+        current_brag_document: A string containing the existing brag document.
+        new_context: A string of text representing the new contribution or achievement to incorporate.
+        language: The language of the brag document.
+        on_text: An optional function called with the refined brag document. It is
+            called at once when the edits apply, and piece by piece otherwise.
+
+    Returns:
+        A string containing the refined brag document.
+
+    """
+    prompt = _generate_edit_brag_document_prompt(
+        current_brag_document, new_context, language
+    )
+    try:
+        edits = await editor_agent.run_structured(prompt, BragDocumentEdits)
+        brag_document = apply_edits(current_brag_document, edits.edits)
+    except (EditError, UnexpectedModelBehavior) as error:
+        logger.warning(
+            "Rewriting the brag document, since its edits could not be applied: {error}",
+            error=error,
+        )
+        return await _update_brag_document(
+            rewriter_agent,
+            current_brag_document,
+            new_context,
+            language=language,
+            on_text=on_text,
+        )
+
+    _pass_text(on_text, brag_document)
+    return brag_document
+
+
+def _generate_edit_brag_document_prompt(
+    current_brag_document: str,
+    new_context: str,
+    language: str,
+) -> _Prompt:
+    """Generate the prompt for editing the brag document with new context.
+
+    Args:
+        current_brag_document: A string containing the existing brag document.
+        new_context: A string of text representing the new contribution or
+            achievement to incorporate.
+        language: The language of the brag document.
 
     Returns:
-        A string containing the prompt for refining the brag document.
+        The prompt for generating the edits of the brag document.
 
     """
-    return promptify(
+    return _Prompt(
+        prefix=promptify(
+            "List the edits that refine the existing brag document with the new context.",
+            "Only describe what changes, without repeating the rest of the brag document.",
+            f"Write the edits in {language}.",
+        ),
+        content=promptify(
+            """
+                Existing brag document up to this point:
+                <brag_document>
+                {brag_document}
+                </brag_document>
+
+                New context:
+                <context>
+                {context}
+                </context>
+            """
+        ).format(brag_document=current_brag_document, context=new_context),
+    )
+
+
+async def _merge_brag_documents(
+    agent: _BragAgent,
+    brag_documents: Sequence[str],
+    existing_brag_document: str | None = None,
+    *,
+    language: str,
+    on_text: Callable[[str], object] | None = None,
+) -> str:
+    """Merge partial brag documents into a single brag document.
+
+    Args:
+        agent: The AI agent to use for merging the brag documents.
+        brag_documents: The partial brag documents to merge.
+        existing_brag_document: An optional existing brag document whose structure
+            should be preserved in the merged document.
+        language: The language of the brag document.
+        on_text: An optional function called with the brag document, piece by piece,
+            as it is generated.
+
+    Returns:
+        A string containing the merged brag document.
+
+    """
+    prompt = _generate_merge_brag_documents_prompt(
+        brag_documents, existing_brag_document, language=language
+    )
+    return await agent.run(prompt, on_text=on_text)
+
+
+def _generate_merge_brag_documents_prompt(
+    brag_documents: Sequence[str],
+    existing_brag_document: str | None = None,
+    *,
+    language: str,
+) -> _Prompt:
+    """Generate the prompt for merging partial brag documents.
+
+    The existing brag document does not change during a run, so it is part of the
+    prefix of the prompt, along with the instructions.
+
+    Args:
+        brag_documents: The partial brag documents to merge.
+        existing_brag_document: An optional existing brag document whose structure
+            should be preserved in the merged document.
+        language: The language of the brag document.
+
+    Returns:
+        The prompt for merging the brag documents.
+
+    """
+    existing_brag_document_block = (
+        promptify(
+            """
+                Existing brag document:
+                <existing_brag_document>
+                {brag_document}
+                </existing_brag_document>
+            """
+        ).format(brag_document=existing_brag_document)
+        if existing_brag_document
+        else None
+    )
+    partial_brag_document_blocks = (
+        promptify(
+            """
+                <brag_document>
+                {brag_document}
+                </brag_document>
+            """
+        ).format(brag_document=brag_document)
+        for brag_document in brag_documents
+    )
+    return _Prompt(
+        prefix=promptify(
+            "Produce a single brag document by merging the following brag documents.",
+            (
+                "Merge the partial brag documents into the existing brag document."
+                if existing_brag_document
+                else "Merge the partial brag documents."
+            ),
+            f"Generate the brag document in {language}.",
+            existing_brag_document_block,
+        ),
+        content=promptify("Partial brag documents:", *partial_brag_document_blocks),
+    )
+
+
+async def _extract_achievements(
+    agent: _BragAgent,
+    chunk: str,
+    *,
+    language: str,
+) -> list[Achievement]:
+    """Extract the achievements of a chunk.
+
+    Args:
+        agent: The AI agent to use for extracting the achievements.
+        chunk: A string of text representing contributions or achievements.
+        language: The language of the brag document.
+
+    Returns:
+        The achievements found in the chunk.
+
+    Raises:
+        UnexpectedModelBehavior: If the agent does not return valid achievements.
+    """
+    prompt = _generate_extract_achievements_prompt(chunk, language)
+    extracted = await agent.run_structured(prompt, ExtractedAchievements)
+    return extracted.achievements
+
+
+def _generate_extract_achievements_prompt(chunk: str, language: str) -> _Prompt:
+    """Generate the prompt for extracting the achievements of a chunk.
+
+    Args:
+        chunk: A string of text representing contributions or achievements.
+        language: The language of the brag document.
+
+    Returns:
+        The prompt for extracting the achievements.
+
+    """
+    return _Prompt(
+        prefix=promptify(
+            "Extract the achievements from the following context.",
+            f"Write the titles and the impacts of the achievements in {language}.",
+        ),
+        content=promptify(
+            """
+                <context>
+                {context}
+                </context>
+            """
+        ).format(context=chunk),
+    )
+
+
+async def _render_brag_document(
+    agent: _BragAgent,
+    achievements: Sequence[Achievement],
+    existing_brag_document: str | None = None,
+    *,
+    language: str,
+    on_text: Callable[[str], object] | None = None,
+) -> str:
+    """Write a brag document from a list of achievements.
+
+    Args:
+        agent: The AI agent to use for writing the brag document.
+        achievements: The achievements to write the brag document from.
+        existing_brag_document: An optional existing brag document to weave the
+            achievements into.
+        language: The language of the brag document.
+        on_text: An optional function called with the brag document, piece by piece,
+            as it is generated.
+
+    Returns:
+        A string containing the brag document.
+
+    """
+    prompt = _generate_render_brag_document_prompt(
+        achievements, existing_brag_document, language=language
+    )
+    return await agent.run(prompt, on_text=on_text)
+
+
+def _generate_render_brag_document_prompt(
+    achievements: Sequence[Achievement],
+    existing_brag_document: str | None = None,
+    *,
+    language: str,
+) -> _Prompt:
+    """Generate the prompt for writing a brag document from a list of achievements.
+
+    The changed files of the achievements are left out, since they were only needed to
+    find duplicate achievements.
+
+    Args:
+        achievements: The achievements to write the brag document from.
+        existing_brag_document: An optional existing brag document to weave the
+            achievements into.
+        language: The language of the brag document.
+
+    Returns:
+        The prompt for writing the brag document.
+
+    """
+    existing_brag_document_block = (
+        promptify(
+            """
+                Existing brag document:
+                <existing_brag_document>
+                {brag_document}
+                </existing_brag_document>
+            """
+        ).format(brag_document=existing_brag_document)
+        if existing_brag_document
+        else None
+    )
+    achievements_json = ExtractedAchievements(
+        achievements=list(achievements)
+    ).model_dump_json(exclude={"achievements": {"__all__": {"files"}}})
+    return _Prompt(
+        prefix=promptify(
+            "Produce a brag document from the following achievements.",
+            (
+                "Weave the achievements into the existing brag document."
+                if existing_brag_document
+                else None
+            ),
+            f"Generate the brag document in {language}.",
+            existing_brag_document_block,
+        ),
+        content=promptify(
+            """
+                Achievements:
+                <achievements>
+                {achievements}
+                </achievements>
+            """
+        ).format(achievements=achievements_json),
+    )
+
+
+@dataclass(frozen=True, slots=True)
+class _Prompt:
+    """A user prompt, laid out so that providers can cache what requests have in common.
+
+    Providers with prompt caching only reuse the longest prefix a request shares with
+    earlier ones, byte for byte. The instructions, and any content that does not change
+    during a run, therefore come first, followed by the content specific to the request.
+
+    Attributes:
+        prefix: The part of the prompt shared by the requests of a run.
+        content: The part of the prompt specific to the request.
+    """
+
+    prefix: str
+    content: str
+
+    @property
+    def text(self) -> str:
+        """The text of the prompt, as read by the model."""
+        return self.prefix + _PROMPT_PREFIX_SEPARATOR + self.content
+
+
+@dataclass(frozen=True, slots=True)
+class _BragAgent:
+    """An agent whose requests are run through a scheduler and a response cache.
+
+    Attributes:
+        model_name: The name of the AI model the agent uses.
+        system_prompt: The system prompt of the agent.
+        scheduler: The scheduler used to run the agent requests.
+        cache: An optional cache of the agent responses.
+    """
+
+    model_name: KnownModelName
+    system_prompt: str
+    scheduler: LLMScheduler
+    cache: ResponseCache | None = None
+
+    async def run(
+        self, prompt: _Prompt, *, on_text: Callable[[str], object] | None = None
+    ) -> str:
+        """Run the agent on a prompt and return its output.
+
+        If `on_text` is provided, it is called with the output, piece by piece, as it is
+        generated.
         """
-            Produce a refined brag document.
+        cache_key = ResponseCache.key(
+            self.model_name,
+            promptify(self.system_prompt),
+            prompt.text,
+            _MODEL_SETTINGS,
+        )
+        if self.cache is not None and (output := self.cache.get(cache_key)) is not None:
+            _pass_text(on_text, output)
+            return output
+
+        agent: Agent[None, str] = _build_agent_from_system_prompt(
+            self.model_name, self.system_prompt
+        )
+        result: AgentRunResult[str] | StreamedRunResult[None, str]
+        # The system prompt is sent with every request, and counts against the budgets
+        full_prompt = promptify(self.system_prompt, prompt.text)
+        token_count = self.scheduler.token_estimator.estimate(full_prompt)
+        if on_text is None:
+            result = await self.scheduler.run(
+                agent, prompt.text, token_count=token_count
+            )
+            output = result.output
+        else:
+            result = await self.scheduler.run_stream(
+                agent, prompt.text, on_text=on_text, token_count=token_count
+            )
+            output = await result.get_output()
+        # Teach the estimator how many tokens the model actually used
+        self.scheduler.token_estimator.observe(full_prompt, _input_token_count(result))
 
-            Existing brag document up to this point:
-            <brag_document>
-            {brag_document}
-            </brag_document>
+        if self.cache is not None:
+            self.cache.set(cache_key, output)
+        return output
 
-            New context:
-            <context>
-            {context}
-            </context>
+    async def run_structured[T: BaseModel](
+        self, prompt: _Prompt, output_type: type[T]
+    ) -> T:
+        """Run the agent on a prompt and return its output, validated as a model.
 
-            Given the new context, refine the original brag document.
+        Raises:
+            UnexpectedModelBehavior: If the output is still invalid after the retries
+                of the agent.
         """
-    ).format(brag_document=current_brag_document, context=new_context)
+        cache_key = ResponseCache.key(
+            self.model_name,
+            promptify(self.system_prompt),
+            prompt.text,
+            _MODEL_SETTINGS,
+            output_type.model_json_schema(),
+        )
+        if self.cache is not None and (cached := self.cache.get(cache_key)) is not None:
+            return output_type.model_validate_json(cached)
+
+        agent: Agent[None, T] = _build_agent_from_system_prompt(
+            self.model_name, self.system_prompt, output_type
+        )
+        result = await self.scheduler.run(
+            agent,
+            prompt.text,
+            token_count=self.scheduler.token_estimator.estimate(
+                promptify(self.system_prompt, prompt.text)
+            ),
+        )
+        # The usage is not reported to the token estimator, since it includes the
+        # schema of the output, which is not part of the prompt
+
+        if self.cache is not None:
+            self.cache.set(cache_key, result.output.model_dump_json())
+        return result.output
+
+
+@dataclass(frozen=True, slots=True)
+class _BragAgentFactory:
+    """Build agents from system prompts, all sharing the same model, scheduler and cache."""
+
+    model_name: KnownModelName
+    scheduler: LLMScheduler
+    cache: ResponseCache | None = None
+
+    def __call__(self, system_prompt: str) -> _BragAgent:
+        return _BragAgent(
+            model_name=self.model_name,
+            system_prompt=system_prompt,
+            scheduler=self.scheduler,
+            cache=self.cache,
+        )
+
+
+def _input_token_count(
+    result: AgentRunResult[str] | StreamedRunResult[None, str],
+) -> TokenCount:
+    """Return the number of input tokens reported by the provider for an agent run."""
+    return sum(
+        message.usage.input_tokens
+        for message in result.new_messages()
+        if isinstance(message, ModelResponse)
+    )
 
 
 @cache
 def _build_agent_from_system_prompt(
     model_name: KnownModelName,
     system_prompt: str,
-) -> Agent:
+    output_type: type[Any] = str,
+) -> Agent[None, Any]:
+    system_prompt = promptify(system_prompt)
     return Agent(
         model_name,
-        model_settings={"temperature": 0.0},
-        system_prompt=promptify(system_prompt),
+        output_type=output_type,
+        model_settings=_model_settings(model_name, system_prompt),
+        system_prompt=system_prompt,
     )
 
 
-def _head_and_tail(iterable: Iterable[_T]) -> tuple[_T, Iterator[_T]]:
-    """Return the first element of an iterable and the remaining elements, similar to `(head, *tail) = iterable`.
+def _model_settings(model_name: KnownModelName, system_prompt: str) -> ModelSettings:
+    """Return the settings of the model, with a cache breakpoint for Anthropic models.
 
-    This helper function takes an iterable and returns a tuple containing the first element and an iterator over the
-    remaining elements.
+    Unlike OpenAI and Gemini, Anthropic only caches prompts up to the blocks marked with
+    a `cache_control` breakpoint. pydantic-ai does not mark any, and its only way to do so
+    is to send the system prompt again in `extra_body`, as a marked block. The user
+    prompt is not marked, so only the system prompt is cached, and only when it is at
+    least as long as the minimum the model caches, such as 1024 tokens.
+    """
+    if not model_name.startswith(_ANTHROPIC_MODEL_PREFIX):
+        return _MODEL_SETTINGS
+    return {
+        **_MODEL_SETTINGS,
+        "extra_body": {
+            "system": [
+                {
+                    "type": "text",
+                    "text": system_prompt,
+                    "cache_control": {"type": "ephemeral"},
+                }
+            ]
+        },
+    }
 
-    Args:
-        iterable: An arbitrary iterable.
 
-    Returns:
-        A tuple `(head, tail)` containing the first element of the iterable and an iterator over
-        the remaining elements.
+def _pass_text(on_text: Callable[[str], object] | None, text: str) -> None:
+    """Pass text that did not come from a streamed LLM call to `on_text`, if any."""
+    if on_text is not None:
+        on_text(text)
 
-    Raises:
-        StopIteration: If the iterable is empty.
 
+async def _flag_last(
+    chunks: AsyncIterator[str], *, peek: bool
+) -> AsyncIterator[tuple[str, bool]]:
+    """Yield chunks along with whether each of them is known to be the last one.
+
+    The last chunk is only known if `peek` is set, in which case the next chunk is
+    awaited before yielding the current one.
     """
-    iterator = iter(iterable)
-    head = next(iterator)
-    return head, iterator
+    if not peek:
+        async for chunk in chunks:
+            yield chunk, False
+        return
+
+    chunk = await anext(chunks, None)
+    while chunk is not None:
+        next_chunk = await anext(chunks, None)
+        yield chunk, next_chunk is None
+        chunk = next_chunk
+
+
+async def _take(chunks: AsyncIterator[str], count: int) -> list[str]:
+    """Take up to `count` chunks from an asynchronous iterator."""
+    taken: list[str] = []
+    while len(taken) < count:
+        try:
+            taken.append(await anext(chunks))
+        except StopAsyncIteration:
+            break
+    return taken
+
+
+async def _chain(
+    first_chunks: Iterable[str], chunks: AsyncIterator[str]
+) -> AsyncIterator[str]:
+    """Yield the given chunks, then the chunks of an asynchronous iterator."""
+    for chunk in first_chunks:
+        yield chunk
+    async for chunk in chunks:
+        yield chunk
+
+
+async def _identity[T](value: T) -> T:
+    """Return the given value as an awaitable."""
+    return value
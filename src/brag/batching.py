@@ -1,19 +1,90 @@
 """Batch text chunks together to fit within a max tokens per batch.
 
 The max tokens per batch is expected to be a subset of the model's context window size.
+
+Several batching strategies are available:
+
+- `greedy` keeps chunks in order and closes a batch as soon as the next chunk does not fit.
+- `lookahead` also keeps batches in order, but fills the remaining room of a batch with
+  chunks from a bounded window of upcoming chunks.
+- `first-fit-decreasing` ignores the order of the chunks and packs them as tightly as
+  possible, which minimizes the number of batches.
 """
 
-from collections.abc import Iterable, Iterator
+from collections import deque
+from collections.abc import Iterable, Iterator, Sequence
+from dataclasses import dataclass, field
+from typing import Final, Literal, assert_never
 
 from brag.models import TokenCount
 from brag.text_formatters import promptify
-from brag.tokens import estimate_token_count
+from brag.tokens import DEFAULT_TOKEN_ESTIMATOR, TokenEstimator
+
+type BatchingStrategy = Literal["greedy", "lookahead", "first-fit-decreasing"]
+
+DEFAULT_BATCH_JOINER: Final = "\n\n---\n\n"
+DEFAULT_LOOKAHEAD_WINDOW: Final = 32
+
+
+def batch_chunks(
+    chunks: Iterable[str],
+    max_tokens_per_batch: TokenCount,
+    joiner: str = DEFAULT_BATCH_JOINER,
+    *,
+    strategy: BatchingStrategy = "greedy",
+    lookahead_window: int = DEFAULT_LOOKAHEAD_WINDOW,
+    token_estimator: TokenEstimator = DEFAULT_TOKEN_ESTIMATOR,
+) -> Iterator[str]:
+    """Batch text chunks together using the given strategy.
+
+    Args:
+        chunks: An iterable of strings, where each string is a chunk of text.
+        max_tokens_per_batch: The maximum number of tokens allowed per batch.
+        joiner: The string to use for joining chunks when batching them together.
+        strategy: The batching strategy. See the module documentation for details.
+        lookahead_window: The number of upcoming chunks considered when using the
+            `lookahead` strategy.
+        token_estimator: The estimator used to measure the size of the chunks.
+
+    Yields:
+        Batches of text chunks, each fitting within the max tokens per batch.
+
+    Raises:
+        ValueError: If max_tokens_per_batch is not positive.
+    """
+    match strategy:
+        case "greedy":
+            return batch_chunks_by_token_limit(
+                chunks,
+                max_tokens_per_batch,
+                joiner,
+                token_estimator=token_estimator,
+            )
+        case "lookahead":
+            return batch_chunks_with_lookahead(
+                chunks,
+                max_tokens_per_batch,
+                joiner,
+                window=lookahead_window,
+                token_estimator=token_estimator,
+            )
+        case "first-fit-decreasing":
+            return pack_chunks_first_fit_decreasing(
+                chunks,
+                max_tokens_per_batch,
+                joiner,
+                token_estimator=token_estimator,
+            )
+        case never:
+            assert_never(never)
 
 
 def batch_chunks_by_token_limit(
     chunks: Iterable[str],
     max_tokens_per_batch: TokenCount,
-    joiner: str = "\n\n---\n\n",
+    joiner: str = DEFAULT_BATCH_JOINER,
+    *,
+    token_estimator: TokenEstimator = DEFAULT_TOKEN_ESTIMATOR,
 ) -> Iterator[str]:
     """Batch text chunks together to fit within a max tokens per batch.
 
@@ -22,7 +93,9 @@ def batch_chunks_by_token_limit(
     token estimation to determine how many chunks can be combined safely.
 
     Chunks are combined with a joiner (defined by the `joiner` parameter) to help
-    distinguish between different chunks in the same batch.
+    distinguish between different chunks in the same batch. Each chunk is formatted with
+    `promptify` before being joined, and chunks that are blank after formatting are dropped.
+    A chunk that starts a new batch and ends up alone in it is yielded as is, unformatted.
 
     This batching optimizes API usage by reducing the number of calls to the LLM provider,
     which can help avoid rate limiting errors for repositories with many commits or
@@ -36,6 +109,7 @@ def batch_chunks_by_token_limit(
         chunks: An iterable of strings, where each string is a chunk of text.
         max_tokens_per_batch: The maximum number of tokens allowed per batch.
         joiner: The string to use for joining chunks when batching them together.
+        token_estimator: The estimator used to measure the size of the chunks.
 
     Yields:
         Batches of text chunks, each fitting within the max tokens per batch.
@@ -46,16 +120,24 @@ def batch_chunks_by_token_limit(
     if max_tokens_per_batch <= 0:
         raise ValueError("max_tokens_per_batch must be positive")
 
-    joiner_token_count = estimate_token_count(joiner, approximation_mode="overestimate")
-    current_batch: str = ""
+    joiner_token_count = token_estimator.estimate(joiner)
+    # Collect the formatted chunks of the current batch and join them only once the batch
+    # is complete, so that building a batch takes linear time in its size
+    current_batch: list[str] = []
     current_batch_token_count = 0
+    # The chunk that started the current batch, as long as no other chunk was added
+    lone_chunk: str | None = None
+
+    def complete_batch() -> str:
+        if lone_chunk is not None and current_batch:
+            return lone_chunk
+        return joiner.join(current_batch)
 
     for chunk in chunks:
         # Use the overestimate strategy to be conservative, that is, to ensure that the chunk
         # will fit within the max tokens per batch.
-        chunk_token_count = estimate_token_count(
-            chunk, approximation_mode="overestimate"
-        )
+        chunk_token_count = token_estimator.estimate(chunk)
+        formatted_chunk = promptify(chunk)
 
         # Only add joiner_token_count if current_batch is not empty
         additional_token_count = joiner_token_count if current_batch else 0
@@ -65,13 +147,219 @@ def batch_chunks_by_token_limit(
             current_batch_token_count + additional_token_count + chunk_token_count
             > max_tokens_per_batch
         ):
-            yield current_batch
-            current_batch = chunk
+            yield complete_batch()
+            current_batch = [formatted_chunk] if formatted_chunk else []
             current_batch_token_count = chunk_token_count
+            lone_chunk = chunk
         else:
-            current_batch = promptify(current_batch, chunk, joiner=joiner)
+            if formatted_chunk:
+                current_batch.append(formatted_chunk)
             current_batch_token_count += additional_token_count + chunk_token_count
+            lone_chunk = None
 
     # Add the last batch if it's not empty
     if current_batch:
-        yield current_batch
+        yield complete_batch()
+
+
+def batch_chunks_with_lookahead(
+    chunks: Iterable[str],
+    max_tokens_per_batch: TokenCount,
+    joiner: str = DEFAULT_BATCH_JOINER,
+    *,
+    window: int = DEFAULT_LOOKAHEAD_WINDOW,
+    token_estimator: TokenEstimator = DEFAULT_TOKEN_ESTIMATOR,
+) -> Iterator[str]:
+    """Batch text chunks in order, filling each batch with chunks from a lookahead window.
+
+    Each batch starts with the first chunk that was not batched yet. When the next chunk
+    does not fit in the batch, the following `window` chunks are scanned, in order, and
+    the ones that fit are pulled into the batch. Chunks within a batch keep their
+    relative order, and a chunk is never moved more than `window` positions earlier.
+
+    With a window of 1, this is equivalent to `batch_chunks_by_token_limit`.
+
+    Args:
+        chunks: An iterable of strings, where each string is a chunk of text.
+        max_tokens_per_batch: The maximum number of tokens allowed per batch.
+        joiner: The string to use for joining chunks when batching them together.
+        window: The maximum number of upcoming chunks considered for each batch.
+        token_estimator: The estimator used to measure the size of the chunks.
+
+    Yields:
+        Batches of text chunks, each fitting within the max tokens per batch.
+
+    Raises:
+        ValueError: If max_tokens_per_batch or window is not positive.
+    """
+    if max_tokens_per_batch <= 0:
+        raise ValueError("max_tokens_per_batch must be positive")
+    if window <= 0:
+        raise ValueError("window must be positive")
+
+    joiner_token_count = token_estimator.estimate(joiner)
+    upcoming_chunks = _prepare_chunks(chunks, token_estimator)
+    pending: deque[_Chunk] = deque()
+
+    def refill() -> None:
+        while (
+            len(pending) < window and (chunk := next(upcoming_chunks, None)) is not None
+        ):
+            pending.append(chunk)
+
+    refill()
+    while pending:
+        batch = _Batch()
+        batch.add(pending.popleft(), joiner_token_count)
+        refill()
+
+        index = 0
+        while index < len(pending):
+            if batch.fits(pending[index], joiner_token_count, max_tokens_per_batch):
+                batch.add(pending[index], joiner_token_count)
+                del pending[index]
+                refill()
+            else:
+                index += 1
+
+        yield batch.join(joiner)
+
+
+def pack_chunks_first_fit_decreasing(
+    chunks: Iterable[str],
+    max_tokens_per_batch: TokenCount,
+    joiner: str = DEFAULT_BATCH_JOINER,
+    *,
+    token_estimator: TokenEstimator = DEFAULT_TOKEN_ESTIMATOR,
+) -> Iterator[str]:
+    """Pack text chunks into as few batches as possible, regardless of their order.
+
+    Chunks are sorted from largest to smallest and each one is placed in the first batch
+    it fits in, or in a new batch if it fits in none. This first-fit-decreasing heuristic
+    never uses more than 11/9 of the optimal number of batches (plus a small constant).
+
+    Chunks keep their original relative order within each batch, and batches are ordered
+    by their earliest chunk. Since all chunks must be known before packing, the input is
+    consumed entirely before the first batch is yielded.
+
+    Args:
+        chunks: An iterable of strings, where each string is a chunk of text.
+        max_tokens_per_batch: The maximum number of tokens allowed per batch.
+        joiner: The string to use for joining chunks when batching them together.
+        token_estimator: The estimator used to measure the size of the chunks.
+
+    Yields:
+        Batches of text chunks, each fitting within the max tokens per batch.
+
+    Raises:
+        ValueError: If max_tokens_per_batch is not positive.
+    """
+    if max_tokens_per_batch <= 0:
+        raise ValueError("max_tokens_per_batch must be positive")
+
+    joiner_token_count = token_estimator.estimate(joiner)
+    batches: list[_Batch] = []
+
+    for chunk in sorted(
+        _prepare_chunks(chunks, token_estimator),
+        key=lambda chunk: chunk.token_count,
+        reverse=True,
+    ):
+        batch = next(
+            (
+                batch
+                for batch in batches
+                if batch.fits(chunk, joiner_token_count, max_tokens_per_batch)
+            ),
+            None,
+        )
+        if batch is None:
+            batch = _Batch()
+            batches.append(batch)
+        batch.add(chunk, joiner_token_count)
+
+    for batch in sorted(batches, key=lambda batch: batch.first_index):
+        yield batch.join(joiner, sort=True)
+
+
+def batch_fill_ratio(
+    batches: Sequence[str],
+    max_tokens_per_batch: TokenCount,
+    *,
+    token_estimator: TokenEstimator = DEFAULT_TOKEN_ESTIMATOR,
+) -> float:
+    """Compute how full a sequence of batches is, on average.
+
+    The fill ratio is the estimated number of tokens in all batches divided by the total
+    capacity of the batches. The closer it is to 1, the fewer batches are wasted. It may
+    exceed 1 if some chunks are larger than the max tokens per batch on their own.
+
+    Args:
+        batches: The batches to measure.
+        max_tokens_per_batch: The maximum number of tokens allowed per batch.
+        token_estimator: The estimator used to measure the size of the batches.
+
+    Returns:
+        The fill ratio of the batches, or 0 if there are no batches.
+    """
+    if not batches:
+        return 0.0
+    token_count = sum(map(token_estimator.estimate, batches))
+    return token_count / (len(batches) * max_tokens_per_batch)
+
+
+@dataclass(frozen=True, slots=True)
+class _Chunk:
+    index: int
+    text: str
+    token_count: TokenCount
+
+
+@dataclass(slots=True)
+class _Batch:
+    chunks: list[_Chunk] = field(default_factory=list)
+    token_count: TokenCount = 0
+
+    @property
+    def first_index(self) -> int:
+        return min(chunk.index for chunk in self.chunks)
+
+    def fits(
+        self,
+        chunk: _Chunk,
+        joiner_token_count: TokenCount,
+        max_tokens_per_batch: TokenCount,
+    ) -> bool:
+        # Chunks larger than the max tokens per batch get a batch of their own
+        additional_token_count = joiner_token_count if self.chunks else 0
+        return (
+            not self.chunks
+            or self.token_count + additional_token_count + chunk.token_count
+            <= max_tokens_per_batch
+        )
+
+    def add(self, chunk: _Chunk, joiner_token_count: TokenCount) -> None:
+        if self.chunks:
+            self.token_count += joiner_token_count
+        self.chunks.append(chunk)
+        self.token_count += chunk.token_count
+
+    def join(self, joiner: str, *, sort: bool = False) -> str:
+        chunks = (
+            sorted(self.chunks, key=lambda chunk: chunk.index) if sort else self.chunks
+        )
+        return joiner.join(chunk.text for chunk in chunks)
+
+
+def _prepare_chunks(
+    chunks: Iterable[str],
+    token_estimator: TokenEstimator,
+) -> Iterator[_Chunk]:
+    """Format chunks with `promptify` and estimate their size, dropping blank chunks."""
+    for index, chunk in enumerate(chunks):
+        if text := promptify(chunk):
+            yield _Chunk(
+                index=index,
+                text=text,
+                token_count=token_estimator.estimate(chunk),
+            )
@@ -0,0 +1,215 @@
+"""Persist LLM responses on disk to avoid paying for identical requests twice.
+
+Responses are stored in a SQLite database and addressed by a hash of everything that
+determines them: the model name, the system prompt, the user prompt and the model
+settings. Entries are evicted when they get too old, or when the cache grows too large,
+in which case the least recently used entries are evicted first.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Mapping
+from datetime import timedelta
+from pathlib import Path
+from types import TracebackType
+from typing import Any, Final, Self
+
+DEFAULT_MAX_CACHE_SIZE_BYTES: Final = 512 * 1024 * 1024
+DEFAULT_MAX_CACHE_AGE: Final = timedelta(days=30)
+
+_RESPONSE_CACHE_FILE_NAME: Final = "responses.sqlite3"
+
+
+def default_cache_dir() -> Path:
+    """Return the default directory for Brag AI's caches.
+
+    This follows the XDG base directory specification, falling back to `~/.cache/brag`.
+    """
+    xdg_cache_home = os.environ.get("XDG_CACHE_HOME")
+    base_dir = Path(xdg_cache_home) if xdg_cache_home else Path.home() / ".cache"
+    return base_dir / "brag"
+
+
+class ResponseCache:
+    """A persistent, content-addressed cache of LLM responses.
+
+    Attributes:
+        path: The path to the SQLite database file.
+        max_size_bytes: The maximum total size of the cached responses. If None, the
+            cache size is unbounded.
+        max_age: The maximum age of a cached response. If None, responses never expire.
+        hits: The number of lookups served from the cache since it was opened.
+        misses: The number of lookups not found in the cache since it was opened.
+
+    The cache can be shared between threads.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        *,
+        max_size_bytes: int | None = DEFAULT_MAX_CACHE_SIZE_BYTES,
+        max_age: timedelta | None = DEFAULT_MAX_CACHE_AGE,
+    ) -> None:
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        # Serialize the transactions of the threads sharing the connection
+        self._lock = threading.RLock()
+        with self._connection:
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)"
+            )
+
+    @classmethod
+    def in_directory(
+        cls,
+        cache_dir: Path,
+        *,
+        max_size_bytes: int | None = DEFAULT_MAX_CACHE_SIZE_BYTES,
+        max_age: timedelta | None = DEFAULT_MAX_CACHE_AGE,
+    ) -> Self:
+        """Open the response cache stored in the given cache directory."""
+        return cls(
+            cache_dir / _RESPONSE_CACHE_FILE_NAME,
+            max_size_bytes=max_size_bytes,
+            max_age=max_age,
+        )
+
+    @staticmethod
+    def key(
+        model_name: str,
+        system_prompt: str,
+        user_prompt: str,
+        model_settings: Mapping[str, Any] | None = None,
+        output_schema: Mapping[str, Any] | None = None,
+    ) -> str:
+        """Compute the cache key of a request.
+
+        The JSON schema of structured outputs is only part of the key when provided, so
+        that the keys of text requests do not depend on it.
+        """
+        payload = json.dumps(
+            {
+                "model_name": model_name,
+                "system_prompt": system_prompt,
+                "user_prompt": user_prompt,
+                "model_settings": dict(model_settings or {}),
+                **(
+                    {"output_schema": dict(output_schema)}
+                    if output_schema is not None
+                    else {}
+                ),
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        """Return the cached response for a key, or None if there is no fresh entry."""
+        with self._lock:
+            now = time.time()
+            row = self._connection.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None or self._is_expired(row[1], now):
+                self.misses += 1
+                return None
+
+            with self._connection:
+                self._connection.execute(
+                    "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+                )
+            self.hits += 1
+            value: str = row[0]
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        """Store the response for a key, evicting old entries if needed."""
+        with self._lock:
+            now = time.time()
+            with self._connection:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (key, value, len(value.encode()), now, now),
+                )
+            self.evict()
+
+    def evict(self) -> int:
+        """Evict expired entries, then least recently used ones until the cache fits its size limit.
+
+        Returns:
+            The number of evicted entries.
+        """
+        with self._lock:
+            evicted = 0
+            with self._connection:
+                if self.max_age is not None:
+                    cutoff = time.time() - self.max_age.total_seconds()
+                    evicted += self._connection.execute(
+                        "DELETE FROM responses WHERE created_at < ?", (cutoff,)
+                    ).rowcount
+
+                if self.max_size_bytes is not None:
+                    # Keep the most recently used entries whose cumulative size fits the limit
+                    evicted += self._connection.execute(
+                        """
+                        DELETE FROM responses WHERE key IN (
+                            SELECT key FROM (
+                                SELECT
+                                    key,
+                                    SUM(size) OVER (ORDER BY accessed_at DESC, key) AS cumulative_size
+                                FROM responses
+                            )
+                            WHERE cumulative_size > ?
+                        )
+                        """,
+                        (self.max_size_bytes,),
+                    ).rowcount
+            return evicted
+
+    def close(self) -> None:
+        """Close the underlying database connection."""
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return (
+            self.max_age is not None and now - created_at > self.max_age.total_seconds()
+        )
@@ -0,0 +1,138 @@
+"""Persist the progress of brag document generation runs so that they can be resumed.
+
+A checkpoint records the brag document generated so far and how many chunks were
+already incorporated into it. Checkpoint files are keyed by a fingerprint of the run
+inputs, and each checkpoint also stores a digest of the chunks it covers, so that a run
+is only resumed if it is fed the same chunks again.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Final, Self
+
+from loguru import logger
+from pydantic import BaseModel
+
+INITIAL_CHUNKS_DIGEST: Final = ""
+
+_CHECKPOINTS_DIR_NAME: Final = "checkpoints"
+
+
+class Checkpoint(BaseModel):
+    """A snapshot of a brag document generation run.
+
+    Attributes:
+        fingerprint: The fingerprint of the run inputs.
+        completed_chunks: The number of chunks already incorporated into the brag document.
+        chunks_digest: A digest of the completed chunks. See `chain_chunks_digest`.
+        brag_document: The brag document generated from the completed chunks.
+    """
+
+    fingerprint: str
+    completed_chunks: int
+    chunks_digest: str
+    brag_document: str
+
+
+class CheckpointFile:
+    """A file storing the latest checkpoint of a run.
+
+    Attributes:
+        path: The path to the checkpoint file.
+        fingerprint: The fingerprint of the run inputs.
+        latest: The latest checkpoint saved or loaded, if any.
+    """
+
+    def __init__(self, path: Path, fingerprint: str) -> None:
+        self.path = path
+        self.fingerprint = fingerprint
+        self.latest: Checkpoint | None = None
+
+    @classmethod
+    def in_directory(cls, cache_dir: Path, fingerprint: str) -> Self:
+        """Return the checkpoint file for a run fingerprint in the given cache directory."""
+        return cls(
+            cache_dir / _CHECKPOINTS_DIR_NAME / f"{fingerprint}.json", fingerprint
+        )
+
+    def load(self) -> Checkpoint | None:
+        """Load the checkpoint from disk.
+
+        A checkpoint that cannot be read, for example because it was truncated, is
+        ignored with a warning, so that the run starts over instead of failing.
+
+        Returns:
+            The saved checkpoint, or None if there is no valid checkpoint for this
+            fingerprint.
+        """
+        try:
+            checkpoint = Checkpoint.model_validate_json(self.path.read_text())
+        except FileNotFoundError:
+            return None
+        except ValueError as error:
+            # Includes the validation errors of malformed checkpoints
+            logger.warning(
+                "Ignoring the invalid checkpoint `{path}`: {error}",
+                path=self.path,
+                error=error,
+            )
+            return None
+
+        if checkpoint.fingerprint != self.fingerprint:
+            return None
+
+        self.latest = checkpoint
+        return checkpoint
+
+    def save(
+        self,
+        *,
+        completed_chunks: int,
+        chunks_digest: str,
+        brag_document: str,
+    ) -> None:
+        """Atomically save a new checkpoint, replacing the previous one."""
+        checkpoint = Checkpoint(
+            fingerprint=self.fingerprint,
+            completed_chunks=completed_chunks,
+            chunks_digest=chunks_digest,
+            brag_document=brag_document,
+        )
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = self.path.with_suffix(".tmp")
+        temporary_path.write_text(checkpoint.model_dump_json())
+        os.replace(temporary_path, self.path)
+        self.latest = checkpoint
+
+    def clear(self) -> None:
+        """Delete the checkpoint file, if it exists."""
+        self.path.unlink(missing_ok=True)
+        self.latest = None
+
+
+def fingerprint_run(**inputs: object) -> str:
+    """Compute a fingerprint of the inputs of a run.
+
+    Args:
+        **inputs: The inputs that determine the result of the run. Values must be JSON
+            serializable or convertible to strings.
+
+    Returns:
+        A hexadecimal digest identifying the run inputs.
+    """
+    payload = json.dumps(inputs, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def chain_chunks_digest(previous_digest: str, chunk: str) -> str:
+    """Extend a digest of a sequence of chunks with one more chunk.
+
+    Starting from `INITIAL_CHUNKS_DIGEST`, folding this function over a sequence of
+    chunks yields a digest that identifies the whole sequence, in order.
+    """
+    chunk_digest = hashlib.sha256(chunk.encode()).hexdigest()
+    return hashlib.sha256(f"{previous_digest}:{chunk_digest}".encode()).hexdigest()
@@ -5,21 +5,40 @@ from their GitHub contributions.
 """
 
 import json
+import os
+import sys
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from contextlib import aclosing, contextmanager
+from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Annotated, Literal
+from typing import Annotated, Literal, Self, assert_never
 
 import cyclopts
 from dateparser import parse as parse_datetime
-from github import Github
 from github.Auth import Token
 from loguru import logger
 from rich.console import Console
 from rich.table import Table
 
 from brag import __version__
-from brag.agents import generate_brag_document
-from brag.batching import batch_chunks_by_token_limit
+from brag.agents import (
+    MIN_MERGE_ARITY,
+    GenerationStrategy,
+    RenderMode,
+    UpdateMode,
+    generate_brag_document,
+)
+from brag.batching import BatchingStrategy, batch_chunks
+from brag.cache import ResponseCache, default_cache_dir
+from brag.checkpoints import CheckpointFile, fingerprint_run
+from brag.dedup import PatchId, deduplicate_commits
+from brag.github_client import (
+    GITHUB_RESPONSE_CACHE_FILE_NAME,
+    GithubCacheStats,
+    GithubRateLimiter,
+    open_github_client,
+)
 from brag.models import (
     KNOWN_CONTEXT_WINDOW_SIZES,
     KNOWN_REQUIRED_ENV_VARS,
@@ -28,13 +47,50 @@ from brag.models import (
     TokenCount,
     iter_pydantic_ai_model_full_names,
 )
-from brag.progress import track_iterable_progress
+from brag.pipeline import iterate_in_thread
+from brag.progress import (
+    progress_display,
+    track_async_iterable_progress,
+    track_iterable_progress,
+)
 from brag.repository import GitHubRepoURL, RepoFullName, RepoReference
-from brag.sources import DataSource
-from brag.sources.git_commits import GitCommit, GitCommitsSource
-from brag.sources.github_commits import FormattedGithubCommit, GithubCommitsSource
+from brag.scheduling import LLMScheduler
+from brag.sources import CommitRef, DataSource
+from brag.sources.git_commits import (
+    GIT_COMMIT_SPLITTERS,
+    GitCommit,
+    GitCommitsSource,
+)
+from brag.sources.github_commits import (
+    GITHUB_COMMIT_SPLITTERS,
+    FormattedGithubCommit,
+    GithubApi,
+    GithubCommitsSource,
+    github_commit_patch_id,
+)
+from brag.sources.path_filters import DEFAULT_EXCLUDED_PATHS, PathFilter
+from brag.splitting import ChunkSplitter, split_oversized_chunks
+from brag.state import (
+    BragDocumentState,
+    SourceState,
+    load_state,
+    save_state,
+    source_key,
+    state_path_for,
+)
+from brag.tokens import (
+    DEFAULT_SAFETY_QUANTILE,
+    CalibratedTokenEstimator,
+    HeuristicTokenEstimator,
+    TokenEstimator,
+    TokenEstimatorKind,
+)
 
 COMMIT_BATCH_JOINER = "\n\n---\n\n"
+# The number of batches extracted ahead of the model calls
+_MAX_PENDING_BATCHES = 4
+# The suffix of the file the partial brag document of an interrupted run is saved to
+_PARTIAL_OUTPUT_SUFFIX = ".partial"
 
 app = cyclopts.App(
     console=Console(),
@@ -53,10 +109,12 @@ app = cyclopts.App(
 inputs_group = cyclopts.Group("Inputs")
 outputs_group = cyclopts.Group("Outputs")
 model_group = cyclopts.Group("Model")
+rate_limits_group = cyclopts.Group("Rate limits")
+cache_group = cyclopts.Group("Cache")
 
 
 @app.command
-async def from_repo(  # noqa: PLR0912 # Ignore this for now - we need to refactor the command to simplify the code
+async def from_repo(  # noqa: PLR0912, PLR0915 # Ignore this for now - we need to refactor the command to simplify the code
     repo_full_name: Annotated[
         RepoFullName | GitHubRepoURL,
         cyclopts.Parameter(
@@ -127,6 +185,59 @@ async def from_repo(  # noqa: PLR0912 # Ignore this for now - we need to refacto
             ),
         ),
     ] = "error",
+    incremental: Annotated[
+        bool,
+        cyclopts.Parameter(
+            help=(
+                "Update the brag document at ``--output`` with the commits made since the last run."
+                " The last processed commit of each repository and user is recorded in a"
+                " ``<output>.brag-state.json`` file next to the output."
+            ),
+            group=inputs_group,
+        ),
+    ] = False,
+    include: Annotated[
+        tuple[str, ...],
+        cyclopts.Parameter(
+            help=(
+                "Only include the diffs of the files matching these ``.gitattributes``-style patterns."
+                " Other changed files are listed with their line counts, without their diff."
+            ),
+            group=inputs_group,
+        ),
+    ] = (),
+    exclude: Annotated[
+        tuple[str, ...],
+        cyclopts.Parameter(
+            help=(
+                "Omit the diffs of the files matching these ``.gitattributes``-style patterns,"
+                " in addition to the default excluded paths."
+                " Files marked as ``linguist-generated``, ``linguist-vendored``, ``binary``"
+                " or ``-diff`` in the repository's ``.gitattributes`` are also excluded."
+            ),
+            group=inputs_group,
+        ),
+    ] = (),
+    default_excludes: Annotated[
+        bool,
+        cyclopts.Parameter(
+            help=(
+                "Omit the diffs of lockfiles, minified bundles, snapshots and vendored"
+                " dependencies. Use ``--no-default-excludes`` to include them."
+            ),
+            group=inputs_group,
+        ),
+    ] = True,
+    deduplicate: Annotated[
+        bool,
+        cyclopts.Parameter(
+            help=(
+                "Drop the commits whose changes were already seen, such as cherry-picks,"
+                " and the commits reverted by each other, before sending them to the model."
+            ),
+            group=inputs_group,
+        ),
+    ] = False,
     github_api_token: Annotated[
         str | None,
         cyclopts.Parameter(
@@ -137,6 +248,38 @@ async def from_repo(  # noqa: PLR0912 # Ignore this for now - we need to refacto
             group=inputs_group,
         ),
     ] = None,
+    github_api: Annotated[
+        GithubApi,
+        cyclopts.Parameter(
+            help=(
+                "The GitHub API used to list commits."
+                " ``graphql`` lists 100 commits per request instead of 30, and does not fetch the commits"
+                " that change no files or more lines than ``--github-max-diff-lines``."
+                " Every other commit is still fetched on its own, as with ``rest``. It requires ``--github-api-token``."
+            ),
+            group=inputs_group,
+        ),
+    ] = "rest",
+    github_concurrency: Annotated[
+        int,
+        cyclopts.Parameter(
+            help="The maximum number of commits fetched concurrently from GitHub.",
+            group=inputs_group,
+            validator=cyclopts.validators.Number(gte=1),
+        ),
+    ] = 4,
+    github_max_diff_lines: Annotated[
+        int | None,
+        cyclopts.Parameter(
+            help=(
+                "Omit the diffs of the commits adding and deleting more lines than this,"
+                " and summarize them by the number of files and lines they change."
+                " With ``--github-api graphql``, such commits are not fetched from GitHub."
+            ),
+            group=inputs_group,
+            validator=cyclopts.validators.Number(gte=0),
+        ),
+    ] = None,
     output: Annotated[
         Path | None,
         cyclopts.Parameter(
@@ -199,6 +342,160 @@ async def from_repo(  # noqa: PLR0912 # Ignore this for now - we need to refacto
             group=model_group,
         ),
     ] = None,
+    token_estimation: Annotated[
+        TokenEstimatorKind,
+        cyclopts.Parameter(
+            help=(
+                "How the number of tokens in commits and prompts is estimated."
+                " If set to `heuristic`, fixed characters-per-token ratios are used."
+                " If set to `calibrated`, the ratios are learned from the token usage reported by the model provider"
+                " and stored in the cache directory, falling back to the heuristic until enough usage has been observed."
+                " Calibrated estimates fill batches closer to the context window, but batch boundaries change as they are learned."
+            ),
+            group=model_group,
+        ),
+    ] = "heuristic",
+    token_safety_quantile: Annotated[
+        float,
+        cyclopts.Parameter(
+            help=(
+                "The fraction (0.0 to 1.0) of past requests whose token usage calibrated estimates must cover."
+                " Higher values are more conservative."
+            ),
+            group=model_group,
+            validator=cyclopts.validators.Number(gt=0.0, lte=1.0),
+        ),
+    ] = DEFAULT_SAFETY_QUANTILE,
+    batching: Annotated[
+        BatchingStrategy,
+        cyclopts.Parameter(
+            help=(
+                "How commits are packed into batches."
+                " If set to `greedy`, commits are batched in order and a batch is closed as soon as the next commit does not fit."
+                " If set to `lookahead`, batches stay in order but are filled with commits from a small window of upcoming commits."
+                " If set to `first-fit-decreasing`, commits are packed into as few batches as possible regardless of their order,"
+                " which minimizes the number of model calls and is best suited for the `tree` strategy."
+            ),
+            group=model_group,
+        ),
+    ] = "greedy",
+    strategy: Annotated[
+        GenerationStrategy,
+        cyclopts.Parameter(
+            help=(
+                "How the commit batches are combined into the brag document."
+                " If set to `refine`, the document is refined with one batch at a time, sequentially."
+                " If set to `tree`, every batch is summarized concurrently and the partial documents are merged"
+                " until a single one remains, which is much faster for long histories."
+                " If set to `extract`, the achievements of every batch are extracted concurrently,"
+                " duplicate achievements are removed, and the document is written from them at once,"
+                " which makes the fewest and smallest model calls."
+            ),
+            group=model_group,
+        ),
+    ] = "refine",
+    merge_arity: Annotated[
+        int,
+        cyclopts.Parameter(
+            help="The number of partial brag documents merged by each model call when using the `tree` strategy.",
+            group=model_group,
+            validator=cyclopts.validators.Number(gte=MIN_MERGE_ARITY),
+        ),
+    ] = 2,
+    update_mode: Annotated[
+        UpdateMode,
+        cyclopts.Parameter(
+            help=(
+                "How the brag document is refined with each batch when using the `refine` strategy."
+                " If set to `rewrite`, the model rewrites the whole document."
+                " If set to `edits`, the model only lists the edits to make, such as bullet points to insert,"
+                " which keeps every model call fast as the document grows."
+                " The document is rewritten whenever the edits do not apply."
+            ),
+            group=model_group,
+        ),
+    ] = "rewrite",
+    render: Annotated[
+        RenderMode,
+        cyclopts.Parameter(
+            help=(
+                "How the achievements are written into the brag document when using the `extract` strategy."
+                " If set to `model`, the model writes the document in a single call."
+                " If set to `template`, every achievement is listed in its own section, without any model call."
+            ),
+            group=model_group,
+        ),
+    ] = "model",
+    max_concurrency: Annotated[
+        int,
+        cyclopts.Parameter(
+            help=(
+                "The maximum number of model requests to run at the same time."
+                " The limit is automatically reduced when the provider reports rate limiting or overload errors."
+            ),
+            group=rate_limits_group,
+            validator=cyclopts.validators.Number(gte=1),
+        ),
+    ] = 8,
+    requests_per_minute: Annotated[
+        int | None,
+        cyclopts.Parameter(
+            help="The maximum number of model requests per minute allowed by the provider.",
+            group=rate_limits_group,
+            validator=cyclopts.validators.Number(gte=1),
+        ),
+    ] = None,
+    tokens_per_minute: Annotated[
+        int | None,
+        cyclopts.Parameter(
+            help="The maximum number of input tokens per minute allowed by the provider.",
+            group=rate_limits_group,
+            validator=cyclopts.validators.Number(gte=1),
+        ),
+    ] = None,
+    use_cache: Annotated[
+        bool,
+        cyclopts.Parameter(
+            name="--cache",
+            help=(
+                "Whether to cache model responses on disk."
+                " Cached responses are reused when the same model is given the same prompts again."
+            ),
+            group=cache_group,
+        ),
+    ] = True,
+    use_github_cache: Annotated[
+        bool,
+        cyclopts.Parameter(
+            name="--github-cache",
+            help=(
+                "Whether to cache GitHub API responses on disk."
+                " Commits are then served from disk, and other responses are revalidated"
+                " with conditional requests, which do not count against the rate limit."
+            ),
+            group=cache_group,
+        ),
+    ] = True,
+    cache_dir: Annotated[
+        Path | None,
+        cyclopts.Parameter(
+            help=(
+                "The directory to store cached model responses in."
+                " Defaults to ``$XDG_CACHE_HOME/brag`` or ``~/.cache/brag``."
+            ),
+            group=cache_group,
+        ),
+    ] = None,
+    resume: Annotated[
+        bool,
+        cyclopts.Parameter(
+            help=(
+                "Resume an interrupted run of the same command instead of starting over."
+                " Progress is checkpointed in the cache directory after every batch when using the `refine` strategy."
+            ),
+            group=cache_group,
+        ),
+    ] = False,
 ) -> None:
     """Generate a brag document from a GitHub repository.
 
@@ -218,18 +515,37 @@ async def from_repo(  # noqa: PLR0912 # Ignore this for now - we need to refacto
     how conservative this batching should be by reserving a portion of the model's
     context window as a safety buffer.
     """
-    if output is not None and output.exists() and on_existing_output == "error":
+    if incremental:
+        _check_incremental_options(output=output, limit=limit)
+
+    if (
+        output is not None
+        and output.exists()
+        and on_existing_output == "error"
+        and not incremental
+    ):
         raise FileExistsError(
             f"Output file `{output}` already exists. Use `--on-existing-output overwrite` to overwrite."
         )
 
     if not author and not github_api_token:
         raise ValueError("Either `user` or `github_api_token` must be provided")
+    if github_api == "graphql" and not github_api_token:
+        raise ValueError("`--github-api graphql` requires `--github-api-token`")
 
     # Resolve inputs
     model = Model.from_full_name(model_name)
     context_window_size = _resolve_context_window_size(context_window_size, model)
     max_tokens_per_batch = int(context_window_size * (1 - buffer_ratio))
+    token_estimator = _build_token_estimator(
+        token_estimation,
+        cache_dir,
+        model.full_name,
+        safety_quantile=token_safety_quantile,
+    )
+    path_filter = _build_path_filter(
+        include, exclude, default_excludes=default_excludes
+    )
     from_date = _maybe_parse_datetime(from_date_str)
     to_date = _maybe_parse_datetime(to_date_str)
 
@@ -255,93 +571,154 @@ async def from_repo(  # noqa: PLR0912 # Ignore this for now - we need to refacto
     else:
         repo = RepoReference.from_repo_full_name(repo_full_name)
 
-    with Github(auth=Token(github_api_token) if github_api_token else None) as g:
+    # Pace requests from the quota reported by GitHub, instead of failing once it is exhausted
+    github_rate_limiter = GithubRateLimiter()
+    with (
+        _maybe_open_github_cache(use_github_cache, cache_dir) as (
+            github_cache,
+            github_cache_stats,
+        ),
+        open_github_client(
+            auth=Token(github_api_token) if github_api_token else None,
+            # Keep a connection per concurrent request
+            pool_size=github_concurrency,
+            cache=github_cache,
+            stats=github_cache_stats,
+            rate_limiter=github_rate_limiter,
+        ) as g,
+    ):
         if not author:
             author = g.get_user().login
 
-        github_commits: DataSource[FormattedGithubCommit] = GithubCommitsSource(
+        incremental_state = (
+            _IncrementalState.load(output, source_key("github", repo.full_name, author))
+            if incremental and output is not None
+            else None
+        )
+
+        github_commits_source = GithubCommitsSource(
             github=g,
             author=author,
             repo=repo,
             from_date=from_date,
             to_date=to_date,
+            after_commit=incremental_state.after_commit if incremental_state else None,
+            path_filter=path_filter,
+            api=github_api,
+            max_diff_lines=github_max_diff_lines,
+            max_concurrent_requests=github_concurrency,
         )
+        github_commits: DataSource[FormattedGithubCommit] = github_commits_source
         if limit:
             github_commits = github_commits.limit(limit)
 
-        commits_count = len(github_commits)
+        # Only estimate the number of commits, so that listing them does not delay the
+        # processing of the first ones
+        commits_count = github_commits.length_hint()
 
-        if not commits_count:
+        if commits_count == 0:
+            if incremental_state is not None and incremental_state.after_commit:
+                logger.info(
+                    "No new commits since {sha}. The brag document is up to date.",
+                    sha=incremental_state.after_commit.sha,
+                )
+                return
             raise ValueError("No commits found for the given repository and date range")
 
+        latest_commit = github_commits_source.latest_commit()
+
         logger.info(
             "Processing {commits} for {author} in {repo}",
-            commits=(
-                f"{commits_count} commits"
-                if commits_count > 1
-                else f"{commits_count} commit"
-            ),
+            commits=_describe_commits_count(commits_count),
             author=author,
             repo=repo.full_name,
         )
 
-        # Batch chunks to respect rate limits
-        batched_chunks = tuple(
-            batch_chunks_by_token_limit(
-                track_iterable_progress(
-                    github_commits,
-                    description="Batching commits",
-                ),
-                max_tokens_per_batch=max_tokens_per_batch,
-                joiner=COMMIT_BATCH_JOINER,
-            )
+        # Read existing brag document if provided
+        if (
+            incremental
+            and input_brag_document_path is None
+            and output is not None
+            and output.exists()
+        ):
+            input_brag_document_path = output
+
+        input_brag_document: str | None = None
+        if input_brag_document_path:
+            try:
+                input_brag_document = input_brag_document_path.read_text()
+            except FileNotFoundError:
+                if on_missing_input_brag_document == "error":
+                    raise FileNotFoundError(
+                        f"Input brag document `{input_brag_document_path}` does not exist."
+                    )
+                else:
+                    logger.warning(
+                        "Input brag document `{path}` does not exist. Generating new brag document.",
+                        path=input_brag_document_path,
+                    )
+
+        checkpoint = _open_checkpoint(
+            cache_dir,
+            resume=resume,
+            command="from-repo",
+            repo=repo.full_name,
+            author=author,
+            from_date=from_date_str,
+            to_date=to_date_str,
+            limit=limit,
+            input_brag_document_path=input_brag_document_path,
+            model=model.full_name,
+            language=language,
+            max_tokens_per_batch=max_tokens_per_batch,
+            batching=batching,
+            path_filter=path_filter,
+            strategy=strategy,
+            update_mode=update_mode,
+            render=render,
+            deduplicate=deduplicate,
         )
 
-    logger.info(
-        "Batched {commits} into {batches} for more efficient processing",
-        commits=(
-            f"{commits_count} commits"
-            if commits_count > 1
-            else f"{commits_count} commit"
-        ),
-        batches=(
-            f"{batch_count} batches"
-            if (batch_count := len(batched_chunks)) > 1
-            else f"{batch_count} batch"
-        ),
-    )
-
-    # Read existing brag document if provided
-    input_brag_document: str | None = None
-    if input_brag_document_path:
-        try:
-            input_brag_document = input_brag_document_path.read_text()
-        except FileNotFoundError:
-            if on_missing_input_brag_document == "error":
-                raise FileNotFoundError(
-                    f"Input brag document `{input_brag_document_path}` does not exist."
-                )
-            else:
-                logger.warning(
-                    "Input brag document `{path}` does not exist. Generating new brag document.",
-                    path=input_brag_document_path,
-                )
-
-    brag_document = await generate_brag_document(
-        # TODO: fix the type error here
-        # We're temporarily using a string here, but it should be a Literal
-        # of KnownModelName
-        model_name,  # type: ignore
-        track_iterable_progress(batched_chunks, description="Processing batches"),
-        language=language,
-        input_brag_document=input_brag_document,
-    )
-
-    # Open the output file if specified, otherwise use stdout
-    if output:
-        output.write_text(brag_document)
-    else:
-        print(brag_document)
+        with (
+            _maybe_open_response_cache(use_cache, cache_dir) as response_cache,
+            _flush_partial_brag_document_on_interruption(checkpoint, output),
+            _open_output(output) as write_output,
+        ):
+            # Commits are extracted and batched while the first batches are processed,
+            # and the brag document is written out as the final model call generates it
+            await _generate_brag_document_from_commits(
+                model_name,
+                github_commits,
+                commits_count=commits_count,
+                splitters=GITHUB_COMMIT_SPLITTERS,
+                patch_id=github_commit_patch_id if deduplicate else None,
+                max_tokens_per_batch=max_tokens_per_batch,
+                batching=batching,
+                token_estimator=token_estimator,
+                status=github_rate_limiter.describe,
+                language=language,
+                input_brag_document=input_brag_document,
+                strategy=strategy,
+                merge_arity=merge_arity,
+                update_mode=update_mode,
+                render_mode=render,
+                scheduler=LLMScheduler(
+                    max_concurrency,
+                    requests_per_minute=requests_per_minute,
+                    tokens_per_minute=tokens_per_minute,
+                    token_estimator=token_estimator,
+                ),
+                cache=response_cache,
+                checkpoint=checkpoint,
+                on_text=write_output,
+            )
+    # Record the processed commits as soon as the output is replaced, so that the next
+    # incremental run does not process them again on top of the output
+    if incremental_state is not None and latest_commit is not None:
+        incremental_state.save(latest_commit)
+    checkpoint.clear()
+    # Only learn from completed runs, so that resumed runs batch commits the same way
+    token_estimator.save()
 
 
 @app.command
@@ -412,6 +789,71 @@ async def from_local(
             ),
         ),
     ] = "error",
+    incremental: Annotated[
+        bool,
+        cyclopts.Parameter(
+            help=(
+                "Update the brag document at ``--output`` with the commits made since the last run."
+                " The last processed commit of each repository and user is recorded in a"
+                " ``<output>.brag-state.json`` file next to the output."
+            ),
+            group=inputs_group,
+        ),
+    ] = False,
+    include: Annotated[
+        tuple[str, ...],
+        cyclopts.Parameter(
+            help=(
+                "Only include the diffs of the files matching these ``.gitattributes``-style patterns."
+                " Other changed files are listed with their line counts, without their diff."
+            ),
+            group=inputs_group,
+        ),
+    ] = (),
+    exclude: Annotated[
+        tuple[str, ...],
+        cyclopts.Parameter(
+            help=(
+                "Omit the diffs of the files matching these ``.gitattributes``-style patterns,"
+                " in addition to the default excluded paths."
+                " Files marked as ``linguist-generated``, ``linguist-vendored``, ``binary``"
+                " or ``-diff`` in the repository's ``.gitattributes`` are also excluded."
+            ),
+            group=inputs_group,
+        ),
+    ] = (),
+    default_excludes: Annotated[
+        bool,
+        cyclopts.Parameter(
+            help=(
+                "Omit the diffs of lockfiles, minified bundles, snapshots and vendored"
+                " dependencies. Use ``--no-default-excludes`` to include them."
+            ),
+            group=inputs_group,
+        ),
+    ] = True,
+    deduplicate: Annotated[
+        bool,
+        cyclopts.Parameter(
+            help=(
+                "Drop the commits whose changes were already seen, such as cherry-picks,"
+                " and the commits reverted by each other, before sending them to the model."
+            ),
+            group=inputs_group,
+        ),
+    ] = False,
+    jobs: Annotated[
+        int,
+        cyclopts.Parameter(
+            name=("-j", "--jobs"),
+            help=(
+                "The number of processes extracting commits from the repository."
+                " Speeds up long histories on machines with several cores."
+            ),
+            group=inputs_group,
+            validator=cyclopts.validators.Number(gte=1),
+        ),
+    ] = 1,
     output: Annotated[
         Path | None,
         cyclopts.Parameter(
@@ -474,6 +916,148 @@ async def from_local(
             group=model_group,
         ),
     ] = None,
+    token_estimation: Annotated[
+        TokenEstimatorKind,
+        cyclopts.Parameter(
+            help=(
+                "How the number of tokens in commits and prompts is estimated."
+                " If set to `heuristic`, fixed characters-per-token ratios are used."
+                " If set to `calibrated`, the ratios are learned from the token usage reported by the model provider"
+                " and stored in the cache directory, falling back to the heuristic until enough usage has been observed."
+                " Calibrated estimates fill batches closer to the context window, but batch boundaries change as they are learned."
+            ),
+            group=model_group,
+        ),
+    ] = "heuristic",
+    token_safety_quantile: Annotated[
+        float,
+        cyclopts.Parameter(
+            help=(
+                "The fraction (0.0 to 1.0) of past requests whose token usage calibrated estimates must cover."
+                " Higher values are more conservative."
+            ),
+            group=model_group,
+            validator=cyclopts.validators.Number(gt=0.0, lte=1.0),
+        ),
+    ] = DEFAULT_SAFETY_QUANTILE,
+    batching: Annotated[
+        BatchingStrategy,
+        cyclopts.Parameter(
+            help=(
+                "How commits are packed into batches."
+                " If set to `greedy`, commits are batched in order and a batch is closed as soon as the next commit does not fit."
+                " If set to `lookahead`, batches stay in order but are filled with commits from a small window of upcoming commits."
+                " If set to `first-fit-decreasing`, commits are packed into as few batches as possible regardless of their order,"
+                " which minimizes the number of model calls and is best suited for the `tree` strategy."
+            ),
+            group=model_group,
+        ),
+    ] = "greedy",
+    strategy: Annotated[
+        GenerationStrategy,
+        cyclopts.Parameter(
+            help=(
+                "How the commit batches are combined into the brag document."
+                " If set to `refine`, the document is refined with one batch at a time, sequentially."
+                " If set to `tree`, every batch is summarized concurrently and the partial documents are merged"
+                " until a single one remains, which is much faster for long histories."
+                " If set to `extract`, the achievements of every batch are extracted concurrently,"
+                " duplicate achievements are removed, and the document is written from them at once,"
+                " which makes the fewest and smallest model calls."
+            ),
+            group=model_group,
+        ),
+    ] = "refine",
+    merge_arity: Annotated[
+        int,
+        cyclopts.Parameter(
+            help="The number of partial brag documents merged by each model call when using the `tree` strategy.",
+            group=model_group,
+            validator=cyclopts.validators.Number(gte=MIN_MERGE_ARITY),
+        ),
+    ] = 2,
+    update_mode: Annotated[
+        UpdateMode,
+        cyclopts.Parameter(
+            help=(
+                "How the brag document is refined with each batch when using the `refine` strategy."
+                " If set to `rewrite`, the model rewrites the whole document."
+                " If set to `edits`, the model only lists the edits to make, such as bullet points to insert,"
+                " which keeps every model call fast as the document grows."
+                " The document is rewritten whenever the edits do not apply."
+            ),
+            group=model_group,
+        ),
+    ] = "rewrite",
+    render: Annotated[
+        RenderMode,
+        cyclopts.Parameter(
+            help=(
+                "How the achievements are written into the brag document when using the `extract` strategy."
+                " If set to `model`, the model writes the document in a single call."
+                " If set to `template`, every achievement is listed in its own section, without any model call."
+            ),
+            group=model_group,
+        ),
+    ] = "model",
+    max_concurrency: Annotated[
+        int,
+        cyclopts.Parameter(
+            help=(
+                "The maximum number of model requests to run at the same time."
+                " The limit is automatically reduced when the provider reports rate limiting or overload errors."
+            ),
+            group=rate_limits_group,
+            validator=cyclopts.validators.Number(gte=1),
+        ),
+    ] = 8,
+    requests_per_minute: Annotated[
+        int | None,
+        cyclopts.Parameter(
+            help="The maximum number of model requests per minute allowed by the provider.",
+            group=rate_limits_group,
+            validator=cyclopts.validators.Number(gte=1),
+        ),
+    ] = None,
+    tokens_per_minute: Annotated[
+        int | None,
+        cyclopts.Parameter(
+            help="The maximum number of input tokens per minute allowed by the provider.",
+            group=rate_limits_group,
+            validator=cyclopts.validators.Number(gte=1),
+        ),
+    ] = None,
+    use_cache: Annotated[
+        bool,
+        cyclopts.Parameter(
+            name="--cache",
+            help=(
+                "Whether to cache model responses on disk."
+                " Cached responses are reused when the same model is given the same prompts again."
+            ),
+            group=cache_group,
+        ),
+    ] = True,
+    cache_dir: Annotated[
+        Path | None,
+        cyclopts.Parameter(
+            help=(
+                "The directory to store cached model responses in."
+                " Defaults to ``$XDG_CACHE_HOME/brag`` or ``~/.cache/brag``."
+            ),
+            group=cache_group,
+        ),
+    ] = None,
+    resume: Annotated[
+        bool,
+        cyclopts.Parameter(
+            help=(
+                "Resume an interrupted run of the same command instead of starting over."
+                " Progress is checkpointed in the cache directory after every batch when using the `refine` strategy."
+            ),
+            group=cache_group,
+        ),
+    ] = False,
 ) -> None:
     """Generate a brag document from a local Git repository.
 
@@ -503,7 +1087,15 @@ async def from_local(
     how conservative this batching should be by reserving a portion of the model's
     context window as a safety buffer.
     """
-    if output is not None and output.exists() and on_existing_output == "error":
+    if incremental:
+        _check_incremental_options(output=output, limit=limit)
+
+    if (
+        output is not None
+        and output.exists()
+        and on_existing_output == "error"
+        and not incremental
+    ):
         raise FileExistsError(
             f"Output file `{output}` already exists. Use `--on-existing-output overwrite` to overwrite."
         )
@@ -513,6 +1105,15 @@ async def from_local(
     model = Model.from_full_name(model_name)
     context_window_size = _resolve_context_window_size(context_window_size, model)
     max_tokens_per_batch = int(context_window_size * (1 - buffer_ratio))
+    token_estimator = _build_token_estimator(
+        token_estimation,
+        cache_dir,
+        model.full_name,
+        safety_quantile=token_safety_quantile,
+    )
+    path_filter = _build_path_filter(
+        include, exclude, default_excludes=default_excludes
+    )
     from_date = _maybe_parse_datetime(from_date_str)
     to_date = _maybe_parse_datetime(to_date_str)
 
@@ -532,90 +1133,130 @@ async def from_local(
         context_window_size=context_window_size,
     )
 
-    git_commits: DataSource[GitCommit] = GitCommitsSource(
+    incremental_state = (
+        _IncrementalState.load(output, source_key("git", str(repo), author))
+        if incremental and output is not None
+        else None
+    )
+
+    with GitCommitsSource(
         path=repo,
         author=author,
         from_date=from_date,
         to_date=to_date,
-    )
-    if limit:
-        git_commits = git_commits.limit(limit)
+        after_commit=incremental_state.after_commit if incremental_state else None,
+        path_filter=path_filter,
+        jobs=jobs,
+    ) as git_commits_source:
+        git_commits: DataSource[GitCommit] = git_commits_source
+        if limit:
+            git_commits = git_commits.limit(limit)
 
-    commits_count = len(git_commits)
+        # Only estimate the number of commits, so that listing them does not delay the
+        # processing of the first ones
+        commits_count = git_commits.length_hint()
 
-    if not commits_count:
-        raise ValueError("No commits found for the given repository and date range")
+        if commits_count == 0:
+            if incremental_state is not None and incremental_state.after_commit:
+                logger.info(
+                    "No new commits since {sha}. The brag document is up to date.",
+                    sha=incremental_state.after_commit.sha,
+                )
+                return
+            raise ValueError("No commits found for the given repository and date range")
 
-    logger.info(
-        "Processing {commits} for {author} in {repo}",
-        commits=(
-            f"{commits_count} commits"
-            if commits_count > 1
-            else f"{commits_count} commit"
-        ),
-        author=author,
-        repo=repo,
-    )
+        latest_commit = git_commits_source.latest_commit()
 
-    # Batch chunks to respect rate limits
-    batched_chunks = tuple(
-        batch_chunks_by_token_limit(
-            track_iterable_progress(
-                git_commits,
-                description="Batching commits",
-            ),
-            max_tokens_per_batch=max_tokens_per_batch,
-            joiner=COMMIT_BATCH_JOINER,
+        logger.info(
+            "Processing {commits} for {author} in {repo}",
+            commits=_describe_commits_count(commits_count),
+            author=author,
+            repo=repo,
         )
-    )
-
-    logger.info(
-        "Batched {commits} into {batches} for more efficient processing",
-        commits=(
-            f"{commits_count} commits"
-            if commits_count > 1
-            else f"{commits_count} commit"
-        ),
-        batches=(
-            f"{batch_count} batches"
-            if (batch_count := len(batched_chunks)) > 1
-            else f"{batch_count} batch"
-        ),
-    )
-
-    input_brag_document: str | None = None
-    if input_brag_document_path:
-        try:
-            input_brag_document = input_brag_document_path.read_text()
-        except FileNotFoundError:
-            if on_missing_input_brag_document == "error":
-                raise FileNotFoundError(
-                    f"Input brag document `{input_brag_document_path}` does not exist."
-                )
-            else:
-                logger.warning(
-                    "Input brag document `{path}` does not exist. Generating new brag document.",
-                    path=input_brag_document_path,
-                )
 
-    brag_document = await generate_brag_document(
-        # TODO: fix the type error here
-        # We're temporarily using a string here, but it should be a Literal
-        # of KnownModelName
-        model_name,  # type: ignore
-        track_iterable_progress(
-            batched_chunks,
-            description="Processing batches",
-        ),
-        language=language,
-        input_brag_document=input_brag_document,
-    )
+        if (
+            incremental
+            and input_brag_document_path is None
+            and output is not None
+            and output.exists()
+        ):
+            input_brag_document_path = output
+
+        input_brag_document: str | None = None
+        if input_brag_document_path:
+            try:
+                input_brag_document = input_brag_document_path.read_text()
+            except FileNotFoundError:
+                if on_missing_input_brag_document == "error":
+                    raise FileNotFoundError(
+                        f"Input brag document `{input_brag_document_path}` does not exist."
+                    )
+                else:
+                    logger.warning(
+                        "Input brag document `{path}` does not exist. Generating new brag document.",
+                        path=input_brag_document_path,
+                    )
+
+        checkpoint = _open_checkpoint(
+            cache_dir,
+            resume=resume,
+            command="from-local",
+            repo=repo,
+            author=author,
+            from_date=from_date_str,
+            to_date=to_date_str,
+            limit=limit,
+            input_brag_document_path=input_brag_document_path,
+            model=model.full_name,
+            language=language,
+            max_tokens_per_batch=max_tokens_per_batch,
+            batching=batching,
+            path_filter=path_filter,
+            strategy=strategy,
+            update_mode=update_mode,
+            render=render,
+            deduplicate=deduplicate,
+        )
 
-    # Open the output file if specified, otherwise use stdout
-    if output:
-        output.write_text(brag_document)
-    else:
-        print(brag_document)
+        with (
+            _maybe_open_response_cache(use_cache, cache_dir) as response_cache,
+            _flush_partial_brag_document_on_interruption(checkpoint, output),
+            _open_output(output) as write_output,
+        ):
+            # Commits are extracted and batched while the first batches are processed,
+            # and the brag document is written out as the final model call generates it
+            await _generate_brag_document_from_commits(
+                model_name,
+                git_commits,
+                commits_count=commits_count,
+                splitters=GIT_COMMIT_SPLITTERS,
+                patch_id=git_commits_source.patch_id if deduplicate else None,
+                max_tokens_per_batch=max_tokens_per_batch,
+                batching=batching,
+                token_estimator=token_estimator,
+                language=language,
+                input_brag_document=input_brag_document,
+                strategy=strategy,
+                merge_arity=merge_arity,
+                update_mode=update_mode,
+                render_mode=render,
+                scheduler=LLMScheduler(
+                    max_concurrency,
+                    requests_per_minute=requests_per_minute,
+                    tokens_per_minute=tokens_per_minute,
+                    token_estimator=token_estimator,
+                ),
+                cache=response_cache,
+                checkpoint=checkpoint,
+                on_text=write_output,
+            )
+    # Record the processed commits as soon as the output is replaced, so that the next
+    # incremental run does not process them again on top of the output
+    if incremental_state is not None and latest_commit is not None:
+        incremental_state.save(latest_commit)
+    checkpoint.clear()
+    # Only learn from completed runs, so that resumed runs batch commits the same way
+    token_estimator.save()
 
 
 @app.command(
@@ -700,6 +1341,188 @@ def list_models(
             print(json.dumps(model_data, indent=2))
 
 
+async def _generate_brag_document_from_commits(
+    model_name: str,
+    commits: Iterable[str],
+    *,
+    commits_count: int | None,
+    splitters: Sequence[ChunkSplitter],
+    patch_id: Callable[[str], PatchId | None] | None = None,
+    max_tokens_per_batch: TokenCount,
+    batching: BatchingStrategy,
+    token_estimator: TokenEstimator,
+    status: Callable[[], str] | None = None,
+    language: str,
+    input_brag_document: str | None,
+    strategy: GenerationStrategy,
+    merge_arity: int,
+    update_mode: UpdateMode,
+    render_mode: RenderMode,
+    scheduler: LLMScheduler,
+    cache: ResponseCache | None,
+    checkpoint: CheckpointFile,
+    on_text: Callable[[str], object] | None = None,
+) -> str:
+    """Generate a brag document from commits while they are being extracted and batched.
+
+    Commits are extracted, split and batched in a worker thread, and every batch is
+    processed by the model as soon as it is full. Only a few batches wait to be processed
+    at any time, so memory use does not grow with the length of the history.
+
+    Args:
+        model_name: The name of the model to use for generating the brag document.
+        commits: The formatted commits, from the most recent, as listed by the sources.
+        commits_count: The estimated number of commits, or None if it is unknown.
+        splitters: The splitters used to split commits that do not fit in a batch.
+        patch_id: An optional function computing the patch ids of a commit. If
+            provided, duplicate commits and commits reverted by each other are dropped
+            before batching, see `deduplicate_commits`.
+        max_tokens_per_batch: The maximum number of tokens per batch.
+        batching: How commits are packed into batches.
+        token_estimator: The estimator of the size of the commits, which keeps learning
+            from the usage reported while generating the brag document.
+        status: An optional status shown next to the progress bars.
+        language: The language of the brag document.
+        input_brag_document: An optional existing brag document to update.
+        strategy: How the batches are combined into the brag document.
+        merge_arity: The number of partial brag documents merged by each model call.
+        update_mode: How the brag document is refined with each batch.
+        render_mode: How the extracted achievements are written into the brag document.
+        scheduler: The scheduler running the model requests.
+        cache: An optional cache of model responses.
+        checkpoint: The checkpoint of the run.
+        on_text: An optional function called with the brag document, piece by piece, as
+            the final model call generates it.
+
+    Returns:
+        The generated brag document.
+    """
+    # Batch with the estimates of the start of the run, so that batches do not depend on
+    # the usage observed while generating, and resumed runs batch commits the same way
+    batching_token_estimator = token_estimator.snapshot()
+    # The number of batched commits is only known once they were all extracted
+    batched_commits = 0
+
+    def count_batched_commits(commits: Iterable[str]) -> Iterator[str]:
+        nonlocal batched_commits
+        for commit in commits:
+            batched_commits += 1
+            yield commit
+
+    with progress_display(status=status) as progress:
+        extracted_commits = track_iterable_progress(
+            commits,
+            description="Batching commits",
+            total=commits_count,
+            progress=progress,
+        )
+        batches = _log_batching_summary(
+            batch_chunks(
+                split_oversized_chunks(
+                    count_batched_commits(
+                        deduplicate_commits(
+                            extracted_commits,
+                            patch_id=patch_id,
+                            token_estimator=batching_token_estimator,
+                        )
+                        if patch_id is not None
+                        else extracted_commits
+                    ),
+                    max_tokens_per_chunk=max_tokens_per_batch,
+                    splitters=splitters,
+                    token_estimator=batching_token_estimator,
+                ),
+                max_tokens_per_batch=max_tokens_per_batch,
+                joiner=COMMIT_BATCH_JOINER,
+                strategy=batching,
+                token_estimator=batching_token_estimator,
+            ),
+            commits_count=lambda: batched_commits,
+            max_tokens_per_batch=max_tokens_per_batch,
+            token_estimator=batching_token_estimator,
+        )
+        async with aclosing(
+            iterate_in_thread(batches, max_pending=_MAX_PENDING_BATCHES)
+        ) as pending_batches:
+            brag_document = await generate_brag_document(
+                # TODO: fix the type error here
+                # We're temporarily using a string here, but it should be a Literal
+                # of KnownModelName
+                model_name,  # type: ignore
+                track_async_iterable_progress(
+                    pending_batches, description="Processing batches", progress=progress
+                ),
+                language=language,
+                input_brag_document=input_brag_document,
+                strategy=strategy,
+                merge_arity=merge_arity,
+                update_mode=update_mode,
+                render_mode=render_mode,
+                scheduler=scheduler,
+                cache=cache,
+                checkpoint=checkpoint,
+                on_text=on_text,
+            )
+
+    _log_model_usage(scheduler)
+    return brag_document
+
+
+def _log_model_usage(scheduler: LLMScheduler) -> None:
+    """Log the tokens used by the model calls of a run, if any were made."""
+    usage = scheduler.usage
+    if not usage.requests:
+        return
+    logger.info(
+        "Used {input_tokens} input tokens, {cached:.0%} of them read from the provider's prompt cache, and {output_tokens} output tokens",
+        input_tokens=usage.input_tokens,
+        cached=usage.cache_read_tokens / usage.input_tokens
+        if usage.input_tokens
+        else 0.0,
+        output_tokens=usage.output_tokens,
+    )
+
+
+def _log_batching_summary(
+    batches: Iterable[str],
+    *,
+    commits_count: Callable[[], int],
+    max_tokens_per_batch: TokenCount,
+    token_estimator: TokenEstimator,
+) -> Iterator[str]:
+    """Yield batches, and log how many there are and how full they are once all were yielded.
+
+    The number of batched commits is only known at that point, so it is given as a function.
+    """
+    batch_count = 0
+    token_count = 0
+    for batch in batches:
+        batch_count += 1
+        token_count += token_estimator.estimate(batch)
+        yield batch
+
+    logger.info(
+        "Batched {commits} into {batches} for more efficient processing, with a fill ratio of {fill_ratio:.0%}",
+        commits=_describe_commits_count(commits_count()),
+        batches=(
+            f"{batch_count} batches" if batch_count > 1 else f"{batch_count} batch"
+        ),
+        # See `batch_fill_ratio`, which needs every batch at once
+        fill_ratio=token_count / (batch_count * max_tokens_per_batch)
+        if batch_count
+        else 0.0,
+    )
+
+
+def _describe_commits_count(commits_count: int | None) -> str:
+    """Describe a number of commits, which may be unknown, for log messages."""
+    if commits_count is None:
+        return "commits"
+    return (
+        f"{commits_count} commits" if commits_count > 1 else f"{commits_count} commit"
+    )
+
+
 def _resolve_context_window_size(
     context_window_size: TokenCount | None,
     model: Model,
@@ -741,6 +1564,284 @@ def _resolve_context_window_size(
     )
 
 
+@contextmanager
+def _maybe_open_github_cache(
+    use_github_cache: bool,
+    cache_dir: Path | None,
+) -> Iterator[tuple[ResponseCache | None, GithubCacheStats]]:
+    """Open the persistent cache of GitHub API responses, unless caching is disabled.
+
+    Args:
+        use_github_cache: Whether to cache GitHub API responses.
+        cache_dir: The directory to store the cache in. If None, the default cache directory is used.
+
+    Yields:
+        The response cache, or None if caching is disabled, and the counts of how cacheable requests were answered.
+    """
+    stats = GithubCacheStats()
+    if not use_github_cache:
+        yield None, stats
+        return
+
+    with ResponseCache(
+        (cache_dir or default_cache_dir()) / GITHUB_RESPONSE_CACHE_FILE_NAME
+    ) as cache:
+        yield cache, stats
+        if stats.total:
+            logger.info(
+                "Answered {requests} GitHub requests: {served} served from the cache at {path},"
+                " {not_modified} not modified and {fetched} fetched",
+                requests=stats.total,
+                served=stats.served,
+                not_modified=stats.not_modified,
+                fetched=stats.fetched,
+                path=cache.path,
+            )
+
+
+@contextmanager
+def _maybe_open_response_cache(
+    use_cache: bool,
+    cache_dir: Path | None,
+) -> Iterator[ResponseCache | None]:
+    """Open the persistent cache of model responses, unless caching is disabled.
+
+    Args:
+        use_cache: Whether to cache model responses.
+        cache_dir: The directory to store the cache in. If None, the default cache directory is used.
+
+    Yields:
+        The response cache, or None if caching is disabled.
+    """
+    if not use_cache:
+        yield None
+        return
+
+    with ResponseCache.in_directory(cache_dir or default_cache_dir()) as cache:
+        yield cache
+        if cache.hits:
+            logger.info(
+                "Reused {hits} of {requests} model responses from the cache at {path}",
+                hits=cache.hits,
+                requests=cache.hits + cache.misses,
+                path=cache.path,
+            )
+
+
+@dataclass(frozen=True, slots=True)
+class _IncrementalState:
+    """The incremental processing state of a source, stored next to the brag document.
+
+    Attributes:
+        path: The path to the state file.
+        key: The key identifying the source in the state file.
+        state: The state of the brag document, for all sources.
+    """
+
+    path: Path
+    key: str
+    state: BragDocumentState
+
+    @classmethod
+    def load(cls, brag_document_path: Path, key: str) -> Self:
+        """Load the incremental state of a source for the given brag document."""
+        path = state_path_for(brag_document_path)
+        return cls(path=path, key=key, state=load_state(path))
+
+    @property
+    def after_commit(self) -> CommitRef | None:
+        """The last processed commit of the source, if any."""
+        source_state = self.state.sources.get(self.key)
+        return source_state.to_commit_ref() if source_state else None
+
+    def save(self, latest_commit: CommitRef) -> None:
+        """Record the latest processed commit of the source."""
+        self.state.sources[self.key] = SourceState.from_commit_ref(latest_commit)
+        save_state(self.path, self.state)
+
+
+def _check_incremental_options(*, output: Path | None, limit: int | None) -> None:
+    """Check that the options of a command are compatible with `--incremental`.
+
+    Raises:
+        ValueError: If there is no output to update, or if the commits are limited. The
+            most recent commits are processed first, so the older commits left out by the
+            limit would be recorded as processed.
+    """
+    if output is None:
+        raise ValueError("`--incremental` requires `--output` to be provided")
+    if limit:
+        raise ValueError("`--incremental` cannot be combined with `--limit`")
+
+
+def _build_path_filter(
+    include: tuple[str, ...],
+    exclude: tuple[str, ...],
+    *,
+    default_excludes: bool,
+) -> PathFilter:
+    """Build the filter deciding which file diffs are included in the commits.
+
+    Args:
+        include: If not empty, only the diffs of the files matching these patterns are included.
+        exclude: The patterns of the files whose diffs are omitted.
+        default_excludes: Whether to also omit the diffs of the default excluded paths.
+
+    Returns:
+        The path filter.
+    """
+    return PathFilter(
+        include=include,
+        exclude=(*DEFAULT_EXCLUDED_PATHS, *exclude) if default_excludes else exclude,
+    )
+
+
+def _build_token_estimator(
+    kind: TokenEstimatorKind,
+    cache_dir: Path | None,
+    model_name: str,
+    *,
+    safety_quantile: float,
+) -> TokenEstimator:
+    """Build the token estimator used for batching and rate limiting.
+
+    Args:
+        kind: The kind of token estimator.
+        cache_dir: The directory the calibration is stored in. If None, the default cache directory is used.
+        model_name: The full name of the model whose token usage is estimated.
+        safety_quantile: The fraction of past requests calibrated estimates must cover.
+
+    Returns:
+        The token estimator.
+    """
+    match kind:
+        case "heuristic":
+            return HeuristicTokenEstimator()
+        case "calibrated":
+            return CalibratedTokenEstimator.in_directory(
+                cache_dir or default_cache_dir(),
+                model_name,
+                safety_quantile=safety_quantile,
+            )
+        case never:
+            assert_never(never)
+
+
+def _open_checkpoint(
+    cache_dir: Path | None,
+    *,
+    resume: bool,
+    **run_inputs: object,
+) -> CheckpointFile:
+    """Open the checkpoint file of a run.
+
+    Args:
+        cache_dir: The directory to store the checkpoint in. If None, the default cache directory is used.
+        resume: Whether to resume from an existing checkpoint. If False, any existing checkpoint is discarded.
+        **run_inputs: The inputs identifying the run.
+
+    Returns:
+        The checkpoint file of the run.
+    """
+    checkpoint = CheckpointFile.in_directory(
+        cache_dir or default_cache_dir(),
+        fingerprint_run(**run_inputs),
+    )
+    if not resume:
+        checkpoint.clear()
+    return checkpoint
+
+
+@contextmanager
+def _flush_partial_brag_document_on_interruption(
+    checkpoint: CheckpointFile,
+    output: Path | None,
+) -> Iterator[None]:
+    """Save the latest checkpointed brag document next to the output file if the run is interrupted.
+
+    The partial brag document is saved to a `.partial` file next to the output file, so
+    that the output file, which is often the input brag document of the run, is kept as
+    is. The partial brag document of an earlier run is removed once the run completes.
+
+    Args:
+        checkpoint: The checkpoint file of the run.
+        output: The output file. If None, nothing is saved.
+    """
+    if output is None:
+        yield
+        return
+
+    partial_output = output.with_name(output.name + _PARTIAL_OUTPUT_SUFFIX)
+    try:
+        yield
+    except BaseException:
+        if checkpoint.latest is not None:
+            temporary_path = partial_output.with_name(partial_output.name + ".tmp")
+            temporary_path.write_text(checkpoint.latest.brag_document)
+            os.replace(temporary_path, partial_output)
+            logger.warning(
+                "Generation was interrupted after {batches}. The partial brag document was saved to `{partial_output}`."
+                " Re-run the same command with `--resume` to continue.",
+                batches=(
+                    f"{completed} batches"
+                    if (completed := checkpoint.latest.completed_chunks) != 1
+                    else f"{completed} batch"
+                ),
+                partial_output=partial_output,
+            )
+        raise
+    partial_output.unlink(missing_ok=True)
+
+
+@contextmanager
+def _open_output(output: Path | None) -> Iterator[Callable[[str], None]]:
+    """Open the output of the brag document, to write it piece by piece as it is generated.
+
+    The brag document is written to a temporary file next to the output file, which
+    replaces the output file once the brag document is complete, so that a failed run
+    never leaves a truncated brag document behind. Without an output file, the brag
+    document is printed to the standard output, one line at a time: the progress display
+    redirects the standard output while it is shown, and would break partial lines.
+
+    Args:
+        output: The output file. If None, the standard output is used.
+
+    Yields:
+        A function writing the next piece of the brag document.
+    """
+    if output is None:
+        pending_line: list[str] = []
+
+        def print_lines(text: str) -> None:
+            lines, newline, partial_line = text.rpartition("\n")
+            if newline:
+                # Look the standard output up every time, since it may be redirected
+                sys.stdout.write("".join(pending_line) + lines + newline)
+                sys.stdout.flush()
+                pending_line.clear()
+            pending_line.append(partial_line)
+
+        yield print_lines
+        # End the last line, unless the brag document already did
+        if partial_line := "".join(pending_line):
+            print(partial_line)
+        return
+
+    temporary_path = output.with_name(output.name + ".tmp")
+    try:
+        with temporary_path.open("w") as stream:
+
+            def write(text: str) -> None:
+                stream.write(text)
+                stream.flush()
+
+            yield write
+    except BaseException:
+        temporary_path.unlink(missing_ok=True)
+        raise
+    os.replace(temporary_path, output)
+
+
 def _maybe_parse_datetime(date_str: str | None) -> datetime | None:
     """Parse a date string into a datetime object.
 
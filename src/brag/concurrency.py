@@ -0,0 +1,66 @@
+"""Run blocking work concurrently while keeping results in order.
+
+Commits must reach the model in the order they are listed, but extracting or fetching them can
+be spread over several workers. `map_ordered` submits work to an executor ahead of the
+consumer, and yields the results in the order of the inputs. The number of pending
+results is bounded, so memory use does not grow with the number of inputs.
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Executor, Future
+from itertools import islice
+
+
+def map_ordered[T, R](
+    executor: Executor,
+    function: Callable[[T], R],
+    items: Iterable[T],
+    *,
+    max_pending: int,
+) -> Iterator[R]:
+    """Map a function over items in an executor, yielding results in the input order.
+
+    Items are submitted lazily, so that at most `max_pending` of them are being processed
+    or waiting to be yielded at any time. If the consumer stops early, the pending items
+    that have not started yet are cancelled.
+
+    Args:
+        executor: The executor to run the function in.
+        function: The function to map over the items.
+        items: The items to map the function over.
+        max_pending: The maximum number of items submitted ahead of the consumer.
+
+    Yields:
+        The result of the function for each item, in the order of the items.
+
+    Raises:
+        ValueError: If max_pending is not positive.
+    """
+    if max_pending <= 0:
+        raise ValueError("max_pending must be positive")
+
+    return _map_ordered(executor, function, iter(items), max_pending)
+
+
+def _map_ordered[T, R](
+    executor: Executor,
+    function: Callable[[T], R],
+    items: Iterator[T],
+    max_pending: int,
+) -> Iterator[R]:
+    pending: deque[Future[R]] = deque(
+        executor.submit(function, item) for item in islice(items, max_pending)
+    )
+    try:
+        while pending:
+            future = pending.popleft()
+            # Keep the executor busy while the consumer handles the result
+            for item in islice(items, 1):
+                pending.append(executor.submit(function, item))
+            yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
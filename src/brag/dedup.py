@@ -0,0 +1,197 @@
+"""Drop commits whose changes the brag document would not benefit from, before batching.
+
+Release branches often cherry-pick the same changes several times, and changes are
+sometimes reverted, and re-applied later. Sending every copy of a change, or a change and
+its revert, to the model costs tokens without adding anything to the brag document.
+
+Commits are compared by patch id: a hash of their changes that ignores line numbers and
+whitespace, so that the same change applied at different places gets the same id, like
+`git patch-id --stable`. A commit reverting another one has the patch id of the reverted
+changes.
+
+`deduplicate_commits` drops the commits whose patch id was already seen, and collapses a
+commit and its revert when both are found close enough to each other.
+"""
+
+from __future__ import annotations
+
+import hashlib
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass
+from typing import Final
+
+from loguru import logger
+
+from brag.models import TokenCount
+from brag.tokens import DEFAULT_TOKEN_ESTIMATOR, TokenEstimator
+
+# The number of commits held back waiting for a revert, see `deduplicate_commits`
+DEFAULT_REVERT_WINDOW: Final = 256
+_REVERSED_SIGNS: Final = {"+": "-", "-": "+"}
+
+
+@dataclass(frozen=True, slots=True)
+class PatchId:
+    """The patch ids of the changes of a commit.
+
+    Attributes:
+        forward: The patch id of the changes of the commit.
+        reverse: The patch id of the reverted changes, which is the forward patch id of
+            the commits reverting the commit.
+    """
+
+    forward: str
+    reverse: str
+
+
+def diff_patch_id(file_diffs: Iterable[tuple[str, str]]) -> PatchId | None:
+    """Compute the patch ids of changes, from the diff of each changed file.
+
+    Only the changed lines are hashed, without their whitespace, along with the path of
+    their file. The files are hashed independently of their order.
+
+    Args:
+        file_diffs: The path and the unified diff of each changed file.
+
+    Returns:
+        The patch ids of the changes, or None if there are no changed lines, for example
+        if the diffs were omitted.
+    """
+    forward_hashes: list[str] = []
+    reverse_hashes: list[str] = []
+    for path, diff in file_diffs:
+        changed_lines = _changed_lines(diff.splitlines())
+        if not changed_lines:
+            continue
+        forward_hashes.append(_hash_file_changes(path, changed_lines))
+        reverse_hashes.append(_hash_file_changes(path, _reverse(changed_lines)))
+
+    if not forward_hashes:
+        return None
+    return PatchId(
+        forward=_combine_hashes(forward_hashes), reverse=_combine_hashes(reverse_hashes)
+    )
+
+
+def deduplicate_commits(
+    commits: Iterable[str],
+    *,
+    patch_id: Callable[[str], PatchId | None],
+    window: int = DEFAULT_REVERT_WINDOW,
+    token_estimator: TokenEstimator = DEFAULT_TOKEN_ESTIMATOR,
+) -> Iterator[str]:
+    """Drop duplicate commits, and collapse commits with their reverts.
+
+    The first commit with a given patch id is kept, and the later ones are dropped. A
+    commit and a commit reverting it are both dropped, unless they are more than
+    `window` commits apart: the commits are yielded `window` commits late, so that their
+    reverts can still be found. A commit re-applying changes after they were reverted is
+    kept.
+
+    Once all the commits were yielded, the number of dropped commits, and an estimate of
+    the tokens they would have used, are logged.
+
+    Args:
+        commits: The formatted commits, in order.
+        patch_id: Compute the patch ids of a formatted commit, or None if the commit
+            has no changes to compare, in which case it is always kept.
+        window: The number of commits held back waiting for a revert.
+        token_estimator: Estimates the tokens of the dropped commits.
+
+    Returns:
+        The commits that are neither duplicates nor reverted, in order.
+
+    Raises:
+        ValueError: If window is not positive.
+    """
+    if window <= 0:
+        raise ValueError("window must be positive")
+
+    return _deduplicate_commits(commits, patch_id, window, token_estimator)
+
+
+def _deduplicate_commits(
+    commits: Iterable[str],
+    patch_id: Callable[[str], PatchId | None],
+    window: int,
+    token_estimator: TokenEstimator,
+) -> Iterator[str]:
+    # The commits held back, by their position, in order
+    pending: dict[int, str] = {}
+    # The position of the kept commit with each forward patch id
+    kept: dict[str, int] = {}
+    duplicate_commits = 0
+    reverted_commits = 0
+    saved_tokens: TokenCount = 0
+
+    for index, commit in enumerate(commits):
+        if (ids := patch_id(commit)) is not None:
+            if ids.forward in kept:
+                duplicate_commits += 1
+                saved_tokens += token_estimator.estimate(commit)
+                continue
+            # The reverted changes may be applied again later
+            reverted_index = kept.pop(ids.reverse, None)
+            if reverted_index is not None and reverted_index in pending:
+                reverted_commit = pending.pop(reverted_index)
+                reverted_commits += 2
+                saved_tokens += token_estimator.estimate(commit)
+                saved_tokens += token_estimator.estimate(reverted_commit)
+                continue
+            kept[ids.forward] = index
+
+        pending[index] = commit
+        if len(pending) > window:
+            yield pending.pop(next(iter(pending)))
+    yield from pending.values()
+
+    logger.info(
+        "Dropped {duplicate_commits} duplicate commits and {reverted_commits} commits reverted by each other, saving about {saved_tokens} tokens",
+        duplicate_commits=duplicate_commits,
+        reverted_commits=reverted_commits,
+        saved_tokens=saved_tokens,
+    )
+
+
+def _changed_lines(diff_lines: Iterable[str]) -> list[str]:
+    """Return the added and removed lines of a diff, with a blank line between blocks."""
+    changed_lines: list[str] = []
+    for line in diff_lines:
+        if line[:1] in _REVERSED_SIGNS and not line.startswith(("+++ ", "--- ")):
+            changed_lines.append(line)
+        elif changed_lines and changed_lines[-1]:
+            changed_lines.append("")
+    if changed_lines and not changed_lines[-1]:
+        changed_lines.pop()
+    return changed_lines
+
+
+def _reverse(changed_lines: Iterable[str]) -> list[str]:
+    """Reverse changed lines, as they would appear in the diff of a revert.
+
+    Diffs list the removed lines of each block before the added ones, so the lines of
+    each block are reordered once their signs are swapped.
+    """
+    reversed_lines: list[str] = []
+    block: list[str] = []
+    for line in [*changed_lines, ""]:
+        if line:
+            block.append(_REVERSED_SIGNS[line[0]] + line[1:])
+            continue
+        reversed_lines.extend(sorted(block, key=lambda line: line[0] != "-"))
+        reversed_lines.append(line)
+        block = []
+    return reversed_lines[:-1]
+
+
+def _hash_file_changes(path: str, changed_lines: Iterable[str]) -> str:
+    digest = hashlib.sha256(path.encode(errors="surrogateescape"))
+    for line in changed_lines:
+        # Ignore whitespace, like `git patch-id`
+        digest.update(b"\0" + "".join(line.split()).encode(errors="surrogateescape"))
+    return digest.hexdigest()
+
+
+def _combine_hashes(hashes: Iterable[str]) -> str:
+    """Combine hashes independently of their order."""
+    return hashlib.sha256("".join(sorted(hashes)).encode()).hexdigest()
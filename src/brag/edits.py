@@ -0,0 +1,247 @@
+"""Update a brag document with a list of edits instead of rewriting it.
+
+Rewriting the whole brag document to incorporate a few new achievements makes the model
+generate as many output tokens as the document is long, which gets slower and more
+expensive as the document grows. Instead, the model can describe the changes as a short
+list of edits, which are validated by the models of this module and applied locally.
+
+Edits refer to the sections of the document by their headings, and to its lines by their
+content, so that they stay valid whatever the layout of the document. Edits that do not
+match the document exactly are rejected rather than guessed, so that the caller can fall
+back to a full rewrite.
+"""
+
+from __future__ import annotations
+
+import re
+from collections.abc import Sequence
+from dataclasses import dataclass
+from typing import Annotated, Literal, assert_never
+
+from pydantic import BaseModel, Field
+
+# Single lines of text, since every edit changes whole lines
+_SINGLE_LINE_PATTERN = r"^[^\r\n]*$"
+_HEADING_PATTERN = re.compile(r"^#{1,6}\s+(.*?)(?:\s+#+)?\s*$")
+_BULLET_PATTERN = re.compile(r"^\s*([-*+])\s+")
+_DEFAULT_BULLET_MARKER = "-"
+_MAX_HEADING_LEVEL = 6
+
+
+class InsertBullet(BaseModel):
+    """Add a bullet point at the end of an existing section, before its subsections."""
+
+    kind: Literal["insert_bullet"] = "insert_bullet"
+    section: str = Field(
+        description="The heading of the section, without the leading '#' characters.",
+        pattern=_SINGLE_LINE_PATTERN,
+    )
+    text: str = Field(
+        description="The text of the bullet point, without the leading bullet marker.",
+        pattern=_SINGLE_LINE_PATTERN,
+    )
+
+
+class ReplaceLine(BaseModel):
+    """Replace a single line of the brag document, or remove it."""
+
+    kind: Literal["replace_line"] = "replace_line"
+    old: str = Field(
+        description="The exact content of the line to replace, which must appear once.",
+        pattern=_SINGLE_LINE_PATTERN,
+    )
+    new: str = Field(
+        description="The new content of the line, or an empty string to remove the line.",
+        pattern=_SINGLE_LINE_PATTERN,
+    )
+
+
+class AppendSection(BaseModel):
+    """Add a new section at the end of the brag document."""
+
+    kind: Literal["append_section"] = "append_section"
+    heading: str = Field(
+        description="The heading of the new section, without the leading '#' characters.",
+        pattern=_SINGLE_LINE_PATTERN,
+    )
+    level: int = Field(
+        default=2,
+        description="The level of the heading, from 1 for '#' to 6 for '######'.",
+        ge=1,
+        le=_MAX_HEADING_LEVEL,
+    )
+    body: str = Field(description="The Markdown content of the new section.")
+
+
+type BragDocumentEdit = Annotated[
+    InsertBullet | ReplaceLine | AppendSection, Field(discriminator="kind")
+]
+
+
+class BragDocumentEdits(BaseModel):
+    """The edits incorporating new context into a brag document, applied in order."""
+
+    edits: list[BragDocumentEdit] = Field(
+        description="The edits to apply, or an empty list if nothing is worth adding."
+    )
+
+
+class EditError(ValueError):
+    """An edit does not apply to the brag document."""
+
+
+@dataclass(frozen=True, slots=True)
+class _Heading:
+    line_index: int
+    title: str
+
+
+def apply_edits(brag_document: str, edits: Sequence[BragDocumentEdit]) -> str:
+    """Apply edits to a brag document, in order.
+
+    Either every edit is applied, or none is.
+
+    Args:
+        brag_document: The Markdown brag document to edit.
+        edits: The edits to apply.
+
+    Returns:
+        The edited brag document.
+
+    Raises:
+        EditError: If an edit refers to a section or a line that does not exist, or
+            that is ambiguous.
+    """
+    lines = brag_document.splitlines()
+    for edit in edits:
+        match edit:
+            case InsertBullet():
+                lines = _insert_bullet(lines, edit)
+            case ReplaceLine():
+                lines = _replace_line(lines, edit)
+            case AppendSection():
+                lines = _append_section(lines, edit)
+            case never:
+                assert_never(never)
+
+    edited_brag_document = "\n".join(lines)
+    if brag_document.endswith("\n"):
+        edited_brag_document += "\n"
+    return edited_brag_document
+
+
+def _insert_bullet(lines: list[str], edit: InsertBullet) -> list[str]:
+    headings = _parse_headings(lines)
+    heading = _find_section(headings, edit.section)
+    # The section's own content ends at the next heading, whatever its level
+    end = next(
+        (
+            other.line_index
+            for other in headings
+            if other.line_index > heading.line_index
+        ),
+        len(lines),
+    )
+    content_indices = [
+        index for index in range(heading.line_index + 1, end) if lines[index].strip()
+    ]
+    markers = [
+        bullet.group(1)
+        for index in content_indices
+        if (bullet := _BULLET_PATTERN.match(lines[index]))
+    ]
+    marker = markers[-1] if markers else _DEFAULT_BULLET_MARKER
+    bullet_line = f"{marker} {_strip_bullet(edit.text)}"
+
+    if not content_indices:
+        return [
+            *lines[: heading.line_index + 1],
+            "",
+            bullet_line,
+            *(["", *lines[end:]] if end < len(lines) else []),
+        ]
+    last_index = content_indices[-1]
+    # A bullet after a paragraph starts a new list, which needs a blank line
+    separator = [] if _BULLET_PATTERN.match(lines[last_index]) else [""]
+    return [
+        *lines[: last_index + 1],
+        *separator,
+        bullet_line,
+        *lines[last_index + 1 :],
+    ]
+
+
+def _replace_line(lines: list[str], edit: ReplaceLine) -> list[str]:
+    # Bullet markers are ignored, since they are often left out or changed
+    old = _strip_bullet(edit.old)
+    if not old:
+        raise EditError("Cannot replace a blank line")
+    indices = [index for index, line in enumerate(lines) if _strip_bullet(line) == old]
+    if not indices:
+        raise EditError(f"Line not found: {edit.old!r}")
+    if len(indices) > 1:
+        raise EditError(f"Line found {len(indices)} times: {edit.old!r}")
+
+    (index,) = indices
+    if not edit.new.strip():
+        return [*lines[:index], *lines[index + 1 :]]
+    # Keep the indentation and the bullet marker of the replaced line
+    line = lines[index]
+    if bullet := _BULLET_PATTERN.match(line):
+        replacement = bullet.group(0) + _strip_bullet(edit.new)
+    else:
+        replacement = line[: len(line) - len(line.lstrip())] + edit.new.strip()
+    return [*lines[:index], replacement, *lines[index + 1 :]]
+
+
+def _append_section(lines: list[str], edit: AppendSection) -> list[str]:
+    title = _normalize_title(edit.heading)
+    if not title:
+        raise EditError("Cannot append a section without a heading")
+    if any(
+        _normalize_title(heading.title) == title for heading in _parse_headings(lines)
+    ):
+        raise EditError(f"Section already exists: {edit.heading!r}")
+
+    while lines and not lines[-1].strip():
+        lines = lines[:-1]
+    body = edit.body.strip()
+    return [
+        *lines,
+        *([""] if lines else []),
+        f"{'#' * edit.level} {edit.heading.strip()}",
+        *(["", *body.splitlines()] if body else []),
+    ]
+
+
+def _parse_headings(lines: Sequence[str]) -> list[_Heading]:
+    headings: list[_Heading] = []
+    in_code_block = False
+    for index, line in enumerate(lines):
+        # Lines starting with "#" in code blocks are not headings
+        if line.lstrip().startswith("```"):
+            in_code_block = not in_code_block
+        elif not in_code_block and (heading := _HEADING_PATTERN.match(line)):
+            headings.append(_Heading(line_index=index, title=heading.group(1)))
+    return headings
+
+
+def _find_section(headings: Sequence[_Heading], section: str) -> _Heading:
+    title = _normalize_title(section)
+    matches = [
+        heading for heading in headings if _normalize_title(heading.title) == title
+    ]
+    if not matches:
+        raise EditError(f"Section not found: {section!r}")
+    if len(matches) > 1:
+        raise EditError(f"Section found {len(matches)} times: {section!r}")
+    return matches[0]
+
+
+def _normalize_title(title: str) -> str:
+    """Normalize a heading title, so that sections can be referred to loosely."""
+    return " ".join(title.strip().lstrip("#").split()).casefold()
+
+
+def _strip_bullet(text: str) -> str:
+    return _BULLET_PATTERN.sub("", text.strip(), count=1)
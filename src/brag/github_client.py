@@ -0,0 +1,496 @@
+"""Create Github clients whose requests are paced and go through a persistent HTTP cache.
+
+Github reports the state of its rate limits in the headers of every response. Requests
+are paced from these headers, so that long runs slow down as the quota runs out and wait
+for it to reset, instead of failing once it is exhausted.
+
+Commits never change once they are pushed, so their responses are served from disk
+without any request. Other responses, such as the pages listing the commits, are
+revalidated with their `ETag`: Github answers `304 Not Modified` when they did not change,
+and such answers do not count against the rate limit.
+
+PyGithub does not let clients customize how requests are sent, so the rate limiter and
+the cache are plugged in as `requests` transport adapters, mounted on the sessions of the connection classes used
+by the client.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, replace
+from datetime import datetime
+from functools import partial
+from http import HTTPStatus
+from typing import Any, Final
+from urllib.parse import urlsplit
+
+from github import Github
+from github.Auth import Auth
+from github.Requester import (
+    HTTPRequestsConnectionClass,
+    HTTPSRequestsConnectionClass,
+    Requester,
+)
+from loguru import logger
+from requests import PreparedRequest, Response
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from brag.cache import ResponseCache
+
+GITHUB_RESPONSE_CACHE_FILE_NAME: Final = "github_responses.sqlite3"
+
+# Commits addressed by their full SHA never change
+_IMMUTABLE_PATH_PATTERN: Final = re.compile(
+    r"^(?:/api/v3)?/repos/[^/]+/[^/]+/commits/[0-9a-f]{40}$"
+)
+# Headers describing the response body, which a `304 Not Modified` answer does not carry
+_BODY_HEADER_PREFIXES: Final = ("content-", "transfer-encoding")
+# Headers describing the state of the rate limit when the response was received
+_RATE_LIMIT_HEADER_PREFIX: Final = "x-ratelimit-"
+# Requests are spread evenly until the quota resets once less than this share is left
+_PACING_THRESHOLD: Final = 0.1
+# Github does not say when in the reset second the quota is restored
+_RESET_MARGIN_SECONDS: Final = 1.0
+# Github asks to wait at least a minute after hitting a secondary rate limit without
+# `Retry-After` header
+_SECONDARY_RATE_LIMIT_WAIT_SECONDS: Final = 60.0
+# The number of times a request rejected because of a rate limit is sent again
+_MAX_RATE_LIMITED_ATTEMPTS: Final = 8
+
+
+@dataclass(frozen=True, slots=True)
+class GithubQuota:
+    """The state of the rate limit of a Github API resource.
+
+    Attributes:
+        resource: The resource the quota applies to, such as `core` for the REST API or
+            `graphql` for the GraphQL API.
+        limit: The number of requests allowed per rate limit window.
+        remaining: The number of requests left in the current window.
+        reset_at: When the current window ends, as a POSIX timestamp.
+    """
+
+    resource: str
+    limit: int
+    remaining: int
+    reset_at: float
+
+
+class GithubRateLimiter:
+    """Pace Github requests within the rate limits reported by Github.
+
+    Requests are sent as fast as possible while the quota of their resource is plentiful.
+    Once it runs low, the remaining requests are spread evenly until the quota resets, and
+    once it is exhausted, requests wait for the reset. Secondary rate limits pause every
+    request for the time Github asks for.
+
+    The limiter can be shared between threads.
+    """
+
+    def __init__(
+        self,
+        *,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self._clock = clock
+        self._sleep = sleep
+        self._quotas: dict[str, GithubQuota] = {}
+        self._last_request_at: dict[str, float] = {}
+        self._paused_until = 0.0
+        self._logged_wait_until = 0.0
+        self._lock = threading.Lock()
+
+    def quota(self, resource: str = "core") -> GithubQuota | None:
+        """Return the last known quota of a resource, if any."""
+        with self._lock:
+            return self._quotas.get(resource)
+
+    def acquire(self, resource: str) -> None:
+        """Wait until a request to a resource can be sent within the rate limits."""
+        while (delay := self._try_acquire(resource)) > 0:
+            self._sleep(delay)
+
+    def record(self, response: Response) -> float | None:
+        """Update the quotas from the headers of a response.
+
+        Returns:
+            The number of seconds to wait before sending the request again if Github
+            rejected it because of a rate limit, otherwise None.
+        """
+        headers = response.headers
+        now = self._clock()
+        quota = _parse_quota(headers)
+        with self._lock:
+            if quota is not None:
+                self._quotas[quota.resource] = quota
+
+            if response.status_code not in {
+                HTTPStatus.FORBIDDEN,
+                HTTPStatus.TOO_MANY_REQUESTS,
+            }:
+                return None
+            if retry_after := headers.get("Retry-After"):
+                delay = float(retry_after)
+            elif quota is not None and quota.remaining == 0:
+                # The primary rate limit is exhausted, the requests to this resource wait
+                # for the reset
+                return max(0.0, quota.reset_at + _RESET_MARGIN_SECONDS - now)
+            elif (
+                response.status_code == HTTPStatus.TOO_MANY_REQUESTS
+                or "rate limit" in response.text.lower()
+            ):
+                delay = _SECONDARY_RATE_LIMIT_WAIT_SECONDS
+            else:
+                # The request is forbidden for another reason
+                return None
+
+            self._paused_until = max(self._paused_until, now + delay)
+            return delay
+
+    def describe(self) -> str:
+        """Describe the known quotas, and how long requests are waiting for, if at all."""
+        with self._lock:
+            now = self._clock()
+            quotas = sorted(self._quotas.values(), key=lambda quota: quota.resource)
+            wait = max(
+                (
+                    self._paused_until,
+                    *(
+                        quota.reset_at + _RESET_MARGIN_SECONDS
+                        for quota in quotas
+                        if quota.remaining <= 0
+                    ),
+                )
+            )
+
+        description = ", ".join(
+            f"GitHub {quota.resource} quota: {quota.remaining}/{quota.limit}"
+            for quota in quotas
+        )
+        if wait > now:
+            description += f" (waiting {math.ceil(wait - now)}s)"
+        return description
+
+    def _try_acquire(self, resource: str) -> float:
+        """Take a request from the quota of a resource, or return how long to wait."""
+        with self._lock:
+            now = self._clock()
+            # Requests are blocked by secondary rate limits and exhausted quotas, and
+            # paced when the quota runs low
+            blocked_until = self._paused_until
+            ready_at = 0.0
+            quota = self._quotas.get(resource)
+            if quota is not None and quota.reset_at > now:
+                if quota.remaining <= 0:
+                    blocked_until = max(
+                        blocked_until, quota.reset_at + _RESET_MARGIN_SECONDS
+                    )
+                elif quota.remaining < quota.limit * _PACING_THRESHOLD:
+                    interval = (quota.reset_at - now) / quota.remaining
+                    last_request_at = self._last_request_at.get(resource, -math.inf)
+                    ready_at = last_request_at + interval
+
+            if blocked_until > now and blocked_until != self._logged_wait_until:
+                self._logged_wait_until = blocked_until
+                logger.info(
+                    "GitHub rate limit reached, waiting until {time} to resume",
+                    time=datetime.fromtimestamp(blocked_until).strftime("%X"),
+                )
+            if (ready_at := max(ready_at, blocked_until)) > now:
+                return ready_at - now
+
+            # Count the request right away, so that concurrent requests do not all spend
+            # the last requests of the quota
+            if quota is not None and quota.reset_at > now:
+                self._quotas[resource] = replace(quota, remaining=quota.remaining - 1)
+            self._last_request_at[resource] = now
+            return 0.0
+
+
+class RateLimitedHTTPAdapter(HTTPAdapter):
+    """A transport adapter pacing Github requests with a rate limiter.
+
+    Requests rejected because of a rate limit are sent again once the limit allows it.
+
+    Attributes:
+        rate_limiter: The rate limiter shared by the requests of the client.
+    """
+
+    def __init__(self, rate_limiter: GithubRateLimiter, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.rate_limiter = rate_limiter
+
+    def send(  # type: ignore[override]
+        self, request: PreparedRequest, **kwargs: Any
+    ) -> Response:
+        """Send a request once the rate limits allow it."""
+        resource = _request_resource(request.url or "")
+        attempts = 1
+        while True:
+            self.rate_limiter.acquire(resource)
+            response = super().send(request, **kwargs)
+            if (
+                self.rate_limiter.record(response) is None
+                or attempts == _MAX_RATE_LIMITED_ATTEMPTS
+            ):
+                return response
+            response.close()
+            attempts += 1
+
+
+@dataclass
+class GithubCacheStats:
+    """Counts of how the cacheable Github requests of a run were answered.
+
+    Attributes:
+        served: The number of responses served from disk without any request.
+        not_modified: The number of responses revalidated by Github as not modified.
+        fetched: The number of responses fetched from Github.
+    """
+
+    served: int = 0
+    not_modified: int = 0
+    fetched: int = 0
+
+    @property
+    def total(self) -> int:
+        """The number of cacheable requests."""
+        return self.served + self.not_modified + self.fetched
+
+
+class CachingHTTPAdapter(RateLimitedHTTPAdapter):
+    """A transport adapter serving Github responses from a persistent cache.
+
+    Only successful `GET` responses are cached. Responses for commits addressed by their
+    SHA are served from the cache without any request, and other responses are
+    revalidated with their `ETag`. The requests that are sent are paced by the rate
+    limiter.
+
+    Attributes:
+        cache: The cache storing the responses.
+        stats: How the cacheable requests were answered so far.
+    """
+
+    def __init__(
+        self,
+        cache: ResponseCache,
+        stats: GithubCacheStats,
+        rate_limiter: GithubRateLimiter,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(rate_limiter, **kwargs)
+        self.cache = cache
+        self.stats = stats
+        self._lock = threading.Lock()
+
+    def send(  # type: ignore[override]
+        self, request: PreparedRequest, stream: bool = False, **kwargs: Any
+    ) -> Response:
+        """Send a request, answering it from the cache when possible."""
+        if request.method != "GET" or stream or request.url is None:
+            return super().send(request, stream=stream, **kwargs)
+
+        key = _cache_key(request)
+        cached = self.cache.get(key)
+        entry = _CachedResponse.from_json(cached) if cached is not None else None
+
+        if entry is not None and _is_immutable(request.url):
+            self._count("served")
+            return entry.to_response(request)
+
+        if entry is not None and entry.etag:
+            request.headers["If-None-Match"] = entry.etag
+
+        response = super().send(request, stream=stream, **kwargs)
+
+        if response.status_code == 304 and entry is not None:  # noqa: PLR2004
+            self._count("not_modified")
+            return entry.to_response(request, fresh_headers=response.headers)
+
+        self._count("fetched")
+        if response.status_code == 200 and (  # noqa: PLR2004
+            "ETag" in response.headers or _is_immutable(request.url)
+        ):
+            self.cache.set(key, _CachedResponse.from_response(response).to_json())
+        return response
+
+    def _count(self, outcome: str) -> None:
+        with self._lock:
+            setattr(self.stats, outcome, getattr(self.stats, outcome) + 1)
+
+
+def open_github_client(
+    *,
+    auth: Auth | None,
+    pool_size: int | None = None,
+    cache: ResponseCache | None = None,
+    stats: GithubCacheStats | None = None,
+    rate_limiter: GithubRateLimiter | None = None,
+    **options: Any,
+) -> Github:
+    """Create a Github client, optionally pacing its requests and caching its responses.
+
+    Args:
+        auth: The authentication of the client, or None for anonymous requests.
+        pool_size: The number of connections kept open, which should be at least the
+            number of concurrent requests.
+        cache: The cache storing Github responses. If None, responses are not cached.
+        stats: Counts of how the cacheable requests are answered, updated as requests are
+            sent. Ignored if there is no cache.
+        rate_limiter: The rate limiter pacing the requests of the client. If None,
+            requests are only paced when there is a cache, by a rate limiter of their own.
+        **options: Other arguments of the Github client, such as its base URL.
+
+    Returns:
+        The Github client.
+    """
+    if cache is None and rate_limiter is None:
+        return Github(auth=auth, pool_size=pool_size, **options)
+
+    rate_limiter = rate_limiter or GithubRateLimiter()
+    adapter_factory: Callable[..., HTTPAdapter] = (
+        partial(RateLimitedHTTPAdapter, rate_limiter)
+        if cache is None
+        else partial(
+            CachingHTTPAdapter, cache, stats or GithubCacheStats(), rate_limiter
+        )
+    )
+    # Requesters pick their connection class when they are created, so the injected
+    # classes only apply to this client.
+    Requester.injectConnectionClasses(*_connection_classes(adapter_factory))
+    try:
+        return Github(auth=auth, pool_size=pool_size, **options)
+    finally:
+        Requester.resetConnectionClasses()
+
+
+def _connection_classes(
+    adapter_factory: Callable[..., HTTPAdapter],
+) -> tuple[type[HTTPRequestsConnectionClass], type[HTTPSRequestsConnectionClass]]:
+    """Build PyGithub connection classes sending requests through the given adapters."""
+
+    class HTTPConnection(HTTPRequestsConnectionClass):
+        def __init__(self, *args: Any, **kwargs: Any) -> None:
+            super().__init__(*args, **kwargs)
+            self.adapter = adapter_factory(
+                max_retries=self.retry,
+                pool_connections=self.pool_size,
+                pool_maxsize=self.pool_size,
+            )
+            self.session.mount("http://", self.adapter)
+
+    class HTTPSConnection(HTTPSRequestsConnectionClass):
+        def __init__(self, *args: Any, **kwargs: Any) -> None:
+            super().__init__(*args, **kwargs)
+            self.adapter = adapter_factory(
+                max_retries=self.retry,
+                pool_connections=self.pool_size,
+                pool_maxsize=self.pool_size,
+            )
+            self.session.mount("https://", self.adapter)
+
+    return HTTPConnection, HTTPSConnection
+
+
+@dataclass(frozen=True, slots=True)
+class _CachedResponse:
+    """A successful Github response, as stored in the cache."""
+
+    headers: dict[str, str]
+    body: str
+
+    @property
+    def etag(self) -> str | None:
+        return self.headers.get("etag")
+
+    @classmethod
+    def from_response(cls, response: Response) -> _CachedResponse:
+        return cls(
+            headers={
+                name.lower(): value
+                for name, value in response.headers.items()
+                if not name.lower().startswith(_RATE_LIMIT_HEADER_PREFIX)
+            },
+            body=response.text,
+        )
+
+    @classmethod
+    def from_json(cls, value: str) -> _CachedResponse:
+        return cls(**json.loads(value))
+
+    def to_json(self) -> str:
+        return json.dumps({"headers": self.headers, "body": self.body})
+
+    def to_response(
+        self,
+        request: PreparedRequest,
+        fresh_headers: CaseInsensitiveDict[str] | None = None,
+    ) -> Response:
+        response = Response()
+        response.status_code = 200
+        response.headers = CaseInsensitiveDict(self.headers)
+        for name, value in (fresh_headers or {}).items():
+            if not name.lower().startswith(_BODY_HEADER_PREFIXES):
+                response.headers[name] = value
+        # The body is stored decoded, so it must not be decoded again
+        response.headers.pop("content-encoding", None)
+        response._content = self.body.encode()
+        response.encoding = "utf-8"
+        response.url = request.url or ""
+        response.request = request
+        return response
+
+
+def _cache_key(request: PreparedRequest) -> str:
+    """Compute the cache key of a request.
+
+    Responses depend on the credentials, which decide what is visible, and on the
+    requested media type.
+    """
+    payload = json.dumps(
+        {
+            "url": request.url,
+            "authorization": hashlib.sha256(
+                request.headers.get("Authorization", "").encode()
+            ).hexdigest(),
+            "accept": request.headers.get("Accept", ""),
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _parse_quota(headers: CaseInsensitiveDict[str]) -> GithubQuota | None:
+    """Parse the quota reported in the headers of a Github response, if any."""
+    try:
+        return GithubQuota(
+            resource=headers.get("X-RateLimit-Resource", "core"),
+            limit=int(headers["X-RateLimit-Limit"]),
+            remaining=int(headers["X-RateLimit-Remaining"]),
+            reset_at=float(headers["X-RateLimit-Reset"]),
+        )
+    except (KeyError, ValueError):
+        return None
+
+
+def _request_resource(url: str) -> str:
+    """Return the Github API resource whose quota a request counts against."""
+    path = urlsplit(url).path.removeprefix("/api/v3").removeprefix("/api")
+    if path == "/graphql":
+        return "graphql"
+    if path.startswith("/search/"):
+        return "search"
+    return "core"
+
+
+def _is_immutable(url: str) -> bool:
+    """Whether the response for a URL can never change."""
+    return _IMMUTABLE_PATH_PATTERN.match(urlsplit(url).path) is not None
@@ -0,0 +1,288 @@
+"""Overlap blocking work with the generation of the brag document.
+
+Extracting and batching commits is blocking work, while the brag document is generated
+by asynchronous model calls. `iterate_in_thread` runs a blocking iterable in a worker
+thread and hands its items over to the event loop through a bounded queue. Model calls
+then start as soon as the first item is ready. At most a fixed number of items wait in
+the queue, so memory use depends on the capacity of the queue rather than on the number
+of items.
+
+`prefetch` and `map_async` apply the same idea to asynchronous iterables: the former
+reads ahead of the consumer, and the latter runs a coroutine function over the items
+with bounded concurrency.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+from collections import deque
+from collections.abc import (
+    AsyncGenerator,
+    AsyncIterable,
+    Awaitable,
+    Callable,
+    Iterable,
+)
+from contextlib import suppress
+from dataclasses import dataclass
+from typing import Final
+
+# How long a consumer that stops early waits for the worker thread to close the iterator
+_WORKER_STOP_TIMEOUT: Final = 1.0
+
+
+@dataclass(frozen=True, slots=True)
+class _Item[T]:
+    value: T
+
+
+@dataclass(frozen=True, slots=True)
+class _Failure:
+    error: BaseException
+
+
+@dataclass(frozen=True, slots=True)
+class _Done:
+    pass
+
+
+def iterate_in_thread[T](
+    iterable: Iterable[T],
+    *,
+    max_pending: int,
+) -> AsyncGenerator[T]:
+    """Iterate over a blocking iterable in a worker thread, yielding its items asynchronously.
+
+    The worker thread runs ahead of the consumer, but waits for fewer than `max_pending`
+    items to be waiting to be consumed before producing the next one. If the iterable
+    raises an exception, it is raised by the consumer after the items yielded before it.
+    If the consumer stops early, the worker thread stops after the item it is producing,
+    and closes the iterator. A consumer that is closed waits a moment for this, and a
+    consumer that is cancelled does not wait at all, since producing an item may block
+    for long, for example while waiting for a rate limit to reset.
+
+    Args:
+        iterable: The blocking iterable to iterate over.
+        max_pending: The maximum number of items produced ahead of the consumer.
+
+    Returns:
+        An asynchronous generator over the items of the iterable, in order. Close it, for
+        example with `contextlib.aclosing`, to stop the worker thread if the iteration
+        stops early.
+
+    Raises:
+        ValueError: If max_pending is not positive.
+    """
+    if max_pending <= 0:
+        raise ValueError("max_pending must be positive")
+
+    return _iterate_in_thread(iterable, max_pending)
+
+
+async def _iterate_in_thread[T](
+    iterable: Iterable[T], max_pending: int
+) -> AsyncGenerator[T]:
+    loop = asyncio.get_running_loop()
+    # One more slot for the end of the iteration, so that it never waits for room
+    queue: asyncio.Queue[_Item[T] | _Failure | _Done] = asyncio.Queue(max_pending + 1)
+    free_slots = threading.Semaphore(max_pending)
+    stopped = threading.Event()
+
+    def hand_over(item: _Item[T] | _Failure | _Done) -> None:
+        # The consumer may have stopped without waiting, and its loop may be closed
+        if not stopped.is_set():
+            with suppress(RuntimeError):
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+
+    def produce() -> None:
+        iterator = iter(iterable)
+        try:
+            while True:
+                # Wait for the consumer to make room before producing the next item,
+                # unless it stopped
+                free_slots.acquire()
+                if stopped.is_set():
+                    return
+                try:
+                    value = next(iterator)
+                except StopIteration:
+                    break
+                hand_over(_Item(value))
+        except BaseException as error:
+            # Raise the error in the consumer instead
+            hand_over(_Failure(error))
+        else:
+            hand_over(_Done())
+        finally:
+            # Generators must be closed by the thread running them
+            if (close := getattr(iterator, "close", None)) is not None:
+                close()
+
+    # A daemon thread, rather than `asyncio.to_thread`, so that a worker still producing
+    # an item does not hold up the shutdown of the event loop or of the interpreter
+    producer = threading.Thread(target=produce, name="iterate-in-thread", daemon=True)
+    producer.start()
+    cancelled = False
+    try:
+        while True:
+            match await queue.get():
+                case _Item(value=value):
+                    free_slots.release()
+                    yield value
+                case _Failure(error=error):
+                    raise error
+                case _Done():
+                    return
+    except asyncio.CancelledError:
+        cancelled = True
+        raise
+    finally:
+        stopped.set()
+        # Wake up the producer if it is waiting for room
+        free_slots.release()
+        if not cancelled:
+            await asyncio.to_thread(producer.join, _WORKER_STOP_TIMEOUT)
+
+
+def prefetch[T](
+    iterable: AsyncIterable[T],
+    *,
+    max_pending: int,
+) -> AsyncGenerator[T]:
+    """Read ahead of the consumer of an asynchronous iterable.
+
+    A background task iterates over the iterable, and stops once `max_pending` items are
+    waiting to be consumed. If the iterable raises an exception, it is raised by the
+    consumer after the items yielded before it.
+
+    Args:
+        iterable: The asynchronous iterable to read ahead of.
+        max_pending: The maximum number of items read ahead of the consumer.
+
+    Returns:
+        An asynchronous generator over the items of the iterable, in order. Close it to
+        stop the background task if the iteration stops early.
+
+    Raises:
+        ValueError: If max_pending is not positive.
+    """
+    if max_pending <= 0:
+        raise ValueError("max_pending must be positive")
+
+    return _prefetch(iterable, max_pending)
+
+
+async def _prefetch[T](
+    iterable: AsyncIterable[T], max_pending: int
+) -> AsyncGenerator[T]:
+    # One more slot for the end of the iteration, so that it never waits for room
+    queue: asyncio.Queue[_Item[T] | _Failure | _Done] = asyncio.Queue(max_pending + 1)
+    free_slots = asyncio.Semaphore(max_pending)
+
+    async def produce() -> None:
+        try:
+            async for value in iterable:
+                await free_slots.acquire()
+                queue.put_nowait(_Item(value))
+        except Exception as error:
+            # Raise the error in the consumer instead
+            queue.put_nowait(_Failure(error))
+        else:
+            queue.put_nowait(_Done())
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            match await queue.get():
+                case _Item(value=value):
+                    free_slots.release()
+                    yield value
+                case _Failure(error=error):
+                    raise error
+                case _Done():
+                    return
+    finally:
+        producer.cancel()
+        with suppress(asyncio.CancelledError):
+            await producer
+
+
+def map_async[T, R](
+    function: Callable[[T], Awaitable[R]],
+    items: Iterable[T] | AsyncIterable[T],
+    *,
+    concurrency: int,
+    ordered: bool = True,
+) -> AsyncGenerator[R]:
+    """Map a coroutine function over items, running up to `concurrency` calls at a time.
+
+    Items are taken lazily, so that at most `concurrency` calls are running or waiting to
+    be yielded at any time. If the consumer stops early, the pending calls are cancelled.
+
+    Args:
+        function: The coroutine function to map over the items.
+        items: The items to map the function over, provided synchronously or
+            asynchronously.
+        concurrency: The maximum number of calls running at the same time.
+        ordered: Whether results are yielded in the order of the items, rather than as
+            soon as they are available.
+
+    Returns:
+        An asynchronous generator over the results of the function.
+
+    Raises:
+        ValueError: If concurrency is not positive.
+    """
+    if concurrency <= 0:
+        raise ValueError("concurrency must be positive")
+
+    return _map_async(function, aiterate(items), concurrency, ordered=ordered)
+
+
+async def _map_async[T, R](
+    function: Callable[[T], Awaitable[R]],
+    items: AsyncGenerator[T],
+    concurrency: int,
+    *,
+    ordered: bool,
+) -> AsyncGenerator[R]:
+    pending: deque[asyncio.Future[R]] = deque()
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < concurrency:
+                try:
+                    item = await anext(items)
+                except StopAsyncIteration:
+                    exhausted = True
+                else:
+                    pending.append(asyncio.ensure_future(function(item)))
+            if not pending:
+                return
+
+            if ordered:
+                yield await pending.popleft()
+                continue
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            pending = deque(future for future in pending if future not in done)
+            for future in done:
+                yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        await items.aclose()
+
+
+async def aiterate[T](items: Iterable[T] | AsyncIterable[T]) -> AsyncGenerator[T]:
+    """Iterate asynchronously over items provided either synchronously or asynchronously.
+
+    Synchronous iterables are expected not to block, see `iterate_in_thread` otherwise.
+    """
+    if isinstance(items, AsyncIterable):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
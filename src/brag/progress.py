@@ -1,8 +1,17 @@
 """Helper functions for tracking the progress of long-running operations."""
 
-from collections.abc import Iterable, Iterator
+from collections.abc import AsyncIterable, AsyncIterator, Callable, Iterable, Iterator
 
-from rich.progress import BarColumn, MofNCompleteColumn, Progress, SpinnerColumn
+from rich.progress import (
+    BarColumn,
+    MofNCompleteColumn,
+    Progress,
+    ProgressColumn,
+    SpinnerColumn,
+    Task,
+    TaskID,
+)
+from rich.text import Text
 
 
 def track_iterable_progress[T](
@@ -10,28 +19,104 @@ def track_iterable_progress[T](
     /,
     *,
     description: str,
+    total: int | None = None,
+    status: Callable[[], str] | None = None,
+    progress: Progress | None = None,
 ) -> Iterator[T]:
     """Track the progress of an iterable.
 
     This function is a helper that creates a progress bar and tracks the progress of
     an iterable. It's useful for tracking the progress of a long-running operation,
     such as generating the brag document.
+
+    The length of the iterable is never computed, since listing every item can be as
+    slow as the operation itself. Instead, the expected number of items can be given as
+    `total`, possibly as an estimate. Without it, the progress bar is indeterminate
+    until the iterable is exhausted.
+
+    If a status function is provided, its result is shown after the progress bar and
+    refreshed with it, for example to show the remaining API quota.
+
+    If a progress display is provided, the iterable is tracked as a new bar of this
+    display instead, so that several iterables can be tracked at the same time. The
+    iterable can then be consumed from another thread.
+    """
+    if progress is None:
+        with progress_display(status=status) as display:
+            yield from track_iterable_progress(
+                iterable, description=description, total=total, progress=display
+            )
+        return
+
+    task_id = progress.add_task(description, total=total)
+    completed = 0
+    for item in iterable:
+        yield item
+        completed += 1
+        progress.update(task_id, completed=completed)
+    # The total may have been an estimate
+    progress.update(task_id, total=completed)
+
+
+async def track_async_iterable_progress[T](
+    iterable: AsyncIterable[T],
+    /,
+    *,
+    description: str,
+    progress: Progress,
+) -> AsyncIterator[T]:
+    """Track the progress of an asynchronous iterable as a new bar of a progress display.
+
+    The number of items is not known in advance, so the bar shows how many items were
+    consumed until the iterable is exhausted. The bar is only added once the first item
+    is available.
     """
-    with _progress_bar(description=description) as progress:
-        yield from progress.track(iterable)
+    task_id: TaskID | None = None
+    completed = 0
+    async for item in iterable:
+        # Show the bar once there is something to process
+        if task_id is None:
+            task_id = progress.add_task(description, total=None)
+        yield item
+        completed += 1
+        progress.update(task_id, completed=completed)
+    if task_id is not None:
+        progress.update(task_id, total=completed)
 
 
-def _progress_bar(*, description: str) -> Progress:
-    """Create a progress bar with a description.
+def progress_display(*, status: Callable[[], str] | None = None) -> Progress:
+    """Create a progress display, showing a progress bar for each tracked iterable.
 
-    This function is a helper that creates a progress bar with a description.
-    Useful for ensuring a consistent progress bar across the CLI.
+    This function is a helper that creates a progress display with consistent columns
+    across the CLI. If a status function is provided, its result is shown after each
+    progress bar.
     """
     return Progress(
         SpinnerColumn(spinner_name="point"),
-        f"[progress.description]{description}",
+        "[progress.description]{task.description}",
         MofNCompleteColumn(),
         BarColumn(),
-        "[progress.percentage]({task.percentage:>3.0f}%)",
+        _PercentageColumn(),
         "[progress.elapsed](Elapsed: {task.elapsed:.2f}s)",
+        *([_StatusColumn(status)] if status is not None else []),
     )
+
+
+class _PercentageColumn(ProgressColumn):
+    """A progress column showing the percentage of completion, if the total is known."""
+
+    def render(self, task: Task) -> Text:
+        if task.total is None:
+            return Text("")
+        return Text(f"({task.percentage:>3.0f}%)", style="progress.percentage")
+
+
+class _StatusColumn(ProgressColumn):
+    """A progress column showing the result of a status function."""
+
+    def __init__(self, status: Callable[[], str]) -> None:
+        super().__init__()
+        self._status = status
+
+    def render(self, task: Task) -> Text:
+        return Text(self._status(), style="progress.data.speed")
@@ -0,0 +1,398 @@
+"""Schedule LLM requests within the provider's rate limits.
+
+This module provides a scheduler that sits between the agents and pydantic-ai. It:
+
+- Runs up to a bounded number of requests concurrently.
+- Enforces requests-per-minute and tokens-per-minute budgets with token buckets.
+- Adapts the concurrency limit to the provider's capacity using AIMD (additive increase,
+  multiplicative decrease): the limit is cut on rate limiting or overload errors and
+  slowly ramped back up on success.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import math
+import time
+from collections.abc import Awaitable, Callable
+from typing import Final
+
+from loguru import logger
+from pydantic_ai import Agent
+from pydantic_ai.agent import AgentRunResult
+from pydantic_ai.exceptions import ModelHTTPError
+from pydantic_ai.messages import ModelResponse
+from pydantic_ai.result import StreamedRunResult
+from pydantic_ai.usage import RunUsage
+
+from brag.models import TokenCount
+from brag.tokens import DEFAULT_TOKEN_ESTIMATOR, TokenEstimator
+
+RETRYABLE_STATUS_CODES: Final[frozenset[int]] = frozenset(
+    {
+        429,  # Too Many Requests
+        503,  # Service Unavailable
+        529,  # Overloaded (Anthropic)
+    }
+)
+
+_SECONDS_PER_MINUTE: Final = 60.0
+
+
+class TokenBucket:
+    """A token bucket that refills continuously up to its capacity.
+
+    Attributes:
+        capacity: The maximum number of tokens the bucket can hold.
+        refill_rate: The number of tokens added to the bucket per second.
+    """
+
+    def __init__(
+        self,
+        capacity: float,
+        refill_rate: float,
+        *,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        if refill_rate <= 0:
+            raise ValueError("refill_rate must be positive")
+
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self._clock = clock
+        self._tokens = capacity
+        self._updated_at = clock()
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def per_minute(cls, amount: float) -> TokenBucket:
+        """Create a bucket that allows `amount` tokens per minute."""
+        return cls(capacity=amount, refill_rate=amount / _SECONDS_PER_MINUTE)
+
+    def try_acquire(self, amount: float) -> float:
+        """Try to take `amount` tokens from the bucket.
+
+        Amounts larger than the bucket capacity are clamped to the capacity, so that they
+        are eventually granted instead of waiting forever.
+
+        Returns:
+            Zero if the tokens were taken, otherwise the number of seconds to wait until
+            enough tokens are available.
+        """
+        amount = min(amount, self.capacity)
+        self._refill()
+        if self._tokens >= amount:
+            self._tokens -= amount
+            return 0.0
+        return (amount - self._tokens) / self.refill_rate
+
+    def refund(self, amount: float) -> None:
+        """Put back tokens taken for a request that did not use them.
+
+        Amounts are clamped to the capacity, like in `try_acquire`.
+        """
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens + min(amount, self.capacity))
+
+    async def acquire(self, amount: float) -> None:
+        """Wait until `amount` tokens are available and take them from the bucket.
+
+        Waiters are served in order, so that large requests are not starved by small ones.
+        """
+        async with self._lock:
+            while (delay := self.try_acquire(amount)) > 0:
+                await asyncio.sleep(delay)
+
+    def _refill(self) -> None:
+        now = self._clock()
+        elapsed = now - self._updated_at
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.refill_rate)
+        self._updated_at = now
+
+
+class AIMDConcurrencyLimiter:
+    """A concurrency limiter whose limit adapts using AIMD.
+
+    Every successful request increases the limit by `1 / limit`, that is, by roughly one
+    slot per round of requests. Every overload signal multiplies the limit by
+    `decrease_factor`, unless the limit was already decreased since the failing request
+    started. The limit always stays between `min_limit` and `max_limit`.
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        *,
+        min_limit: int = 1,
+        decrease_factor: float = 0.5,
+    ) -> None:
+        if min_limit < 1:
+            raise ValueError("min_limit must be at least 1")
+        if max_limit < min_limit:
+            raise ValueError("max_limit must be greater than or equal to min_limit")
+        if not 0 < decrease_factor < 1:
+            raise ValueError("decrease_factor must be between 0 and 1")
+
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self._limit = float(max_limit)
+        self._in_flight = 0
+        self._window = 0
+        self._condition = asyncio.Condition()
+
+    @property
+    def limit(self) -> int:
+        """The current number of requests allowed to run concurrently."""
+        return max(self.min_limit, math.floor(self._limit))
+
+    @property
+    def in_flight(self) -> int:
+        """The number of requests currently running."""
+        return self._in_flight
+
+    @property
+    def window(self) -> int:
+        """The number of times the limit was decreased, identifying the current window."""
+        return self._window
+
+    async def acquire(self) -> None:
+        """Wait for a free slot and take it."""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+
+    async def release(self) -> None:
+        """Release a slot taken with `acquire`."""
+        async with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self) -> None:
+        """Additively increase the limit after a successful request."""
+        self._limit = min(float(self.max_limit), self._limit + 1 / self._limit)
+
+    def on_overload(self, window: int | None = None) -> None:
+        """Multiplicatively decrease the limit after a rate limiting or overload error.
+
+        Requests that were already in flight when the limit was decreased usually fail
+        from the same overload, and must not decrease it again.
+
+        Args:
+            window: The `window` in which the failing request started. If provided, the
+                limit is only decreased if it was not decreased since then.
+        """
+        if window is not None and window != self._window:
+            return
+        self._limit = max(float(self.min_limit), self._limit * self.decrease_factor)
+        self._window += 1
+
+
+class LLMScheduler:
+    """Run agent requests concurrently within the provider's rate limits.
+
+    Requests that fail with a rate limiting or overload error are retried with exponential
+    backoff, and the concurrency limit is reduced until the provider recovers. Requests
+    only take from the rate limit budgets once they have a concurrency slot, and the
+    tokens of the failed attempts are put back in the tokens-per-minute budget.
+
+    Attributes:
+        max_concurrency: The maximum number of requests running at the same time.
+        requests_per_minute: An optional requests-per-minute budget.
+        tokens_per_minute: An optional tokens-per-minute budget. Prompt sizes are
+            estimated with the token estimator.
+        max_retries: The maximum number of retries for a request that keeps failing with
+            a rate limiting or overload error.
+        initial_backoff: The number of seconds to wait before the first retry. The
+            delay doubles with every subsequent retry.
+        max_backoff: The maximum number of seconds to wait between retries.
+        token_estimator: The estimator used to measure the size of the prompts.
+        usage: The usage reported by the provider for all the completed requests,
+            including how many input tokens were read from its prompt cache.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        *,
+        requests_per_minute: int | None = None,
+        tokens_per_minute: TokenCount | None = None,
+        max_retries: int = 5,
+        initial_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        token_estimator: TokenEstimator = DEFAULT_TOKEN_ESTIMATOR,
+    ) -> None:
+        if max_retries < 0:
+            raise ValueError("max_retries must not be negative")
+
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.token_estimator = token_estimator
+        self.usage = RunUsage()
+
+        self._concurrency = AIMDConcurrencyLimiter(max_concurrency)
+        self._request_bucket = (
+            TokenBucket.per_minute(requests_per_minute)
+            if requests_per_minute is not None
+            else None
+        )
+        self._token_bucket = (
+            TokenBucket.per_minute(tokens_per_minute)
+            if tokens_per_minute is not None
+            else None
+        )
+
+    @property
+    def concurrency_limit(self) -> int:
+        """The current, adaptive, concurrency limit."""
+        return self._concurrency.limit
+
+    async def run[T](
+        self,
+        agent: Agent[None, T],
+        prompt: str,
+        *,
+        token_count: TokenCount | None = None,
+    ) -> AgentRunResult[T]:
+        """Run an agent on a prompt once the rate limits allow it.
+
+        Args:
+            agent: The agent to run.
+            prompt: The user prompt to run the agent on.
+            token_count: The number of tokens the request is expected to consume,
+                including the system prompt. If not provided, it is estimated from the
+                user prompt alone.
+
+        Returns:
+            The result of the agent run.
+
+        Raises:
+            ModelHTTPError: If the request fails with a non-retryable error, or keeps
+                failing after `max_retries` retries.
+        """
+        result = await self._run_with_retries(
+            lambda: agent.run(prompt),
+            token_count=(
+                self.token_estimator.estimate(prompt)
+                if token_count is None
+                else token_count
+            ),
+        )
+        self._record_usage(result)
+        return result
+
+    async def run_stream(
+        self,
+        agent: Agent[None, str],
+        prompt: str,
+        *,
+        on_text: Callable[[str], object],
+        token_count: TokenCount | None = None,
+    ) -> StreamedRunResult[None, str]:
+        """Run an agent on a prompt once the rate limits allow it, streaming its output.
+
+        The output is passed to `on_text` piece by piece as the model generates it. Text
+        passed on cannot be taken back, so a request is only retried if it fails before
+        generating any text.
+
+        Args:
+            agent: The agent to run.
+            prompt: The user prompt to run the agent on.
+            on_text: Called with every piece of text generated by the model, in order.
+            token_count: The number of tokens the request is expected to consume,
+                including the system prompt. If not provided, it is estimated from the
+                user prompt alone.
+
+        Returns:
+            The completed result of the agent run.
+
+        Raises:
+            ModelHTTPError: If the request fails with a non-retryable error, keeps
+                failing after `max_retries` retries, or fails after generating text.
+        """
+        generated_text = False
+
+        async def stream() -> StreamedRunResult[None, str]:
+            nonlocal generated_text
+            async with agent.run_stream(prompt) as result:
+                async for text in result.stream_text(delta=True, debounce_by=None):
+                    generated_text = True
+                    on_text(text)
+            return result
+
+        result = await self._run_with_retries(
+            stream,
+            token_count=(
+                self.token_estimator.estimate(prompt)
+                if token_count is None
+                else token_count
+            ),
+            can_retry=lambda: not generated_text,
+        )
+        self._record_usage(result)
+        return result
+
+    def _record_usage(
+        self, result: AgentRunResult[object] | StreamedRunResult[None, str]
+    ) -> None:
+        """Add the usage reported for the responses of a completed run."""
+        for message in result.new_messages():
+            if isinstance(message, ModelResponse):
+                self.usage.requests += 1
+                self.usage.incr(message.usage)
+
+    async def _run_with_retries[R](
+        self,
+        request: Callable[[], Awaitable[R]],
+        *,
+        token_count: TokenCount,
+        can_retry: Callable[[], bool] = lambda: True,
+    ) -> R:
+        for attempt in itertools.count():
+            # Take a slot first, so that requests waiting for one do not hold a budget
+            await self._concurrency.acquire()
+            window = self._concurrency.window
+            try:
+                await self._acquire_budget(token_count)
+                result = await request()
+            except ModelHTTPError as error:
+                if (
+                    error.status_code not in RETRYABLE_STATUS_CODES
+                    or attempt >= self.max_retries
+                    or not can_retry()
+                ):
+                    raise
+                # The rejected request still counts against the provider's request
+                # budget, but its tokens were not consumed
+                if self._token_bucket is not None:
+                    self._token_bucket.refund(token_count)
+                self._concurrency.on_overload(window)
+                delay = min(self.max_backoff, self.initial_backoff * 2**attempt)
+                logger.warning(
+                    "Model request failed with status {status_code}, retrying in {delay:.1f}s with a concurrency limit of {limit}",
+                    status_code=error.status_code,
+                    delay=delay,
+                    limit=self._concurrency.limit,
+                )
+            else:
+                self._concurrency.on_success()
+                return result
+            finally:
+                await self._concurrency.release()
+
+            await asyncio.sleep(delay)
+
+        raise AssertionError("unreachable")  # pragma: no cover
+
+    async def _acquire_budget(self, token_count: TokenCount) -> None:
+        if self._request_bucket is not None:
+            await self._request_bucket.acquire(1)
+        if self._token_bucket is not None:
+            await self._token_bucket.acquire(token_count)
@@ -1,11 +1,22 @@
-"""Sources of data."""
+"""Sources of data.
+
+Sources are iterated over synchronously with `DataSource`, or asynchronously with
+`AsyncDataSource`, so that sources doing I/O do not block the event loop and can overlap
+their I/O with the processing of the items they already yielded.
+"""
 
 from __future__ import annotations
 
 import abc
-from collections.abc import Callable, Iterator
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator
 from dataclasses import dataclass
+from datetime import datetime
 from itertools import islice
+from typing import Final
+
+from brag.pipeline import iterate_in_thread, map_async, prefetch
+
+DEFAULT_MAX_PENDING: Final = 8
 
 
 class DataSource[T](abc.ABC):
@@ -17,6 +28,18 @@ class DataSource[T](abc.ABC):
     @abc.abstractmethod
     def __len__(self) -> int: ...
 
+    def length_hint(self) -> int | None:
+        """Estimate the number of items this data source yields, without listing them.
+
+        Unlike `len`, which may have to list every item first, the estimate is meant to
+        be cheap enough to show progress before the first item is processed. An estimate
+        of zero means that the data source is empty.
+
+        Returns:
+            The estimated number of items, or None if it cannot be estimated cheaply.
+        """
+        return None
+
     def limit(self, count: int) -> LimitDataSource[T]:
         """Limit the number of items this data source yields."""
         return LimitDataSource(self, count)
@@ -25,6 +48,13 @@ class DataSource[T](abc.ABC):
         """Map a function over a data source."""
         return MapDataSource(self, mapper)
 
+    def to_async(self, max_pending: int = DEFAULT_MAX_PENDING) -> ThreadedDataSource[T]:
+        """Iterate over this data source asynchronously, in a worker thread.
+
+        The worker thread reads up to `max_pending` items ahead of the consumer.
+        """
+        return ThreadedDataSource(self, max_pending)
+
 
 @dataclass(frozen=True, slots=True)
 class LimitDataSource[T](DataSource[T]):
@@ -39,6 +69,11 @@ class LimitDataSource[T](DataSource[T]):
     def __len__(self) -> int:
         return min(self.count, len(self.inner))
 
+    def length_hint(self) -> int | None:
+        """Estimate the number of items from the estimate of the inner data source."""
+        length_hint = self.inner.length_hint()
+        return None if length_hint is None else min(self.count, length_hint)
+
 
 @dataclass(frozen=True, slots=True)
 class MapDataSource[T, R](DataSource[R]):
@@ -52,3 +87,125 @@ class MapDataSource[T, R](DataSource[R]):
 
     def __len__(self) -> int:
         return len(self.inner)
+
+    def length_hint(self) -> int | None:
+        """Estimate the number of items from the estimate of the inner data source."""
+        return self.inner.length_hint()
+
+
+class AsyncDataSource[T](abc.ABC):
+    """A source of data iterated over asynchronously."""
+
+    @abc.abstractmethod
+    def __aiter__(self) -> AsyncIterator[T]: ...
+
+    @abc.abstractmethod
+    def __len__(self) -> int: ...
+
+    def prefetch(self, count: int) -> PrefetchDataSource[T]:
+        """Read up to `count` items ahead of the consumer of this data source."""
+        return PrefetchDataSource(self, count)
+
+    def amap[R](
+        self,
+        mapper: Callable[[T], Awaitable[R]],
+        *,
+        concurrency: int = 1,
+        ordered: bool = True,
+    ) -> AsyncMapDataSource[T, R]:
+        """Map a coroutine function over a data source, running calls concurrently.
+
+        Args:
+            mapper: The coroutine function to map over the items.
+            concurrency: The maximum number of calls running at the same time.
+            ordered: Whether results are yielded in the order of the items, rather than
+                as soon as they are available.
+        """
+        return AsyncMapDataSource(self, mapper, concurrency, ordered=ordered)
+
+
+@dataclass(frozen=True, slots=True)
+class ThreadedDataSource[T](AsyncDataSource[T]):
+    """An asynchronous data source iterating over a data source in a worker thread."""
+
+    inner: DataSource[T]
+    max_pending: int = DEFAULT_MAX_PENDING
+
+    def __post_init__(self) -> None:
+        if self.max_pending < 1:
+            raise ValueError("max_pending must be positive")
+
+    def __aiter__(self) -> AsyncIterator[T]:
+        return iterate_in_thread(self.inner, max_pending=self.max_pending)
+
+    def __len__(self) -> int:
+        return len(self.inner)
+
+
+@dataclass(frozen=True, slots=True)
+class PrefetchDataSource[T](AsyncDataSource[T]):
+    """An asynchronous data source reading ahead of its consumer."""
+
+    inner: AsyncDataSource[T]
+    count: int
+
+    def __post_init__(self) -> None:
+        if self.count < 1:
+            raise ValueError("count must be positive")
+
+    def __aiter__(self) -> AsyncIterator[T]:
+        return prefetch(self.inner, max_pending=self.count)
+
+    def __len__(self) -> int:
+        return len(self.inner)
+
+
+@dataclass(frozen=True, slots=True)
+class AsyncMapDataSource[T, R](AsyncDataSource[R]):
+    """An asynchronous data source that maps a coroutine function over a data source."""
+
+    inner: AsyncDataSource[T]
+    mapper: Callable[[T], Awaitable[R]]
+    concurrency: int = 1
+    ordered: bool = True
+
+    def __post_init__(self) -> None:
+        if self.concurrency < 1:
+            raise ValueError("concurrency must be positive")
+
+    def __aiter__(self) -> AsyncIterator[R]:
+        return map_async(
+            self.mapper,
+            self.inner,
+            concurrency=self.concurrency,
+            ordered=self.ordered,
+        )
+
+    def __len__(self) -> int:
+        return len(self.inner)
+
+
+@dataclass(frozen=True, slots=True)
+class CommitRef:
+    """A reference to a commit, used to resume processing after it.
+
+    Attributes:
+        sha: The SHA of the commit.
+        committed_at: The commit date.
+    """
+
+    sha: str
+    committed_at: datetime
+
+
+def latest_datetime(*datetimes: datetime | None) -> datetime | None:
+    """Return the latest of the given datetimes, ignoring None values.
+
+    Naive and timezone-aware datetimes are compared by their POSIX timestamps, naive
+    datetimes being interpreted in the local timezone.
+    """
+    return max(
+        (dt for dt in datetimes if dt is not None),
+        key=datetime.timestamp,
+        default=None,
+    )
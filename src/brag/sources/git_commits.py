@@ -7,57 +7,551 @@ This module provides functionality to:
 
 from __future__ import annotations
 
-from collections.abc import Iterator
+import asyncio
+import os
+import re
+import subprocess
+from collections.abc import AsyncIterator, Iterator, Sequence
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime
-from functools import cached_property
+from functools import cached_property, partial
+from itertools import batched, dropwhile
+from multiprocessing import get_context
 from pathlib import Path
-from typing import Any
+from types import TracebackType
+from typing import IO, Any, Final, Self
 
-from git import Repo
+from git import BadName, Commit, Git, GitCmdObjectDB, GitCommandError, Repo
+from loguru import logger
 
-from brag.sources import DataSource
+from brag.concurrency import map_ordered
+from brag.dedup import PatchId
+from brag.pipeline import map_async
+from brag.sources import AsyncDataSource, CommitRef, DataSource, latest_datetime
+from brag.sources.path_filters import PathFilter, format_omitted_file_diff
+from brag.splitting import ChunkSplit, ChunkSplitter, split_at, split_diff_by_hunk
 
 type GitCommit = str
 
+_FILE_DIFF_PATTERN = re.compile(r"^diff --(?:git|cc|combined) ", re.MULTILINE)
+_FILE_DIFF_HEADER_PATTERN = re.compile(r"^diff --(?:git a/.* b/|cc |combined )(.*)$")
+_GITATTRIBUTES_FILE_NAME = ".gitattributes"
+_STREAM_READ_SIZE: Final = 1 << 16
+# The number of commits extracted at once by each worker process
+_SHARD_SIZE: Final = 64
+# The number of commits whose patch ids are computed at once
+_PATCH_ID_SHARD_SIZE: Final = 256
+
 
 @dataclass(frozen=True, slots=True)
-class GitCommitsSource(DataSource[GitCommit]):
+class GitCommitsSource(DataSource[GitCommit], AsyncDataSource[GitCommit]):
     """A class to load Git commits from a local repository.
 
+    The source opens the repository once, and reuses the `git cat-file` processes
+    GitPython keeps running to read objects. Use the source as a context manager, or call
+    `close`, to stop these processes deterministically.
+
+    Iterating over the source asynchronously runs the same git processes without blocking
+    the event loop.
+
     Attributes:
         path: A Path object representing the local repository.
         author: The username of the author whose commits are being fetched.
         from_date: An optional datetime object representing the start date for fetching commits.
         to_date: An optional datetime object representing the end date for fetching commits.
+        after_commit: An optional reference to an already processed commit. If provided,
+            only commits that are not reachable from it are fetched.
+        path_filter: Decides which file diffs are included. The repository's
+            `.gitattributes` file is also respected.
+        jobs: The number of processes extracting commits. If greater than one, commits
+            are extracted in shards by a pool of processes, each running its own git
+            processes, and yielded in their original order.
     """
 
     path: Path
     author: str
     from_date: datetime | None = None
     to_date: datetime | None = None
+    after_commit: CommitRef | None = None
+    path_filter: PathFilter = PathFilter()
+    jobs: int = 1
+
+    def __post_init__(self) -> None:
+        if self.jobs < 1:
+            raise ValueError("jobs must be positive")
 
     def __iter__(self) -> Iterator[GitCommit]:
-        return (self._repo.git.show(commit) for commit in self._commit_shas)
+        if self.jobs > 1 and len(self._commit_shas) > _SHARD_SIZE:
+            return self._extract_commits_in_parallel()
+        return (
+            omit_excluded_file_diffs(commit, self._path_filter)
+            for commit in _stream_commits(self._repo, self._commit_shas)
+        )
+
+    def __aiter__(self) -> AsyncIterator[GitCommit]:
+        return self._aiter_commits()
 
     def __len__(self) -> int:
         return len(self._commit_shas)
 
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close the repository and stop its persistent git processes, if it was opened."""
+        repo: Repo | None = self.__dict__.pop("_repo", None)
+        if repo is not None:
+            repo.close()
+
+    def length_hint(self) -> int | None:
+        """Count the commits with `git rev-list --count`, without listing them."""
+        if "_commit_shas" in self.__dict__:
+            return len(self._commit_shas)
+        rev, kwargs = self._rev_list_arguments
+        count = int(self._repo.git.rev_list(rev or "HEAD", count=True, **kwargs))
+        # The processed commit was not found, and may be listed again by its date
+        if count and self.after_commit is not None and rev is None:
+            return len(self._commit_shas)
+        return count
+
+    def patch_id(self, commit: GitCommit) -> PatchId | None:
+        """Return the patch ids of a commit yielded by this source, see `brag.dedup`.
+
+        The patch ids are computed with `git patch-id --stable`, for a shard of commits
+        at a time, as the commits are yielded. Merge commits have no patch ids.
+        """
+        _, sha, *_ = commit.split(maxsplit=2)
+        if sha not in self._patch_ids:
+            self._patch_ids.update(self._compute_shard_patch_ids(sha))
+        return self._patch_ids.get(sha)
+
+    def latest_commit(self) -> CommitRef | None:
+        """Return a reference to the most recent commit yielded by this source, if any."""
+        if "_commit_shas" in self.__dict__:
+            if not self._commit_shas:
+                return None
+            commit = self._repo.commit(self._commit_shas[0])
+        else:
+            rev, kwargs = self._rev_list_arguments
+            # The processed commit may be listed among the two most recent ones
+            commits = self._repo.iter_commits(rev, max_count=2, **kwargs)
+            latest = next(filter(self._is_new_commit, commits), None)
+            if latest is None:
+                return None
+            commit = latest
+        return CommitRef(sha=commit.hexsha, committed_at=commit.committed_datetime)
+
     @cached_property
     def _commit_shas(self) -> tuple[GitCommit, ...]:
+        rev, kwargs = self._rev_list_arguments
+        # Get commits for the specified author
+        commits_iter = self._repo.iter_commits(rev, **kwargs)
+        return tuple(
+            commit.hexsha for commit in commits_iter if self._is_new_commit(commit)
+        )
+
+    @cached_property
+    def _commit_indices(self) -> dict[str, int]:
+        return {sha: index for index, sha in enumerate(self._commit_shas)}
+
+    @cached_property
+    def _patch_ids(self) -> dict[str, PatchId | None]:
+        # Filled a shard at a time by `patch_id`
+        return {}
+
+    def _compute_shard_patch_ids(self, sha: str) -> dict[str, PatchId | None]:
+        """Compute the patch ids of the shard of commits starting with a commit."""
+        index = self._commit_indices.get(sha)
+        if index is None:
+            return {sha: None}
+        shard = self._commit_shas[index : index + _PATCH_ID_SHARD_SIZE]
+        forward_patch_ids = _compute_patch_ids(self._repo, shard)
+        reverse_patch_ids = _compute_patch_ids(self._repo, shard, reverse=True)
+        return {
+            shard_sha: PatchId(
+                forward=forward_patch_ids[shard_sha],
+                reverse=reverse_patch_ids[shard_sha],
+            )
+            if shard_sha in forward_patch_ids and shard_sha in reverse_patch_ids
+            else None
+            for shard_sha in shard
+        }
+
+    @cached_property
+    def _rev_list_arguments(self) -> tuple[str | None, dict[str, Any]]:
         # Build kwargs for filtering commits
         kwargs: dict[str, Any] = {"author": self.author}
+        rev: str | None = None
+        since = self.from_date
+
+        if self.after_commit is not None:
+            if self._has_commit(self.after_commit.sha):
+                # Only fetch commits that are not reachable from the processed commit
+                rev = f"{self.after_commit.sha}..HEAD"
+            else:
+                logger.warning(
+                    "Commit {sha} not found in {path}, fetching commits after {date} instead",
+                    sha=self.after_commit.sha,
+                    path=self.path,
+                    date=self.after_commit.committed_at,
+                )
+                since = latest_datetime(since, self.after_commit.committed_at)
 
         # Add date filters if specified
-        if self.from_date is not None:
-            kwargs["since"] = self.from_date
+        if since is not None:
+            kwargs["since"] = since
         if self.to_date is not None:
             kwargs["until"] = self.to_date
+        return rev, kwargs
 
-        # Get commits for the specified author
-        commits_iter = self._repo.iter_commits(**kwargs)
-        return tuple(commit.hexsha for commit in commits_iter)
+    def _is_new_commit(self, commit: Commit) -> bool:
+        return self.after_commit is None or commit.hexsha != self.after_commit.sha
+
+    def _extract_commits_in_parallel(self) -> Iterator[GitCommit]:
+        extract_shard = partial(
+            _extract_commits, self.path, path_filter=self._path_filter
+        )
+        # Spawn workers rather than forking a process that may be running threads
+        with ProcessPoolExecutor(
+            max_workers=self.jobs, mp_context=get_context("spawn")
+        ) as executor:
+            # Bound the number of shards held in memory while waiting for older ones
+            for commits in map_ordered(
+                executor,
+                extract_shard,
+                batched(self._commit_shas, _SHARD_SIZE),
+                max_pending=2 * self.jobs,
+            ):
+                yield from commits
+
+    async def _aiter_commits(self) -> AsyncIterator[GitCommit]:
+        # Listing the commits runs `git rev-list` through GitPython
+        commit_shas = await asyncio.to_thread(lambda: self._commit_shas)
+        path_filter = self._path_filter
+        if self.jobs == 1 or len(commit_shas) <= _SHARD_SIZE:
+            async for commit in _astream_commits(self.path, commit_shas):
+                yield omit_excluded_file_diffs(commit, path_filter)
+            return
+
+        loop = asyncio.get_running_loop()
+        extract_shard = partial(_extract_commits, self.path, path_filter=path_filter)
+        with ProcessPoolExecutor(
+            max_workers=self.jobs, mp_context=get_context("spawn")
+        ) as executor:
+
+            async def extract_shard_in_executor(
+                shard: Sequence[str],
+            ) -> list[GitCommit]:
+                return await loop.run_in_executor(executor, extract_shard, shard)
+
+            async for commits in map_async(
+                extract_shard_in_executor,
+                batched(commit_shas, _SHARD_SIZE),
+                concurrency=2 * self.jobs,
+            ):
+                for commit in commits:
+                    yield commit
+
+    @cached_property
+    def _path_filter(self) -> PathFilter:
+        gitattributes_path = self.path / _GITATTRIBUTES_FILE_NAME
+        if not gitattributes_path.is_file():
+            return self.path_filter
+        return self.path_filter.with_gitattributes(gitattributes_path.read_text())
+
+    def _has_commit(self, sha: str) -> bool:
+        try:
+            self._repo.commit(sha)
+        except (BadName, ValueError):
+            return False
+        return True
 
-    @property
+    @cached_property
     def _repo(self) -> Repo:
-        return Repo(self.path)
+        return Repo(self.path, odbt=GitCmdObjectDB)
+
+
+def split_git_commit_by_file(commit: GitCommit) -> ChunkSplit | None:
+    """Split the output of `git show` into the commit message and the diff of each file."""
+    return split_at(
+        commit, [match.start() for match in _FILE_DIFF_PATTERN.finditer(commit)]
+    )
+
+
+def _extract_commits(
+    path: Path, commit_shas: Sequence[str], path_filter: PathFilter
+) -> list[GitCommit]:
+    """Extract and format commits in a worker process, with its own repository."""
+    with Repo(path, odbt=GitCmdObjectDB) as repo:
+        return [
+            omit_excluded_file_diffs(commit, path_filter)
+            for commit in _stream_commits(repo, commit_shas)
+        ]
+
+
+def _stream_commits(repo: Repo, commit_shas: Sequence[str]) -> Iterator[GitCommit]:
+    """Stream the `git show` output of commits from a single `git log` process.
+
+    Running `git show` once per commit forks a process per commit, which dominates
+    the extraction time of long histories. Instead, the commit SHAs are piped to one
+    `git log --no-walk` process, whose output is split into commits as it arrives.
+    """
+    if not commit_shas:
+        return
+
+    # `--cc` shows merge commits the same way as `git show`, and `-z` separates
+    # commits with NUL characters, which cannot appear in commit messages or diffs.
+    process = repo.git.log(
+        "--stdin",
+        "--no-walk=unsorted",
+        "--cc",
+        "-z",
+        as_process=True,
+        istream=subprocess.PIPE,
+    )
+    stdin, stdout = process.proc.stdin, process.proc.stdout
+    assert stdin is not None and stdout is not None
+    # Git reads all the revisions before writing anything, so this cannot deadlock
+    stdin.write("".join(f"{sha}\n" for sha in commit_shas).encode())
+    stdin.close()
+
+    try:
+        yield from _read_nul_separated_commits(stdout)
+    except GeneratorExit:
+        # The consumer stopped early, for example because of a limit
+        process.proc.kill()
+        process.proc.wait()
+        raise
+    process.wait()
+
+
+def _compute_patch_ids(
+    repo: Repo, commit_shas: Sequence[str], *, reverse: bool = False
+) -> dict[str, str]:
+    """Compute the stable patch ids of commits with `git patch-id --stable`.
+
+    The diffs of the commits are piped from a `git log` subprocess to `git patch-id`,
+    like in `_stream_commits`. If `reverse` is set, the patch ids of the reverted diffs
+    are computed instead. Paths are shown without their `a/` and `b/` prefixes, which
+    reverted diffs swap, so that the patch ids of reverted diffs match the patch ids of
+    the commits reverting them.
+
+    Returns:
+        The patch id of each commit with changes, by commit SHA.
+    """
+    if not commit_shas:
+        return {}
+
+    process = repo.git.log(
+        "--stdin",
+        "--no-walk=unsorted",
+        "--patch",
+        "--no-prefix",
+        "--no-color",
+        "--no-ext-diff",
+        *(("-R",) if reverse else ()),
+        as_process=True,
+        istream=subprocess.PIPE,
+    )
+    stdin, stdout = process.proc.stdin, process.proc.stdout
+    assert stdin is not None and stdout is not None
+    # Git reads all the revisions before writing anything, so this cannot deadlock
+    stdin.write("".join(f"{sha}\n" for sha in commit_shas).encode())
+    stdin.close()
+
+    patch_ids = subprocess.run(
+        [Git.GIT_PYTHON_GIT_EXECUTABLE or "git", "patch-id", "--stable"],
+        cwd=repo.working_dir,
+        stdin=stdout,
+        capture_output=True,
+        check=True,
+    )
+    process.wait()
+    # Each line holds the patch id and the SHA of a commit
+    return {
+        sha: patch_id
+        for patch_id, sha in (
+            line.split() for line in patch_ids.stdout.decode().splitlines()
+        )
+    }
+
+
+async def _astream_commits(
+    path: Path, commit_shas: Sequence[str]
+) -> AsyncIterator[GitCommit]:
+    """Stream the `git show` output of commits from a `git log` subprocess, asynchronously.
+
+    See `_stream_commits`. The subprocess is run by the event loop, so that reading its
+    output does not block other tasks.
+    """
+    if not commit_shas:
+        return
+
+    process = await asyncio.create_subprocess_exec(
+        Git.GIT_PYTHON_GIT_EXECUTABLE or "git",
+        "log",
+        "--stdin",
+        "--no-walk=unsorted",
+        "--cc",
+        "-z",
+        cwd=path,
+        # Like GitPython, so that the output is the same as `_stream_commits`
+        env={**os.environ, "LANGUAGE": "C", "LC_ALL": "C"},
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+    )
+    stdin, stdout = process.stdin, process.stdout
+    assert stdin is not None and stdout is not None
+    stdin.write("".join(f"{sha}\n" for sha in commit_shas).encode())
+    await stdin.drain()
+    stdin.close()
+
+    parser = _NulSeparatedCommitsParser()
+    try:
+        while chunk := await stdout.read(_STREAM_READ_SIZE):
+            for commit in parser.feed(chunk):
+                yield commit
+        for commit in parser.finish():
+            yield commit
+    finally:
+        if process.returncode is None and stdout.at_eof():
+            await process.wait()
+        elif process.returncode is None:
+            # The consumer stopped early, for example because of a limit
+            process.kill()
+            await process.wait()
+    if process.returncode:
+        raise GitCommandError(["git", "log", "--stdin"], process.returncode)
+
+
+def _read_nul_separated_commits(stream: IO[bytes]) -> Iterator[GitCommit]:
+    """Split the output of `git log -z` into commits, formatted like `git show`."""
+    parser = _NulSeparatedCommitsParser()
+    while chunk := stream.read(_STREAM_READ_SIZE):
+        yield from parser.feed(chunk)
+    yield from parser.finish()
+
+
+class _NulSeparatedCommitsParser:
+    """Split the output of `git log -z` into commits as it arrives.
+
+    `-z` turns into NUL characters both the separators between commits and the extra
+    line terminator that follows merge commits without a diff. Only the NUL characters
+    followed by a commit header separate commits, the others stand for newlines.
+    """
+
+    def __init__(self) -> None:
+        # Parts may span many chunks, so their pieces are joined once they are complete
+        self._pieces: list[bytes] = []
+        # The complete parts of the current commit
+        self._parts: list[bytes] = []
+
+    def feed(self, chunk: bytes) -> list[GitCommit]:
+        """Parse a chunk of the output, and return the commits it completes."""
+        *completed_pieces, incomplete_piece = chunk.split(b"\0")
+        commits: list[GitCommit] = []
+        for piece in completed_pieces:
+            if (commit := self._add_part(b"".join((*self._pieces, piece)))) is not None:
+                commits.append(commit)
+            self._pieces = []
+        self._pieces.append(incomplete_piece)
+        return commits
+
+    def finish(self) -> list[GitCommit]:
+        """Return the commits that remain once the output is complete."""
+        commit = self._add_part(b"".join(self._pieces))
+        commits = [commit] if commit is not None else []
+        if last_commit := b"\n".join(self._parts):
+            commits.append(_decode_commit(last_commit))
+        self._pieces, self._parts = [], []
+        return commits
+
+    def _add_part(self, part: bytes) -> GitCommit | None:
+        """Add a part to the current commit, returning the previous commit if it ends."""
+        commit = None
+        if part.startswith(b"commit ") and self._parts:
+            commit = _decode_commit(b"\n".join(self._parts))
+            self._parts = []
+        self._parts.append(part)
+        return commit
+
+
+def _decode_commit(commit: bytes) -> GitCommit:
+    """Decode a commit the same way GitPython decodes the output of `git show`."""
+    return commit.removesuffix(b"\n").decode(errors="surrogateescape")
+
+
+def omit_excluded_file_diffs(commit: GitCommit, path_filter: PathFilter) -> GitCommit:
+    """Replace the diffs of the files excluded by a path filter with a one-line summary.
+
+    Args:
+        commit: The output of `git show` for a commit.
+        path_filter: Decides which file diffs are included.
+
+    Returns:
+        The commit with the excluded file diffs omitted, or the commit unchanged if no
+        file diff is excluded.
+    """
+    split = split_git_commit_by_file(commit)
+    if split is None:
+        return commit
+
+    file_diffs = [
+        _summarize_file_diff(file_diff)
+        if path_filter.is_excluded(_file_diff_path(file_diff))
+        else file_diff
+        for file_diff in split.sections
+    ]
+    if file_diffs == split.sections:
+        return commit
+    return "\n\n".join((split.header, "\n".join(file_diffs)))
+
+
+def _file_diff_path(file_diff: str) -> str:
+    """Return the path of the file changed by the diff of a single file."""
+    header, *lines = file_diff.splitlines()
+    for line in lines:
+        if line.startswith("+++ b/"):
+            return line.removeprefix("+++ b/")
+        if line.startswith("rename to "):
+            return line.removeprefix("rename to ")
+        if line.startswith("@@"):
+            break
+    match = _FILE_DIFF_HEADER_PATTERN.match(header)
+    return match.group(1).strip('"') if match else header
+
+
+def _summarize_file_diff(file_diff: str) -> str:
+    """Summarize the diff of a single file as a one-line entry."""
+    lines = file_diff.splitlines()
+    if any(line.startswith("new file mode") for line in lines):
+        status = "added"
+    elif any(line.startswith("deleted file mode") for line in lines):
+        status = "removed"
+    elif any(line.startswith("rename to ") for line in lines):
+        status = "renamed"
+    else:
+        status = "modified"
+
+    hunk_lines = list(dropwhile(lambda line: not line.startswith("@@"), lines))
+    return format_omitted_file_diff(
+        status,
+        _file_diff_path(file_diff),
+        additions=sum(line.startswith("+") for line in hunk_lines),
+        deletions=sum(line.startswith("-") for line in hunk_lines),
+    )
+
+
+GIT_COMMIT_SPLITTERS: Final[tuple[ChunkSplitter, ...]] = (
+    split_git_commit_by_file,
+    split_diff_by_hunk,
+)
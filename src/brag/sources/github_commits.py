@@ -7,33 +7,89 @@ This module provides functionality to:
 
 from __future__ import annotations
 
-from collections.abc import Iterator
+import asyncio
+import re
+from collections.abc import AsyncIterator, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
 from dataclasses import dataclass
 from datetime import datetime
 from functools import cached_property
+from itertools import takewhile
+from typing import Any, Final, Literal, assert_never
 
-from github import Github
+from github import Github, UnknownObjectException
 from github.Commit import Commit as GithubCommit
 from github.File import File
-from github.GithubObject import NotSet
 from github.PaginatedList import PaginatedList
+from github.Repository import Repository
+from github.Requester import Requester
 
+from brag.concurrency import map_ordered
+from brag.dedup import PatchId, diff_patch_id
+from brag.pipeline import iterate_in_thread, map_async
 from brag.repository import RepoReference
-from brag.sources import DataSource
+from brag.sources import AsyncDataSource, CommitRef, DataSource, latest_datetime
+from brag.sources.github_graphql import GithubCommitSummary, list_commit_summaries
+from brag.sources.path_filters import PathFilter, format_omitted_file_diff
+from brag.splitting import ChunkSplit, ChunkSplitter, split_at, split_diff_by_hunk
 
 type FormattedGithubCommit = str
+type GithubApi = Literal["rest", "graphql"]
+type _ListedCommits = (
+    PaginatedList[GithubCommit] | _ListedLazily[GithubCommit | GithubCommitSummary]
+)
+
+# See https://docs.github.com/en/rest/commits/commits#get-a-commit
+_FILE_STATUSES: Final = (
+    "added",
+    "removed",
+    "modified",
+    "renamed",
+    "copied",
+    "changed",
+    "unchanged",
+)
+_FILE_HEADER_PATTERN = re.compile(
+    rf"^(?:{'|'.join(status.upper() for status in _FILE_STATUSES)}) "
+    r"(?:.+:(?: no diff)?|.+ \(\+\d+ -\d+, diff omitted\))$",
+    re.MULTILINE,
+)
+_GITATTRIBUTES_FILE_NAME: Final = ".gitattributes"
+_GITHUB_DATETIME_FORMAT: Final = "%Y-%m-%dT%H:%M:%SZ"
+# The number of commits fetched ahead of the consumer, per concurrent request
+_LOOKAHEAD_PER_REQUEST: Final = 4
 
 
 @dataclass(frozen=True, slots=True)
-class GithubCommitsSource(DataSource[FormattedGithubCommit]):
+class GithubCommitsSource(
+    DataSource[FormattedGithubCommit], AsyncDataSource[FormattedGithubCommit]
+):
     """A class to fetch Github commits from a repository for a specific user.
 
+    The Github client is synchronous, so iterating over the source asynchronously sends
+    the requests from worker threads, without blocking the event loop.
+
     Attributes:
         github: A Github API client instance.
         repo: A RepoReference object representing the repository.
         author: The username of the author whose commits are being fetched.
         from_date: An optional datetime object representing the start date for fetching commits.
         to_date: An optional datetime object representing the end date for fetching commits.
+        after_commit: An optional reference to an already processed commit. If provided,
+            only commits newer than it are fetched.
+        path_filter: Decides which file diffs are included. The repository's
+            `.gitattributes` file, on the default branch, is also respected.
+        api: The API used to list the commits. The REST API lists 30 commits per request,
+            and then fetches every commit again to get its changed files. The GraphQL API,
+            which requires an authenticated client, lists 100 commits per request, with
+            the number of lines they change, and only fetches the commits whose diffs are
+            included.
+        max_diff_lines: If provided, the diffs of the commits adding and deleting more
+            lines than this are omitted, and such commits are summarized by the number of
+            files and lines they change. With the GraphQL API, they are not fetched.
+        max_concurrent_requests: The maximum number of commits fetched concurrently.
+            Commits are still yielded in order.
     """
 
     github: Github
@@ -41,32 +97,285 @@ class GithubCommitsSource(DataSource[FormattedGithubCommit]):
     author: str
     from_date: datetime | None = None
     to_date: datetime | None = None
+    after_commit: CommitRef | None = None
+    path_filter: PathFilter = PathFilter()
+    api: GithubApi = "rest"
+    max_diff_lines: int | None = None
+    max_concurrent_requests: int = 1
+
+    def __post_init__(self) -> None:
+        if self.max_concurrent_requests < 1:
+            raise ValueError("max_concurrent_requests must be positive")
+        if self.max_diff_lines is not None and self.max_diff_lines < 0:
+            raise ValueError("max_diff_lines must not be negative")
 
     def __iter__(self) -> Iterator[FormattedGithubCommit]:
-        return map(_format_github_commit_as_prompt_context, self._commits)
+        if self.max_concurrent_requests == 1:
+            return map(self._format_commit, self._new_commits)
+        return self._format_commits_concurrently()
+
+    def __aiter__(self) -> AsyncIterator[FormattedGithubCommit]:
+        return self._aiter_commits()
 
     def __len__(self) -> int:
-        return self._commits.totalCount
+        if isinstance(self._new_commits, PaginatedList):
+            return self._new_commits.totalCount
+        return sum(1 for _ in self._new_commits)
+
+    def length_hint(self) -> int | None:
+        """Estimate the number of commits from the first page of the list of commits.
+
+        With the REST API, the last page of the list is linked from the first page, and
+        the estimate is the number of commits per page times the number of pages. Unlike
+        `len`, this does not send a request of its own, since the first page is reused by
+        the iteration. The GraphQL API does not link to the last page, so the number of
+        commits is unknown until they are listed.
+        """
+        commits = self._new_commits
+        if next(iter(commits), None) is None:
+            return 0
+        if self.api != "rest":
+            return None
+        last_page = _last_page_number(self._first_commits_page.headers)
+        if last_page is None:
+            # The first page is the only one, and was already fetched
+            return sum(1 for _ in commits)
+        return last_page * self.github.per_page
+
+    def latest_commit(self) -> CommitRef | None:
+        """Return a reference to the most recent commit yielded by this source, if any."""
+        commits: Iterable[GithubCommit | GithubCommitSummary] = self._new_commits
+        commit = next(iter(commits), None)
+        if commit is None:
+            return None
+        if isinstance(commit, GithubCommitSummary):
+            return CommitRef(sha=commit.sha, committed_at=commit.committed_at)
+        return CommitRef(sha=commit.sha, committed_at=commit.commit.committer.date)
+
+    def _format_commits_concurrently(self) -> Iterator[FormattedGithubCommit]:
+        # Resolve the shared state before the worker threads need it
+        _ = self._path_filter
+        with ThreadPoolExecutor(
+            max_workers=self.max_concurrent_requests,
+            thread_name_prefix="github-commits",
+        ) as executor:
+            yield from map_ordered(
+                executor,
+                self._format_commit,
+                self._new_commits,
+                max_pending=_LOOKAHEAD_PER_REQUEST * self.max_concurrent_requests,
+            )
+
+    async def _aiter_commits(self) -> AsyncIterator[FormattedGithubCommit]:
+        # Resolve the shared state before the worker threads need it
+        await asyncio.to_thread(lambda: self._path_filter)
+        new_commits = await asyncio.to_thread(lambda: self._new_commits)
+
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(
+            max_workers=self.max_concurrent_requests,
+            thread_name_prefix="github-commits",
+        ) as executor:
+
+            async def format_commit(
+                commit: GithubCommit | GithubCommitSummary,
+            ) -> FormattedGithubCommit:
+                return await loop.run_in_executor(executor, self._format_commit, commit)
+
+            # Pages of commits are listed in their own thread, ahead of the commits
+            # being fetched
+            async with aclosing(
+                iterate_in_thread(
+                    new_commits,
+                    max_pending=_LOOKAHEAD_PER_REQUEST * self.max_concurrent_requests,
+                )
+            ) as listed_commits:
+                async for commit in map_async(
+                    format_commit,
+                    listed_commits,
+                    concurrency=self.max_concurrent_requests,
+                ):
+                    yield commit
+
+    def _format_commit(self, commit: GithubCommit | GithubCommitSummary) -> str:
+        if isinstance(commit, GithubCommitSummary):
+            if commit.changed_files == 0:
+                return commit.message.strip()
+            if self._exceeds_max_diff_lines(commit.additions + commit.deletions):
+                # The summary has all that is kept of the commit, so it is not fetched
+                return _format_commit_stats(
+                    commit.message,
+                    commit.changed_files,
+                    commit.additions,
+                    commit.deletions,
+                )
+            commit = self._github_repo.get_commit(commit.sha)
+        # Newer PyGithub versions request the files again every time they are listed
+        files = list(commit.files)
+        additions = sum(file.additions for file in files)
+        deletions = sum(file.deletions for file in files)
+        if self._exceeds_max_diff_lines(additions + deletions):
+            return _format_commit_stats(
+                commit.commit.message, len(files), additions, deletions
+            )
+        return _format_github_commit_as_prompt_context(
+            commit.commit.message, files, self._path_filter
+        )
+
+    def _exceeds_max_diff_lines(self, changed_lines: int) -> bool:
+        return self.max_diff_lines is not None and changed_lines > self.max_diff_lines
 
     @cached_property
-    def _commits(self) -> PaginatedList[GithubCommit]:
-        return self.github.get_repo(self.repo.full_name).get_commits(
-            author=self.author,
-            since=self.from_date or NotSet,
-            until=self.to_date or NotSet,
+    def _new_commits(self) -> _ListedCommits:
+        if self.after_commit is None:
+            return self._commits
+
+        # The `since` filter is inclusive, so the processed commit itself, and possibly
+        # older commits with the same date, are listed after the new ones.
+        after_sha = self.after_commit.sha
+        commits: Iterable[GithubCommit | GithubCommitSummary] = self._commits
+        return _ListedLazily(takewhile(lambda commit: commit.sha != after_sha, commits))
+
+    @cached_property
+    def _commits(self) -> _ListedCommits:
+        match self.api:
+            case "rest":
+                # List the first page directly, rather than with `get_commits`, so that
+                # its Link header is kept for `length_hint`
+                first_page = self._first_commits_page
+                return PaginatedList(
+                    GithubCommit,
+                    self.github.requester,
+                    first_page.url,
+                    dict(first_page.parameters),
+                    firstData=first_page.data,
+                    firstHeaders=first_page.headers,
+                )
+            case "graphql":
+                return _ListedLazily(
+                    list_commit_summaries(
+                        self.github.requester,
+                        self.repo,
+                        self.author,
+                        since=self._since,
+                        until=self.to_date,
+                    )
+                )
+            case never:
+                assert_never(never)
+
+    @property
+    def _since(self) -> datetime | None:
+        return latest_datetime(
+            self.from_date,
+            self.after_commit.committed_at if self.after_commit else None,
+        )
+
+    @cached_property
+    def _first_commits_page(self) -> _FirstCommitsPage:
+        """Request the first page of the commits listed with the REST API."""
+        # The same parameters as `Repository.get_commits`
+        parameters: dict[str, Any] = {
+            "author": self.author,
+            "per_page": self.github.per_page,
+        }
+        if self._since is not None:
+            parameters["since"] = self._since.strftime(_GITHUB_DATETIME_FORMAT)
+        if self.to_date is not None:
+            parameters["until"] = self.to_date.strftime(_GITHUB_DATETIME_FORMAT)
+        url = f"{self._github_repo.url}/commits"
+        headers, data = self.github.requester.requestJsonAndCheck(
+            "GET", url, parameters=parameters
         )
+        return _FirstCommitsPage(
+            url=url, parameters=parameters, headers=headers, data=data
+        )
+
+    @cached_property
+    def _path_filter(self) -> PathFilter:
+        try:
+            gitattributes = self._github_repo.get_contents(_GITATTRIBUTES_FILE_NAME)
+        except UnknownObjectException:
+            return self.path_filter
+        if isinstance(gitattributes, list):
+            # The path is a directory
+            return self.path_filter
+        return self.path_filter.with_gitattributes(
+            gitattributes.decoded_content.decode(errors="replace")
+        )
+
+    @cached_property
+    def _github_repo(self) -> Repository:
+        return self.github.get_repo(self.repo.full_name)
+
+
+class _ListedLazily[T]:
+    """Items listed as they are iterated over, and kept to be iterated over again.
+
+    Like a `PaginatedList`, the first items can be peeked at without listing the others.
+    """
+
+    def __init__(self, items: Iterable[T]) -> None:
+        self._items = iter(items)
+        self._listed: list[T] = []
+
+    def __iter__(self) -> Iterator[T]:
+        index = 0
+        while index < len(self._listed) or self._list_next():
+            yield self._listed[index]
+            index += 1
+
+    def _list_next(self) -> bool:
+        """List the next item, and return whether there was one."""
+        for item in self._items:
+            self._listed.append(item)
+            return True
+        return False
+
+
+@dataclass(frozen=True, slots=True)
+class _FirstCommitsPage:
+    """The response to the request for the first page of commits of the REST API.
+
+    Attributes:
+        url: The URL of the list of commits.
+        parameters: The query parameters of the request.
+        headers: The headers of the response, with lowercase names.
+        data: The commits of the first page, as JSON.
+    """
+
+    url: str
+    parameters: dict[str, Any]
+    headers: dict[str, Any]
+    data: Any
+
+
+def _last_page_number(headers: dict[str, Any]) -> int | None:
+    """Return the number of the last page linked from a page, if it has a next page."""
+    for link in str(headers.get("link", "")).split(","):
+        url, _, relation = link.partition(";")
+        if relation.strip() == 'rel="last"':
+            (page,) = Requester.get_parameters_of_url(url.strip(" <>"))["page"]
+            return int(page)
+    return None
 
 
 def _format_github_commit_as_prompt_context(
-    commit: GithubCommit,
+    message: str,
+    files: Iterable[File],
+    path_filter: PathFilter,
 ) -> FormattedGithubCommit:
     """Format a Github commit as a context string.
 
-    This function takes a Github commit object and formats it into a string
-    that includes the commit message and the diffs of the files changed in the commit.
+    This function takes the message and the changed files of a Github commit and formats
+    them into a string that includes the commit message and the diffs of the files changed
+    in the commit. The diffs of the files excluded by the path filter are replaced by a
+    one-line summary.
 
     Args:
-        commit: The Github commit object to format.
+        message: The message of the Github commit to format.
+        files: The files changed by the commit.
+        path_filter: Decides which file diffs are included.
 
     Returns:
         A string containing the commit message and file diffs.
@@ -74,16 +383,63 @@ def _format_github_commit_as_prompt_context(
     """
     return "\n\n".join(
         (
-            commit.commit.message.strip(),
-            *map(_format_commit_file, commit.files),
+            message.strip(),
+            *(_format_commit_file(file, path_filter) for file in files),
         )
     )
 
 
-def _format_commit_file(file: File) -> str:
+def _format_commit_stats(
+    message: str, changed_files: int | None, additions: int, deletions: int
+) -> FormattedGithubCommit:
+    """Format a commit whose diffs are omitted as its message and the lines it changes."""
+    files = "Files" if changed_files is None else f"{changed_files} files"
+    return f"{message.strip()}\n\n{files} changed (+{additions} -{deletions}, diffs omitted)"
+
+
+def _format_commit_file(file: File, path_filter: PathFilter) -> str:
     """Format the commit file into a context string."""
+    if path_filter.is_excluded(file.filename):
+        return format_omitted_file_diff(
+            file.status, file.filename, file.additions, file.deletions
+        )
     file_header = f"{file.status.upper()} {file.filename}:"
     if file.patch:
         return "\n".join((file_header, file.patch))
     else:
         return f"{file_header} no diff"
+
+
+def split_github_commit_by_file(
+    commit: FormattedGithubCommit,
+) -> ChunkSplit | None:
+    """Split a formatted Github commit into the commit message and the diff of each file."""
+    return split_at(
+        commit,
+        [match.start() for match in _FILE_HEADER_PATTERN.finditer(commit)],
+        separator="\n\n",
+    )
+
+
+def github_commit_patch_id(commit: FormattedGithubCommit) -> PatchId | None:
+    """Compute the patch ids of a formatted Github commit, see `brag.dedup`.
+
+    The patch ids are computed from the diffs of the formatted commit, since Github does
+    not provide them. Files whose diff is omitted are not part of the patch ids.
+    """
+    split = split_github_commit_by_file(commit)
+    if split is None:
+        return None
+    file_diffs = []
+    for section in split.sections:
+        header, _, diff = section.partition("\n")
+        # The header is the status and the path of the file, followed by a colon
+        _, _, path = header.partition(" ")
+        file_diffs.append((path.removesuffix(": no diff").removesuffix(":"), diff))
+    return diff_patch_id(file_diffs)
+
+
+GITHUB_COMMIT_SPLITTERS: Final[tuple[ChunkSplitter, ...]] = (
+    split_github_commit_by_file,
+    split_diff_by_hunk,
+)
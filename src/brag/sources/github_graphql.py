@@ -0,0 +1,158 @@
+"""List Github commits in bulk with the GraphQL API.
+
+The REST API lists commits 30 at a time, and only returns their changed files when each
+commit is fetched on its own. The GraphQL API lists up to 100 commits per request, with
+their message, the number of files they change and the number of lines they add and
+delete, so that commits can be listed in a few requests. The GraphQL API does not list
+the changed files of a commit, nor their diffs, so the commits whose diffs are needed are
+still fetched on their own.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Iterator
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Final
+
+from github.Requester import Requester
+
+from brag.repository import RepoReference
+
+GRAPHQL_PAGE_SIZE: Final = 100
+
+_USER_ID_QUERY: Final = """
+query ($login: String!) {
+  user(login: $login) {
+    id
+  }
+}
+"""
+
+_COMMIT_HISTORY_QUERY: Final = """
+query (
+  $owner: String!
+  $name: String!
+  $author: CommitAuthor
+  $since: GitTimestamp
+  $until: GitTimestamp
+  $first: Int!
+  $cursor: String
+) {
+  repository(owner: $owner, name: $name) {
+    defaultBranchRef {
+      target {
+        ... on Commit {
+          history(
+            author: $author
+            since: $since
+            until: $until
+            first: $first
+            after: $cursor
+          ) {
+            pageInfo {
+              hasNextPage
+              endCursor
+            }
+            nodes {
+              oid
+              message
+              committedDate
+              changedFilesIfAvailable
+              additions
+              deletions
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+
+@dataclass(frozen=True, slots=True)
+class GithubCommitSummary:
+    """The metadata of a Github commit, without its changed files.
+
+    Attributes:
+        sha: The SHA of the commit.
+        message: The commit message.
+        committed_at: The commit date.
+        changed_files: The number of files changed by the commit, or None if Github could
+            not count them.
+        additions: The number of lines added by the commit.
+        deletions: The number of lines deleted by the commit.
+    """
+
+    sha: str
+    message: str
+    committed_at: datetime
+    changed_files: int | None
+    additions: int
+    deletions: int
+
+
+def list_commit_summaries(
+    requester: Requester,
+    repo: RepoReference,
+    author: str,
+    *,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    page_size: int = GRAPHQL_PAGE_SIZE,
+) -> Iterator[GithubCommitSummary]:
+    """List the commits of the default branch of a repository made by an author.
+
+    Commits are listed from the most recent, like the REST API does.
+
+    Args:
+        requester: The requester of an authenticated Github client. The GraphQL API
+            cannot be used anonymously.
+        repo: The repository to list the commits of.
+        author: The login or the email address of the author of the commits.
+        since: If provided, only commits made after this date are listed.
+        until: If provided, only commits made before this date are listed.
+        page_size: The number of commits listed per request, up to 100.
+
+    Yields:
+        The summary of each commit.
+    """
+    variables: dict[str, Any] = {
+        "owner": repo.owner,
+        "name": repo.name,
+        "author": _author_filter(requester, author),
+        "since": since.isoformat() if since else None,
+        "until": until.isoformat() if until else None,
+        "first": page_size,
+        "cursor": None,
+    }
+    while True:
+        _, response = requester.graphql_query(_COMMIT_HISTORY_QUERY, variables)
+        branch = response["data"]["repository"]["defaultBranchRef"]
+        if branch is None:
+            # The repository is empty
+            return
+
+        history = branch["target"]["history"]
+        for node in history["nodes"]:
+            yield GithubCommitSummary(
+                sha=node["oid"],
+                message=node["message"],
+                committed_at=datetime.fromisoformat(node["committedDate"]),
+                changed_files=node["changedFilesIfAvailable"],
+                additions=node["additions"],
+                deletions=node["deletions"],
+            )
+
+        if not history["pageInfo"]["hasNextPage"]:
+            return
+        variables["cursor"] = history["pageInfo"]["endCursor"]
+
+
+def _author_filter(requester: Requester, author: str) -> dict[str, Any]:
+    """Build the filter matching the commits of an author given by login or email."""
+    if "@" in author:
+        return {"emails": [author]}
+    _, response = requester.graphql_query(_USER_ID_QUERY, {"login": author})
+    return {"id": response["data"]["user"]["id"]}
@@ -0,0 +1,185 @@
+"""Decide which changed files have their diffs included in commit sources.
+
+Lockfiles, generated files, minified bundles and vendored code rarely say anything about
+someone's contributions, but their diffs can take up most of the tokens of a commit. Their
+diffs are omitted from commits, and replaced by a one-line summary.
+
+Patterns follow the `.gitattributes` syntax: a pattern without a slash matches a file
+name at any depth, while a pattern with a slash matches the path from the repository
+root. `*` and `?` do not match slashes, and `**` matches any number of directories.
+"""
+
+from __future__ import annotations
+
+import re
+from collections.abc import Sequence
+from dataclasses import dataclass, replace
+from functools import cache
+from typing import Final, Self
+
+DEFAULT_EXCLUDED_PATHS: Final[tuple[str, ...]] = (
+    # Lockfiles
+    "Cargo.lock",
+    "Gemfile.lock",
+    "Pipfile.lock",
+    "composer.lock",
+    "go.sum",
+    "package-lock.json",
+    "pdm.lock",
+    "pnpm-lock.yaml",
+    "poetry.lock",
+    "uv.lock",
+    "yarn.lock",
+    # Minified and generated bundles
+    "*.min.js",
+    "*.min.css",
+    "*.map",
+    # Snapshots
+    "*.snap",
+    "**/__snapshots__/**",
+    # Vendored code
+    "**/node_modules/**",
+    "**/vendor/**",
+    "**/third_party/**",
+)
+
+# Attributes that mark a file as generated, vendored or not meant to be diffed, and
+# whether setting them excludes the file
+_EXCLUDING_ATTRIBUTES: Final = {
+    "linguist-generated": True,
+    "linguist-vendored": True,
+    "binary": True,
+    "diff": False,
+}
+_TRUE_VALUES: Final = frozenset({"true", "1", "yes"})
+
+
+@dataclass(frozen=True, slots=True)
+class GitAttributesRule:
+    """A `.gitattributes` rule that affects whether a file diff is excluded.
+
+    Attributes:
+        pattern: The pattern of the paths the rule applies to.
+        excluded: Whether the rule excludes or includes the matching paths.
+    """
+
+    pattern: str
+    excluded: bool
+
+
+@dataclass(frozen=True, slots=True)
+class PathFilter:
+    """Decide whether the diff of a changed file is included.
+
+    A path is excluded if there are include patterns and it matches none of them, if it
+    matches an exclude pattern, or if the last `.gitattributes` rule matching it
+    excludes it.
+
+    Attributes:
+        include: If not empty, only paths matching one of these patterns are included.
+        exclude: Paths matching one of these patterns are excluded.
+        gitattributes: The `.gitattributes` rules of the repository, in file order.
+    """
+
+    include: Sequence[str] = ()
+    exclude: Sequence[str] = DEFAULT_EXCLUDED_PATHS
+    gitattributes: Sequence[GitAttributesRule] = ()
+
+    def with_gitattributes(self, text: str) -> Self:
+        """Return a copy of this filter that also respects a `.gitattributes` file."""
+        return replace(self, gitattributes=parse_gitattributes(text))
+
+    def is_excluded(self, path: str) -> bool:
+        """Whether the diff of the file at the given path is excluded."""
+        if self.include and not any(
+            matches_path(pattern, path) for pattern in self.include
+        ):
+            return True
+        if any(matches_path(pattern, path) for pattern in self.exclude):
+            return True
+        return next(
+            (
+                rule.excluded
+                for rule in reversed(self.gitattributes)
+                if matches_path(rule.pattern, path)
+            ),
+            False,
+        )
+
+
+def parse_gitattributes(text: str) -> tuple[GitAttributesRule, ...]:
+    """Parse the rules of a `.gitattributes` file that affect whether diffs are excluded.
+
+    Supported attributes are `linguist-generated`, `linguist-vendored`, `binary` and
+    `diff`, which can be set (`attr`, `attr=true`) or unset (`-attr`, `attr=false`).
+    """
+    rules: list[GitAttributesRule] = []
+    for line in text.splitlines():
+        fields = line.split()
+        if not fields or fields[0].startswith("#"):
+            continue
+        pattern, *attributes = fields
+        for attribute in attributes:
+            parsed = _parse_attribute(attribute)
+            if parsed is None:
+                continue
+            name, is_set = parsed
+            rules.append(
+                GitAttributesRule(
+                    pattern=pattern,
+                    excluded=is_set == _EXCLUDING_ATTRIBUTES[name],
+                )
+            )
+    return tuple(rules)
+
+
+def format_omitted_file_diff(
+    status: str, path: str, additions: int, deletions: int
+) -> str:
+    """Format the one-line summary replacing the diff of an excluded file."""
+    return f"{status.upper()} {path} (+{additions} -{deletions}, diff omitted)"
+
+
+def matches_path(pattern: str, path: str) -> bool:
+    """Whether a path, relative to the repository root, matches a pattern."""
+    return _compile_pattern(pattern).fullmatch(path) is not None
+
+
+def _parse_attribute(attribute: str) -> tuple[str, bool] | None:
+    """Parse an attribute into its name and whether it is set."""
+    if attribute.startswith(("-", "!")):
+        name, is_set = attribute[1:], False
+    elif "=" in attribute:
+        name, value = attribute.split("=", 1)
+        is_set = value.lower() in _TRUE_VALUES
+    else:
+        name, is_set = attribute, True
+    return (name, is_set) if name in _EXCLUDING_ATTRIBUTES else None
+
+
+@cache
+def _compile_pattern(pattern: str) -> re.Pattern[str]:
+    """Translate a `.gitattributes` pattern into a regular expression."""
+    anchored = "/" in pattern.rstrip("/")
+    pattern = pattern.strip("/")
+
+    regex = ""
+    index = 0
+    while index < len(pattern):
+        if pattern.startswith("**/", index):
+            regex += "(?:.*/)?"
+            index += 3
+        elif pattern.startswith("**", index):
+            regex += ".*"
+            index += 2
+        elif pattern[index] == "*":
+            regex += "[^/]*"
+            index += 1
+        elif pattern[index] == "?":
+            regex += "[^/]"
+            index += 1
+        else:
+            regex += re.escape(pattern[index])
+            index += 1
+
+    return re.compile(regex if anchored else f"(?:.*/)?{regex}")
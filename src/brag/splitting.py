@@ -0,0 +1,237 @@
+"""Split chunks that are too large to fit in a batch on their own.
+
+Large commits are split along their structure: first into the sections for each changed
+file, then, if a file section is still too large, into the hunks of its diff. The header
+of every level, such as the commit message or the file name, is repeated on each piece,
+so that every piece can be understood on its own.
+
+The structure of a chunk is described by a sequence of splitters, one per level. As a last
+resort, chunks that cannot be split any further are split by lines.
+"""
+
+from __future__ import annotations
+
+import re
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from dataclasses import dataclass
+
+from brag.models import TokenCount
+from brag.tokens import DEFAULT_TOKEN_ESTIMATOR, TokenEstimator
+
+
+@dataclass(frozen=True, slots=True)
+class ChunkSplit:
+    """A chunk split into a header and sections.
+
+    The chunk can be reassembled by joining the header and the sections with the
+    separator.
+
+    Attributes:
+        header: The part of the chunk that is repeated on each piece.
+        sections: The parts of the chunk that can be put in different pieces.
+        separator: The string used to join the header and the sections.
+    """
+
+    header: str
+    sections: Sequence[str]
+    separator: str = "\n"
+
+
+# A function splitting a chunk into a header and sections, or returning None if the chunk
+# has no sections
+type ChunkSplitter = Callable[[str], ChunkSplit | None]
+
+
+_DIFF_HUNK_PATTERN = re.compile(r"^@@", re.MULTILINE)
+
+
+def split_oversized_chunks(
+    chunks: Iterable[str],
+    max_tokens_per_chunk: TokenCount,
+    splitters: Sequence[ChunkSplitter] = (),
+    *,
+    token_estimator: TokenEstimator = DEFAULT_TOKEN_ESTIMATOR,
+) -> Iterator[str]:
+    """Split the chunks that are larger than the max tokens per chunk.
+
+    Chunks that fit are yielded unchanged. See `split_oversized_chunk` for how the other
+    chunks are split.
+
+    Args:
+        chunks: An iterable of strings, where each string is a chunk of text.
+        max_tokens_per_chunk: The maximum number of tokens allowed per chunk.
+        splitters: The splitters describing the structure of the chunks, one per level.
+        token_estimator: The estimator used to measure the size of the chunks.
+
+    Yields:
+        Chunks, each fitting within the max tokens per chunk.
+
+    Raises:
+        ValueError: If max_tokens_per_chunk is not positive.
+    """
+    if max_tokens_per_chunk <= 0:
+        raise ValueError("max_tokens_per_chunk must be positive")
+
+    for chunk in chunks:
+        yield from split_oversized_chunk(
+            chunk, max_tokens_per_chunk, splitters, token_estimator=token_estimator
+        )
+
+
+def split_oversized_chunk(
+    chunk: str,
+    max_tokens_per_chunk: TokenCount,
+    splitters: Sequence[ChunkSplitter] = (),
+    *,
+    token_estimator: TokenEstimator = DEFAULT_TOKEN_ESTIMATOR,
+) -> list[str]:
+    """Split a chunk into pieces that fit within the max tokens per chunk.
+
+    The first splitter splits the chunk into a header and sections. Consecutive sections
+    are grouped into pieces that fit within the budget, each piece starting with the
+    header. Sections that do not fit on their own are split recursively using the
+    remaining splitters. When the splitter of a level does not apply, or when the header
+    alone is too large, the chunk is split by lines at that level, without trying the
+    splitters of the deeper levels.
+
+    Args:
+        chunk: The chunk to split.
+        max_tokens_per_chunk: The maximum number of tokens allowed per piece.
+        splitters: The splitters describing the structure of the chunk, one per level.
+        token_estimator: The estimator used to measure the size of the pieces.
+
+    Returns:
+        The pieces of the chunk, or the chunk itself if it already fits.
+    """
+    if token_estimator.estimate(chunk) <= max_tokens_per_chunk:
+        return [chunk]
+
+    # Only the splitter of this level applies: the deeper ones describe the structure of
+    # the sections, not of the whole chunk
+    split = splitters[0](chunk) if splitters else None
+    if split is not None:
+        sections_budget = (
+            max_tokens_per_chunk
+            - token_estimator.estimate(split.header)
+            - token_estimator.estimate(split.separator)
+        )
+        if sections_budget > 0:
+            return [
+                split.separator.join((split.header, piece))
+                for piece in _group_sections(
+                    split.sections,
+                    sections_budget,
+                    split.separator,
+                    splitters[1:],
+                    token_estimator,
+                )
+            ]
+
+    return _split_lines(chunk, max_tokens_per_chunk, token_estimator)
+
+
+def split_diff_by_hunk(diff: str) -> ChunkSplit | None:
+    """Split a unified diff into its file header and its hunks."""
+    starts = [match.start() for match in _DIFF_HUNK_PATTERN.finditer(diff)]
+    return split_at(diff, starts)
+
+
+def split_at(
+    text: str, starts: Sequence[int], separator: str = "\n"
+) -> ChunkSplit | None:
+    """Split a text into a header and sections starting at the given offsets.
+
+    Args:
+        text: The text to split.
+        starts: The offsets where sections start, in increasing order. The text before
+            the first offset is the header.
+        separator: The separator used to join the header and sections back together.
+            Trailing whitespace is stripped from the header and sections.
+
+    Returns:
+        The split text, or None if there are no sections.
+    """
+    if not starts:
+        return None
+    return ChunkSplit(
+        header=text[: starts[0]].rstrip(),
+        sections=[
+            text[start:end].rstrip()
+            for start, end in zip(starts, (*starts[1:], len(text)), strict=True)
+        ],
+        separator=separator,
+    )
+
+
+def _group_sections(
+    sections: Iterable[str],
+    max_tokens_per_group: TokenCount,
+    separator: str,
+    splitters: Sequence[ChunkSplitter],
+    token_estimator: TokenEstimator,
+) -> Iterator[str]:
+    """Group consecutive sections so that each group fits within the budget."""
+    separator_token_count = token_estimator.estimate(separator)
+    group: list[str] = []
+    group_token_count = 0
+
+    for section in sections:
+        section_token_count = token_estimator.estimate(section)
+        additional_token_count = separator_token_count if group else 0
+
+        if (
+            group_token_count + additional_token_count + section_token_count
+            <= max_tokens_per_group
+        ):
+            group.append(section)
+            group_token_count += additional_token_count + section_token_count
+            continue
+
+        if group:
+            yield separator.join(group)
+
+        if section_token_count <= max_tokens_per_group:
+            group = [section]
+            group_token_count = section_token_count
+        else:
+            yield from split_oversized_chunk(
+                section,
+                max_tokens_per_group,
+                splitters,
+                token_estimator=token_estimator,
+            )
+            group = []
+            group_token_count = 0
+
+    if group:
+        yield separator.join(group)
+
+
+def _split_lines(
+    text: str,
+    max_tokens_per_piece: TokenCount,
+    token_estimator: TokenEstimator,
+) -> list[str]:
+    """Split a text by lines, cutting lines that are too large on their own."""
+    lines = (
+        piece
+        for line in text.splitlines()
+        for piece in _split_characters(line, max_tokens_per_piece, token_estimator)
+    )
+    return list(_group_sections(lines, max_tokens_per_piece, "\n", (), token_estimator))
+
+
+def _split_characters(
+    text: str,
+    max_tokens_per_piece: TokenCount,
+    token_estimator: TokenEstimator,
+) -> Iterator[str]:
+    """Cut a text into pieces of at most the max tokens per piece."""
+    token_count = token_estimator.estimate(text)
+    if token_count <= max_tokens_per_piece:
+        yield text
+        return
+
+    piece_length = max(1, len(text) * max_tokens_per_piece // token_count)
+    for start in range(0, len(text), piece_length):
+        yield text[start : start + piece_length]
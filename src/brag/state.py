@@ -0,0 +1,92 @@
+"""Track which commits were already incorporated into a brag document.
+
+The state is stored in a sidecar file next to the brag document. For every source
+(a repository and an author), it records the most recent commit that was processed,
+so that the next run only needs to process newer commits.
+"""
+
+from __future__ import annotations
+
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Final, Self
+
+from pydantic import BaseModel, Field
+
+from brag.sources import CommitRef
+
+_STATE_FILE_SUFFIX: Final = ".brag-state.json"
+
+
+class SourceState(BaseModel):
+    """The processing state of a single source.
+
+    Attributes:
+        last_commit_sha: The SHA of the most recent processed commit.
+        last_commit_date: The commit date of the most recent processed commit.
+    """
+
+    last_commit_sha: str
+    last_commit_date: datetime
+
+    @classmethod
+    def from_commit_ref(cls, commit: CommitRef) -> Self:
+        """Create a source state pointing at the given commit."""
+        return cls(last_commit_sha=commit.sha, last_commit_date=commit.committed_at)
+
+    def to_commit_ref(self) -> CommitRef:
+        """Return a reference to the most recent processed commit."""
+        return CommitRef(sha=self.last_commit_sha, committed_at=self.last_commit_date)
+
+
+class BragDocumentState(BaseModel):
+    """The processing state of a brag document, for every source it was generated from.
+
+    Attributes:
+        sources: The state of each source, keyed by `source_key`.
+    """
+
+    sources: dict[str, SourceState] = Field(default_factory=dict)
+
+
+def source_key(kind: str, location: str, author: str) -> str:
+    """Build the key identifying a source in the state file.
+
+    Args:
+        kind: The kind of source, such as "git" or "github".
+        location: The location of the source, such as a repository path or full name.
+        author: The author whose commits are processed.
+    """
+    return f"{kind}:{location}@{author}"
+
+
+def state_path_for(brag_document_path: Path) -> Path:
+    """Return the path of the state sidecar file of a brag document."""
+    return brag_document_path.with_name(brag_document_path.name + _STATE_FILE_SUFFIX)
+
+
+def load_state(path: Path) -> BragDocumentState:
+    """Load the state from a file, or return an empty state if the file does not exist.
+
+    Raises:
+        ValueError: If the file is not a valid state file. Starting from an empty state
+            instead would process all commits again, and add them to the brag document
+            a second time.
+    """
+    try:
+        return BragDocumentState.model_validate_json(path.read_text())
+    except FileNotFoundError:
+        return BragDocumentState()
+    except ValueError as error:
+        raise ValueError(
+            f"The state file `{path}` is invalid. Fix it, or delete it to process all"
+            f" commits again.\n{error}"
+        ) from error
+
+
+def save_state(path: Path, state: BragDocumentState) -> None:
+    """Atomically save the state to a file."""
+    temporary_path = path.with_name(path.name + ".tmp")
+    temporary_path.write_text(state.model_dump_json(indent=2))
+    os.replace(temporary_path, path)
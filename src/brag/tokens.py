@@ -1,7 +1,53 @@
-"""Estimate the number of tokens in a text."""
+"""Estimate the number of tokens in a text.
 
+Besides the fixed character ratios of `estimate_token_count`, this module provides token
+estimators that can be plugged into batching and scheduling. The
+`CalibratedTokenEstimator` learns how many tokens a model uses per character of prose and
+per character of code from the usage reported by the provider.
+"""
+
+from __future__ import annotations
+
+import abc
+import copy
 import math
-from typing import Literal, assert_never
+import os
+from collections import deque
+from functools import cached_property
+from pathlib import Path
+from typing import Final, Literal, Self, assert_never
+
+from pydantic import BaseModel, Field
+
+from brag.models import TokenCount
+
+type TokenEstimatorKind = Literal["heuristic", "calibrated"]
+
+DEFAULT_SAFETY_QUANTILE: Final = 0.95
+MIN_CALIBRATION_OBSERVATIONS: Final = 5
+MAX_CALIBRATION_OBSERVATIONS: Final = 256
+
+_CALIBRATION_FILE_NAME: Final = "token_calibration.json"
+# Lines that start a diff, and lines that may follow them within a diff
+_DIFF_START_PREFIXES: Final = ("diff ", "@@", "--- a/", "+++ b/")
+_DIFF_LINE_PREFIXES: Final = (
+    *_DIFF_START_PREFIXES,
+    "+",
+    "-",
+    " ",
+    "\\",
+    "index ",
+    "new file mode ",
+    "deleted file mode ",
+    "old mode ",
+    "new mode ",
+    "similarity index ",
+    "rename from ",
+    "rename to ",
+    "copy from ",
+    "copy to ",
+    "Binary files ",
+)
 
 
 def estimate_token_count(
@@ -25,3 +71,265 @@ def estimate_token_count(
             return math.ceil(len(text) / 3)
         case never:
             assert_never(never)
+
+
+class TokenEstimator(abc.ABC):
+    """Estimate the number of tokens a model uses for a text."""
+
+    @abc.abstractmethod
+    def estimate(self, text: str) -> TokenCount:
+        """Estimate the number of tokens in a text."""
+
+    def observe(self, text: str, token_count: TokenCount) -> None:
+        """Record the number of tokens the model actually used for a text.
+
+        Estimators that do not learn from usage ignore the observation.
+        """
+
+    def save(self) -> None:
+        """Persist what the estimator learned from the observations, if anything."""
+
+    def snapshot(self) -> TokenEstimator:
+        """Return an estimator making the same estimates, unaffected by later observations.
+
+        Estimators that do not learn from usage return themselves.
+        """
+        return self
+
+
+class HeuristicTokenEstimator(TokenEstimator):
+    """Estimate token counts with fixed characters-per-token ratios.
+
+    See `estimate_token_count`.
+    """
+
+    def __init__(
+        self,
+        approximation_mode: Literal["underestimate", "overestimate"] = "overestimate",
+    ) -> None:
+        self.approximation_mode = approximation_mode
+
+    def estimate(self, text: str) -> TokenCount:
+        """Estimate the number of tokens in a text."""
+        return estimate_token_count(text, approximation_mode=self.approximation_mode)
+
+
+DEFAULT_TOKEN_ESTIMATOR: Final[TokenEstimator] = HeuristicTokenEstimator()
+
+
+class TokenObservation(BaseModel):
+    """The number of tokens a model used for a text.
+
+    Attributes:
+        prose_characters: The number of prose characters in the text.
+        code_characters: The number of code characters in the text.
+        token_count: The number of tokens reported by the provider.
+    """
+
+    prose_characters: int
+    code_characters: int
+    token_count: TokenCount
+
+
+class TokenCalibrations(BaseModel):
+    """The token observations of every model, as stored on disk.
+
+    Attributes:
+        models: The most recent observations of each model, keyed by model name.
+    """
+
+    models: dict[str, list[TokenObservation]] = Field(default_factory=dict)
+
+
+class CalibratedTokenEstimator(TokenEstimator):
+    """Estimate token counts with ratios learned from the usage reported by a model.
+
+    The token count of a text is modeled as a linear function of its number of prose
+    characters and its number of code characters, fitted by least squares on the most
+    recent observations. To avoid underestimating, the fitted estimate is scaled by the
+    `safety_quantile` quantile of the ratios between the observed and fitted token
+    counts, so that the estimate covers that fraction of the observations.
+
+    Until enough observations are available, the fallback estimator is used instead.
+
+    Attributes:
+        model_name: The name of the model whose usage is learned.
+        path: The path to the file storing the observations of all models. If None, the
+            observations are not persisted.
+        safety_quantile: The fraction of observations the estimates must cover.
+        fallback: The estimator to use until the estimator is calibrated.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        *,
+        path: Path | None = None,
+        safety_quantile: float = DEFAULT_SAFETY_QUANTILE,
+        fallback: TokenEstimator = DEFAULT_TOKEN_ESTIMATOR,
+    ) -> None:
+        if not 0 < safety_quantile <= 1:
+            raise ValueError("safety_quantile must be between 0 and 1")
+
+        self.model_name = model_name
+        self.path = path
+        self.safety_quantile = safety_quantile
+        self.fallback = fallback
+        self._observations: deque[TokenObservation] = deque(
+            self._load_calibrations().models.get(model_name, ()),
+            maxlen=MAX_CALIBRATION_OBSERVATIONS,
+        )
+
+    @classmethod
+    def in_directory(
+        cls,
+        cache_dir: Path,
+        model_name: str,
+        *,
+        safety_quantile: float = DEFAULT_SAFETY_QUANTILE,
+        fallback: TokenEstimator = DEFAULT_TOKEN_ESTIMATOR,
+    ) -> Self:
+        """Open the estimator whose observations are stored in the given cache directory."""
+        return cls(
+            model_name,
+            path=cache_dir / _CALIBRATION_FILE_NAME,
+            safety_quantile=safety_quantile,
+            fallback=fallback,
+        )
+
+    @property
+    def calibrated(self) -> bool:
+        """Whether there are enough observations to use the learned ratios."""
+        return len(self._observations) >= MIN_CALIBRATION_OBSERVATIONS
+
+    def estimate(self, text: str) -> TokenCount:
+        """Estimate the number of tokens in a text."""
+        if not self.calibrated:
+            return self.fallback.estimate(text)
+        prose_coefficient, code_coefficient, safety_factor = self._fit
+        prose_characters, code_characters = count_prose_and_code_characters(text)
+        return math.ceil(
+            safety_factor
+            * (
+                prose_coefficient * prose_characters
+                + code_coefficient * code_characters
+            )
+        )
+
+    def observe(self, text: str, token_count: TokenCount) -> None:
+        """Record the number of tokens the model actually used for a text."""
+        if token_count <= 0 or not text:
+            return
+        prose_characters, code_characters = count_prose_and_code_characters(text)
+        self._observations.append(
+            TokenObservation(
+                prose_characters=prose_characters,
+                code_characters=code_characters,
+                token_count=token_count,
+            )
+        )
+        # Invalidate the fit
+        self.__dict__.pop("_fit", None)
+
+    def save(self) -> None:
+        """Atomically persist the observations, keeping those of other models."""
+        if self.path is None:
+            return
+        calibrations = self._load_calibrations()
+        calibrations.models[self.model_name] = list(self._observations)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = self.path.with_name(self.path.name + ".tmp")
+        temporary_path.write_text(calibrations.model_dump_json())
+        os.replace(temporary_path, self.path)
+
+    def snapshot(self) -> CalibratedTokenEstimator:
+        """Return an estimator making the same estimates, unaffected by later observations.
+
+        The snapshot is not persisted, and can be used from another thread while this
+        estimator keeps learning.
+        """
+        snapshot = copy.copy(self)
+        snapshot.path = None
+        snapshot._observations = deque(
+            self._observations, maxlen=MAX_CALIBRATION_OBSERVATIONS
+        )
+        return snapshot
+
+    @cached_property
+    def _fit(self) -> tuple[float, float, float]:
+        """Fit the prose and code coefficients, and the safety factor."""
+        prose_coefficient, code_coefficient = _fit_coefficients(self._observations)
+        ratios = sorted(
+            observation.token_count
+            / (
+                prose_coefficient * observation.prose_characters
+                + code_coefficient * observation.code_characters
+            )
+            for observation in self._observations
+        )
+        safety_factor = ratios[math.ceil(self.safety_quantile * len(ratios)) - 1]
+        return prose_coefficient, code_coefficient, safety_factor
+
+    def _load_calibrations(self) -> TokenCalibrations:
+        if self.path is None:
+            return TokenCalibrations()
+        try:
+            return TokenCalibrations.model_validate_json(self.path.read_text())
+        except FileNotFoundError:
+            return TokenCalibrations()
+
+
+def count_prose_and_code_characters(text: str) -> tuple[int, int]:
+    """Count the characters of a text that belong to prose and to code.
+
+    Code is recognized as the lines of unified diffs, such as those in `git show`
+    output. Everything else is considered prose.
+
+    Returns:
+        The number of prose characters and the number of code characters.
+    """
+    prose_characters = code_characters = 0
+    in_diff = False
+    for line in text.splitlines(keepends=True):
+        if line.startswith(_DIFF_START_PREFIXES):
+            in_diff = True
+        elif in_diff and not line.startswith(_DIFF_LINE_PREFIXES):
+            in_diff = False
+
+        if in_diff:
+            code_characters += len(line)
+        else:
+            prose_characters += len(line)
+    return prose_characters, code_characters
+
+
+def _fit_coefficients(
+    observations: deque[TokenObservation],
+) -> tuple[float, float]:
+    """Fit the tokens per prose character and per code character by least squares.
+
+    If prose and code cannot be told apart, for example because all observations only
+    contain prose, a single coefficient is fitted for both.
+    """
+    prose_squares = sum(o.prose_characters**2 for o in observations)
+    code_squares = sum(o.code_characters**2 for o in observations)
+    cross_products = sum(o.prose_characters * o.code_characters for o in observations)
+    prose_tokens = sum(o.prose_characters * o.token_count for o in observations)
+    code_tokens = sum(o.code_characters * o.token_count for o in observations)
+
+    determinant = prose_squares * code_squares - cross_products**2
+    # Tolerate rounding errors in the determinant of nearly collinear observations
+    if determinant > 1e-9 * prose_squares * code_squares:
+        prose_coefficient = (
+            prose_tokens * code_squares - code_tokens * cross_products
+        ) / determinant
+        code_coefficient = (
+            code_tokens * prose_squares - prose_tokens * cross_products
+        ) / determinant
+        if prose_coefficient > 0 and code_coefficient > 0:
+            return prose_coefficient, code_coefficient
+
+    coefficient = (prose_tokens + code_tokens) / (
+        prose_squares + 2 * cross_products + code_squares
+    )
+    return coefficient, coefficient
@@ -0,0 +1,339 @@
+"""A local stub of the Github API, serving the endpoints used by the commit sources."""
+
+import base64
+import hashlib
+import json
+import re
+import threading
+import time
+from collections.abc import Iterator, Sequence
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+from urllib.parse import parse_qs, urlsplit
+
+from github import Github
+
+OWNER = "octocat"
+NAME = "hello-world"
+AUTHOR = "octocat"
+
+
+@dataclass(frozen=True)
+class StubFile:
+    """A file changed by a stub commit."""
+
+    filename: str
+    patch: str | None = None
+    status: str = "modified"
+    additions: int = 1
+    deletions: int = 0
+
+
+@dataclass(frozen=True)
+class StubCommit:
+    """A commit served by the stub."""
+
+    sha: str
+    message: str
+    committed_at: datetime
+    files: Sequence[StubFile] = ()
+    author: str = AUTHOR
+
+
+@dataclass
+class GithubStub:
+    """The state of the stub: the commits it serves and the requests it received.
+
+    Attributes:
+        commits: The commits of the default branch, from the most recent.
+        files: The contents of the files of the default branch, by path.
+        requests: The method and path of every request received, in order. Successful
+            responses carry an `ETag`, and are answered with `304 Not Modified` when
+            requested with a matching `If-None-Match` header.
+        base_url: The base URL of the stub, once it is running.
+        commit_delay: The time taken to serve each commit, in seconds.
+        max_commits_in_flight: The maximum number of commits served concurrently.
+        quota: The number of requests left in the rate limit window, reported in the
+            `X-RateLimit-*` headers of every response.
+        rate_limited_requests: The number of upcoming requests rejected with
+            `429 Too Many Requests` and a `Retry-After` header.
+        retry_after: The number of seconds rejected requests are asked to wait.
+    """
+
+    commits: Sequence[StubCommit] = ()
+    files: dict[str, str] = field(default_factory=dict)
+    requests: list[tuple[str, str]] = field(default_factory=list)
+    base_url: str = ""
+    commit_delay: float = 0
+    max_commits_in_flight: int = 0
+    quota: int = 5000
+    rate_limited_requests: int = 0
+    retry_after: float = 0
+    _commits_in_flight: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def client(self) -> Github:
+        """Create a Github client connected to the stub."""
+        return Github(
+            base_url=self.base_url,
+            seconds_between_requests=None,
+            seconds_between_writes=None,
+            retry=None,
+        )
+
+    def requested_paths(self, method: str = "GET") -> list[str]:
+        """Return the paths requested with the given method, without query strings."""
+        return [urlsplit(path).path for m, path in self.requests if m == method]
+
+
+@contextmanager
+def serve_github_stub(stub: GithubStub) -> Iterator[GithubStub]:
+    """Serve the stub on a local port for the duration of the context."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _handler_for(stub))
+    stub.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+    )
+    thread.start()
+    try:
+        yield stub
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def _handler_for(stub: GithubStub) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+        def do_GET(self) -> None:
+            stub.requests.append(("GET", self.path))
+            with stub._lock:
+                stub.quota = max(0, stub.quota - 1)
+                rate_limited = stub.rate_limited_requests > 0
+                stub.rate_limited_requests -= rate_limited
+            if rate_limited:
+                self._send_json(
+                    {"message": "You have exceeded a secondary rate limit."},
+                    status=HTTPStatus.TOO_MANY_REQUESTS,
+                    headers={"Retry-After": str(stub.retry_after)},
+                )
+                return
+
+            url = urlsplit(self.path)
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            repo_path = f"/repos/{OWNER}/{NAME}"
+
+            if url.path == repo_path:
+                self._send_json(_repo_json(stub))
+            elif match := re.fullmatch(rf"{repo_path}/contents/(.+)", url.path):
+                self._send_contents(match.group(1))
+            elif url.path == f"{repo_path}/commits":
+                self._send_commit_page(query)
+            elif match := re.fullmatch(rf"{repo_path}/commits/(\w+)", url.path):
+                self._send_commit(match.group(1))
+            else:
+                self._send_json({"message": "Not Found"}, status=404)
+
+        def do_POST(self) -> None:
+            stub.requests.append(("POST", self.path))
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if self.path != "/graphql":
+                self._send_json({"message": "Not Found"}, status=404)
+            elif "user(login" in body["query"]:
+                login = body["variables"]["login"]
+                self._send_json({"data": {"user": {"id": f"U_{login}"}}})
+            else:
+                self._send_json(_history_json(stub, body["variables"]))
+
+        def _send_contents(self, path: str) -> None:
+            if path not in stub.files:
+                self._send_json({"message": "Not Found"}, status=404)
+                return
+            self._send_json(
+                {
+                    "type": "file",
+                    "encoding": "base64",
+                    "name": path.rsplit("/", 1)[-1],
+                    "path": path,
+                    "content": base64.b64encode(stub.files[path].encode()).decode(),
+                }
+            )
+
+        def _send_commit_page(self, query: dict[str, str]) -> None:
+            commits = [
+                commit
+                for commit in stub.commits
+                if _matches(commit, query.get("author"), query.get("since"))
+                and _before(commit, query.get("until"))
+            ]
+            per_page = int(query.get("per_page", 30))
+            page = int(query.get("page", 1))
+            last_page = max(1, -(-len(commits) // per_page))
+            links = [
+                f'<{self._page_url(query, number)}>; rel="{rel}"'
+                for number, rel in ((page + 1, "next"), (last_page, "last"))
+                if page < last_page
+            ]
+            self._send_json(
+                [
+                    _commit_json(stub, commit, with_files=False)
+                    for commit in commits[(page - 1) * per_page : page * per_page]
+                ],
+                headers={"Link": ", ".join(links)} if links else {},
+            )
+
+        def _send_commit(self, sha: str) -> None:
+            with stub._lock:
+                stub._commits_in_flight += 1
+                stub.max_commits_in_flight = max(
+                    stub.max_commits_in_flight, stub._commits_in_flight
+                )
+            time.sleep(stub.commit_delay)
+            with stub._lock:
+                stub._commits_in_flight -= 1
+
+            commit = next((c for c in stub.commits if c.sha == sha), None)
+            if commit is None:
+                self._send_json({"message": "Not Found"}, status=404)
+            else:
+                self._send_json(_commit_json(stub, commit, with_files=True))
+
+        def _page_url(self, query: dict[str, str], page: int) -> str:
+            parameters = "&".join(
+                f"{key}={value}" for key, value in {**query, "page": page}.items()
+            )
+            return f"{stub.base_url}{urlsplit(self.path).path}?{parameters}"
+
+        def _send_json(
+            self,
+            payload: object,
+            *,
+            status: int = 200,
+            headers: dict[str, str] | None = None,
+        ) -> None:
+            body = json.dumps(payload).encode()
+            etag = f'"{hashlib.sha256(body).hexdigest()}"'
+            if status == HTTPStatus.OK and self.headers.get("If-None-Match") == etag:
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self.send_header("ETag", etag)
+                self._send_rate_limit_headers()
+                self.end_headers()
+                return
+
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            if status == HTTPStatus.OK:
+                self.send_header("ETag", etag)
+            self._send_rate_limit_headers()
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_rate_limit_headers(self) -> None:
+            self.send_header("X-RateLimit-Limit", "5000")
+            self.send_header("X-RateLimit-Remaining", str(stub.quota))
+            self.send_header("X-RateLimit-Reset", str(int(time.time()) + 3600))
+            self.send_header("X-RateLimit-Resource", "core")
+
+    return Handler
+
+
+def _repo_json(stub: GithubStub) -> dict[str, Any]:
+    return {
+        "id": 1,
+        "name": NAME,
+        "full_name": f"{OWNER}/{NAME}",
+        "owner": {"login": OWNER},
+        "url": f"{stub.base_url}/repos/{OWNER}/{NAME}",
+    }
+
+
+def _commit_json(
+    stub: GithubStub, commit: StubCommit, *, with_files: bool
+) -> dict[str, Any]:
+    payload: dict[str, Any] = {
+        "sha": commit.sha,
+        "url": f"{stub.base_url}/repos/{OWNER}/{NAME}/commits/{commit.sha}",
+        "commit": {
+            "message": commit.message,
+            "committer": {"date": commit.committed_at.isoformat()},
+            "author": {"date": commit.committed_at.isoformat()},
+        },
+        "author": {"login": commit.author},
+    }
+    if with_files:
+        payload["files"] = [
+            {
+                "filename": file.filename,
+                "status": file.status,
+                "additions": file.additions,
+                "deletions": file.deletions,
+                "changes": file.additions + file.deletions,
+                **({"patch": file.patch} if file.patch is not None else {}),
+            }
+            for file in commit.files
+        ]
+    return payload
+
+
+def _history_json(stub: GithubStub, variables: dict[str, Any]) -> dict[str, Any]:
+    author = variables["author"]
+    login = author["id"].removeprefix("U_") if "id" in author else None
+    commits = [
+        commit
+        for commit in stub.commits
+        if _matches(commit, login, variables["since"])
+        and _before(commit, variables["until"])
+    ]
+    start = int(variables["cursor"] or 0)
+    end = start + variables["first"]
+    return {
+        "data": {
+            "repository": {
+                "defaultBranchRef": {
+                    "target": {
+                        "history": {
+                            "pageInfo": {
+                                "hasNextPage": end < len(commits),
+                                "endCursor": str(end),
+                            },
+                            "nodes": [
+                                {
+                                    "oid": commit.sha,
+                                    "message": commit.message,
+                                    "committedDate": commit.committed_at.isoformat(),
+                                    "changedFilesIfAvailable": len(commit.files),
+                                    "additions": sum(
+                                        file.additions for file in commit.files
+                                    ),
+                                    "deletions": sum(
+                                        file.deletions for file in commit.files
+                                    ),
+                                }
+                                for commit in commits[start:end]
+                            ],
+                        }
+                    }
+                }
+            }
+        }
+    }
+
+
+def _matches(commit: StubCommit, author: str | None, since: str | None) -> bool:
+    return (author is None or commit.author == author) and (
+        since is None or commit.committed_at >= datetime.fromisoformat(since)
+    )
+
+
+def _before(commit: StubCommit, until: str | None) -> bool:
+    return until is None or commit.committed_at <= datetime.fromisoformat(until)
@@ -0,0 +1,126 @@
+"""Tests for the achievements module."""
+
+from datetime import date
+
+import pytest
+
+from brag.achievements import Achievement, merge_achievements, render_achievements
+
+
+def _achievement(
+    title: str,
+    *,
+    impact: str = "",
+    skills: list[str] | None = None,
+    commit_shas: list[str] | None = None,
+    files: list[str] | None = None,
+) -> Achievement:
+    return Achievement(
+        title=title,
+        impact=impact or title,
+        skills=skills or [],
+        commit_shas=commit_shas or [],
+        files=files or [],
+    )
+
+
+@pytest.mark.parametrize(
+    ("first", "second"),
+    (
+        pytest.param(
+            _achievement("Added full-text search"),
+            _achievement("added Full Text search!"),
+            id="normalized title",
+        ),
+        pytest.param(
+            _achievement("Added search", commit_shas=["0123456789abcdef"]),
+            _achievement("Indexed documents", commit_shas=["0123456"]),
+            id="shared commit",
+        ),
+        pytest.param(
+            _achievement("Added search", files=["search.py", "index.py", "api.py"]),
+            _achievement("Indexed documents", files=["search.py", "index.py"]),
+            id="file overlap",
+        ),
+    ),
+)
+def test_merge_achievements_merges_duplicates(
+    first: Achievement, second: Achievement
+) -> None:
+    (merged,) = merge_achievements([first, second])
+
+    assert merged.title == first.title
+
+
+@pytest.mark.parametrize(
+    ("first", "second"),
+    (
+        pytest.param(
+            _achievement("Added search", files=["CHANGELOG.md"]),
+            _achievement("Fixed login", files=["CHANGELOG.md"]),
+            id="single shared file",
+        ),
+        pytest.param(
+            _achievement("Added search", files=["a.py", "b.py", "c.py", "d.py"]),
+            _achievement("Fixed login", files=["a.py", "b.py", "e.py", "f.py"]),
+            id="low file overlap",
+        ),
+        pytest.param(
+            _achievement("Added search", commit_shas=[""]),
+            _achievement("Fixed login", commit_shas=[""]),
+            id="empty commit shas",
+        ),
+    ),
+)
+def test_merge_achievements_keeps_distinct_achievements(
+    first: Achievement, second: Achievement
+) -> None:
+    assert merge_achievements([first, second]) == [first, second]
+
+
+def test_merge_achievements_combines_details_in_order() -> None:
+    achievements = [
+        _achievement("Added search", impact="Faster.", skills=["Python"]),
+        _achievement("Fixed login", skills=["OAuth"]),
+        Achievement(
+            title="Added Search",
+            impact="Used by every team.",
+            skills=["python", "SQL"],
+            commit_shas=["abc"],
+            dates=[date(2024, 2, 1), date(2024, 1, 1)],
+        ),
+    ]
+
+    search, login = merge_achievements(achievements)
+
+    assert search == Achievement(
+        title="Added search",
+        impact="Faster. Used by every team.",
+        skills=["Python", "SQL"],
+        commit_shas=["abc"],
+        dates=[date(2024, 1, 1), date(2024, 2, 1)],
+    )
+    assert login == achievements[1]
+
+
+def test_render_achievements() -> None:
+    achievements = [
+        Achievement(
+            title="Added search",
+            impact="Searches take 50 ms.",
+            skills=["Python", "SQL"],
+            commit_shas=["0123456789abcdef"],
+            dates=[date(2024, 1, 1), date(2024, 2, 1)],
+        ),
+        Achievement(title="Fixed login", impact="No more lockouts."),
+    ]
+
+    assert render_achievements(achievements) == (
+        "## Added search\n\n"
+        "Searches take 50 ms.\n\n"
+        "- **Skills:** Python, SQL\n"
+        "- **Dates:** 2024-01-01 to 2024-02-01\n"
+        "- **Commits:** 0123456\n\n"
+        "## Fixed login\n\n"
+        "No more lockouts."
+    )
@@ -0,0 +1,635 @@
+"""Tests for the agents module."""
+
+import asyncio
+import json
+import os
+import re
+from collections.abc import AsyncIterator, Callable, Iterator
+from pathlib import Path
+
+import pytest
+from pydantic_ai import Agent
+from pydantic_ai.messages import (
+    ModelMessage,
+    ModelResponse,
+    SystemPromptPart,
+    TextPart,
+    ToolCallPart,
+    UserPromptPart,
+)
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+from brag import agents
+from brag.agents import GenerationStrategy, generate_brag_document
+from brag.cache import ResponseCache
+from brag.checkpoints import CheckpointFile
+from brag.scheduling import LLMScheduler
+from brag.tokens import HeuristicTokenEstimator
+
+
+def _last_user_prompt(messages: list[ModelMessage]) -> str:
+    for part in messages[-1].parts:
+        if isinstance(part, UserPromptPart):
+            if isinstance(part.content, str):
+                return part.content
+            return "".join(item for item in part.content if isinstance(item, str))
+    raise AssertionError("No user prompt found")
+
+
+def _echo_model(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+    """Summarize a prompt by concatenating the contents of its tagged sections."""
+    prompt = _last_user_prompt(messages)
+    sections = re.findall(
+        r"<(context|brag_document|existing_brag_document)>\n(.*?)\n</\1>",
+        prompt,
+        flags=re.DOTALL,
+    )
+    return ModelResponse(parts=[TextPart("+".join(text for _, text in sections))])
+
+
+@pytest.fixture
+def prompts(monkeypatch: pytest.MonkeyPatch) -> list[str]:
+    """Replace the model used by the agents with a deterministic function model."""
+    recorded_prompts: list[str] = []
+
+    def model_function(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+        recorded_prompts.append(_last_user_prompt(messages))
+        return _echo_model(messages, info)
+
+    async def stream_function(
+        messages: list[ModelMessage], info: AgentInfo
+    ) -> AsyncIterator[str]:
+        (part,) = model_function(messages, info).parts
+        assert isinstance(part, TextPart)
+        # Stream the response one character at a time
+        for character in part.content:
+            yield character
+
+    def build_agent(
+        model_name: str, system_prompt: str, output_type: type[object] = str
+    ) -> Agent:
+        return Agent(
+            FunctionModel(model_function, stream_function=stream_function),
+            system_prompt=system_prompt,
+            output_type=output_type,
+        )
+
+    monkeypatch.setattr(agents, "_build_agent_from_system_prompt", build_agent)
+    return recorded_prompts
+
+
+def _edits_model(section: str, calls: list[str]) -> FunctionModel:
+    """Build a model inserting the context of prompts as bullets of a section.
+
+    Initial brag documents have a single "Achievements" section, and brag documents are
+    rewritten by concatenating the contents of the tagged sections of the prompt. The
+    kind of every call, "edits" or "text", is recorded in `calls`.
+    """
+
+    def model_function(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+        prompt = _last_user_prompt(messages)
+        contexts = re.findall(r"<context>\n(.*?)\n</context>", prompt)
+        if not info.output_tools:
+            calls.append("text")
+            if prompt.startswith("Generate"):
+                return ModelResponse(
+                    parts=[TextPart(f"# Achievements\n\n- {contexts[0]}")]
+                )
+            return _echo_model(messages, info)
+
+        calls.append("edits")
+        edits = [{"kind": "insert_bullet", "section": section, "text": contexts[0]}]
+        return ModelResponse(
+            parts=[ToolCallPart(info.output_tools[0].name, {"edits": edits})]
+        )
+
+    return FunctionModel(model_function)
+
+
+@pytest.fixture
+def use_edits_model(monkeypatch: pytest.MonkeyPatch) -> Callable[[str], list[str]]:
+    """Replace the model used by the agents with `_edits_model`, returning its calls."""
+
+    def use(section: str) -> list[str]:
+        calls: list[str] = []
+
+        def build_agent(
+            model_name: str, system_prompt: str, output_type: type[object] = str
+        ) -> Agent:
+            return Agent(
+                _edits_model(section, calls),
+                system_prompt=system_prompt,
+                output_type=output_type,
+            )
+
+        monkeypatch.setattr(agents, "_build_agent_from_system_prompt", build_agent)
+        return calls
+
+    return use
+
+
+def test_generate_brag_document_refine(prompts: list[str]) -> None:
+    chunks = ["a", "b", "c"]
+    result = asyncio.run(generate_brag_document("test", chunks))
+
+    assert result == "a+b+c"
+    assert len(prompts) == len(chunks)
+
+
+def test_generate_brag_document_refine_with_input_document(
+    prompts: list[str],
+) -> None:
+    chunks = ["a", "b"]
+    result = asyncio.run(
+        generate_brag_document("test", chunks, input_brag_document="x")
+    )
+
+    assert result == "x+a+b"
+    assert len(prompts) == len(chunks)
+
+
+@pytest.mark.parametrize(
+    ("chunks", "merge_arity", "expected_call_count"),
+    (
+        pytest.param(["a"], 2, 1, id="single chunk"),
+        pytest.param(["a", "b"], 2, 3, id="two chunks"),
+        pytest.param(["a", "b", "c", "d", "e"], 2, 9, id="binary tree"),
+        pytest.param(["a", "b", "c", "d", "e"], 3, 8, id="ternary tree"),
+        pytest.param(["a", "b", "c", "d", "e"], 5, 6, id="single merge"),
+    ),
+)
+def test_generate_brag_document_tree(
+    prompts: list[str],
+    chunks: list[str],
+    merge_arity: int,
+    expected_call_count: int,
+) -> None:
+    result = asyncio.run(
+        generate_brag_document("test", chunks, strategy="tree", merge_arity=merge_arity)
+    )
+
+    assert result == "+".join(chunks)
+    assert len(prompts) == expected_call_count
+
+
+@pytest.mark.parametrize("strategy", ("refine", "tree"))
+def test_generate_brag_document_processes_chunks_as_they_arrive(
+    prompts: list[str], strategy: GenerationStrategy
+) -> None:
+    prompts_before_chunk: list[int] = []
+
+    async def chunks() -> AsyncIterator[str]:
+        for chunk in ("a", "b", "c"):
+            prompts_before_chunk.append(len(prompts))
+            yield chunk
+            # Let the model process the chunk before providing the next one
+            await asyncio.sleep(0.01)
+
+    result = asyncio.run(generate_brag_document("test", chunks(), strategy=strategy))
+
+    assert result == "a+b+c"
+    assert prompts_before_chunk == [0, 1, 2]
+
+
+def test_generate_brag_document_tree_folds_input_document_at_final_merge(
+    prompts: list[str],
+) -> None:
+    result = asyncio.run(
+        generate_brag_document(
+            "test", ["a", "b", "c"], input_brag_document="x", strategy="tree"
+        )
+    )
+
+    assert result == "x+a+b+c"
+    # Three summaries, two intermediate merges and the final merge
+    *summary_prompts, first_merge_prompt, second_merge_prompt, final_prompt = prompts
+    assert [prompt.startswith("Generate") for prompt in summary_prompts] == [True] * 3
+    assert "<existing_brag_document>" not in first_merge_prompt
+    assert "<existing_brag_document>" not in second_merge_prompt
+    assert "<existing_brag_document>\nx\n</existing_brag_document>" in final_prompt
+
+
+def test_generate_brag_document_tree_without_chunks_returns_input_document(
+    prompts: list[str],
+) -> None:
+    result = asyncio.run(
+        generate_brag_document("test", [], input_brag_document="x", strategy="tree")
+    )
+
+    assert result == "x"
+    assert not prompts
+
+
+def test_generate_brag_document_refine_without_chunks_or_input_document(
+    prompts: list[str],
+) -> None:
+    with pytest.raises(ValueError, match="at least one chunk"):
+        asyncio.run(generate_brag_document("test", []))
+
+
+def test_generate_brag_document_tree_without_chunks_or_input_document(
+    prompts: list[str],
+) -> None:
+    with pytest.raises(ValueError, match="at least one chunk"):
+        asyncio.run(generate_brag_document("test", [], strategy="tree"))
+
+
+def test_generate_brag_document_tree_merge_arity_must_be_at_least_two(
+    prompts: list[str],
+) -> None:
+    with pytest.raises(ValueError, match="merge_arity must be at least 2"):
+        asyncio.run(
+            generate_brag_document("test", ["a"], strategy="tree", merge_arity=1)
+        )
+
+
+def test_generate_brag_document_reuses_cached_responses(
+    prompts: list[str], tmp_path: Path
+) -> None:
+    chunks = ["a", "b", "c"]
+
+    with ResponseCache.in_directory(tmp_path) as cache:
+        first_result = asyncio.run(generate_brag_document("test", chunks, cache=cache))
+        second_result = asyncio.run(generate_brag_document("test", chunks, cache=cache))
+
+    assert first_result == second_result == "a+b+c"
+    assert len(prompts) == len(chunks)
+
+
+def test_generate_brag_document_resumes_from_checkpoint(
+    prompts: list[str], tmp_path: Path
+) -> None:
+    chunks = ["a", "b", "c", "d"]
+    checkpoint = CheckpointFile.in_directory(tmp_path, "fingerprint")
+
+    def interrupted_chunks() -> Iterator[str]:
+        yield from chunks[:2]
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        asyncio.run(
+            generate_brag_document("test", interrupted_chunks(), checkpoint=checkpoint)
+        )
+    assert checkpoint.latest is not None
+    assert checkpoint.latest.brag_document == "a+b"
+
+    prompts.clear()
+    result = asyncio.run(
+        generate_brag_document(
+            "test",
+            chunks,
+            checkpoint=CheckpointFile.in_directory(tmp_path, "fingerprint"),
+        )
+    )
+
+    assert result == "a+b+c+d"
+    assert len(prompts) == len(chunks) - 2
+
+
+def test_generate_brag_document_ignores_checkpoint_for_other_chunks(
+    prompts: list[str], tmp_path: Path
+) -> None:
+    checkpoint = CheckpointFile.in_directory(tmp_path, "fingerprint")
+    asyncio.run(generate_brag_document("test", ["a", "b"], checkpoint=checkpoint))
+
+    prompts.clear()
+    chunks = ["x", "y", "z"]
+    result = asyncio.run(generate_brag_document("test", chunks, checkpoint=checkpoint))
+
+    assert result == "x+y+z"
+    assert len(prompts) == len(chunks)
+
+
+def test_generate_brag_document_reports_token_usage_to_the_estimator(
+    prompts: list[str],
+) -> None:
+    observations: list[tuple[str, int]] = []
+
+    class RecordingTokenEstimator(HeuristicTokenEstimator):
+        def observe(self, text: str, token_count: int) -> None:
+            observations.append((text, token_count))
+
+    chunks = ["a", "b", "c"]
+    scheduler = LLMScheduler(token_estimator=RecordingTokenEstimator())
+    asyncio.run(generate_brag_document("test", chunks, scheduler=scheduler))
+
+    assert len(observations) == len(prompts)
+    for (text, _), prompt in zip(observations, prompts, strict=True):
+        assert text.endswith(prompt)
+    assert all(token_count > 0 for _, token_count in observations)
+
+
+@pytest.mark.parametrize(
+    ("strategy", "chunks", "input_brag_document"),
+    (
+        pytest.param("refine", ["a", "b", "c"], None, id="refine"),
+        pytest.param("refine", ["a"], "x", id="refine with input document"),
+        pytest.param("tree", ["a", "b", "c"], None, id="tree"),
+        pytest.param("tree", ["a", "b"], "x", id="tree with input document"),
+    ),
+)
+def test_generate_brag_document_streams_the_final_call(
+    prompts: list[str],
+    strategy: GenerationStrategy,
+    chunks: list[str],
+    input_brag_document: str | None,
+) -> None:
+    texts: list[str] = []
+
+    result = asyncio.run(
+        generate_brag_document(
+            "test",
+            chunks,
+            input_brag_document=input_brag_document,
+            strategy=strategy,
+            on_text=texts.append,
+        )
+    )
+
+    # Only the final call is streamed, one character at a time
+    assert texts == list(result)
+
+
+@pytest.mark.parametrize(
+    ("strategy", "chunks", "input_brag_document"),
+    (
+        pytest.param("refine", [], "x", id="refine without chunks"),
+        pytest.param("tree", [], "x", id="tree without chunks"),
+        pytest.param("tree", ["a"], None, id="tree with a single chunk"),
+    ),
+)
+def test_generate_brag_document_passes_documents_not_generated_last_at_once(
+    prompts: list[str],
+    strategy: GenerationStrategy,
+    chunks: list[str],
+    input_brag_document: str | None,
+) -> None:
+    texts: list[str] = []
+
+    result = asyncio.run(
+        generate_brag_document(
+            "test",
+            chunks,
+            input_brag_document=input_brag_document,
+            strategy=strategy,
+            on_text=texts.append,
+        )
+    )
+
+    assert texts == [result]
+
+
+def test_generate_brag_document_passes_cached_documents_at_once(
+    prompts: list[str], tmp_path: Path
+) -> None:
+    chunks = ["a", "b"]
+    with ResponseCache.in_directory(tmp_path) as cache:
+        asyncio.run(generate_brag_document("test", chunks, cache=cache))
+        texts: list[str] = []
+        result = asyncio.run(
+            generate_brag_document("test", chunks, cache=cache, on_text=texts.append)
+        )
+
+    assert texts == [result]
+
+
+@pytest.mark.parametrize(
+    ("strategy", "chunks", "input_brag_document"),
+    (
+        pytest.param("refine", ["a", "b", "c"], "x", id="refine"),
+        # Only the final merge would include an input document
+        pytest.param("tree", ["a", "b", "c", "d"], None, id="tree"),
+    ),
+)
+def test_generate_brag_document_lays_out_prompts_for_prefix_caching(
+    monkeypatch: pytest.MonkeyPatch,
+    strategy: GenerationStrategy,
+    chunks: list[str],
+    input_brag_document: str | None,
+) -> None:
+    user_prompts: list[str] = []
+    system_prompts: set[str] = set()
+
+    def model_function(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+        for part in messages[-1].parts:
+            if isinstance(part, SystemPromptPart):
+                system_prompts.add(part.content)
+            if isinstance(part, UserPromptPart):
+                assert isinstance(part.content, str)
+                user_prompts.append(part.content)
+        return _echo_model(messages, info)
+
+    def build_agent(model_name: str, system_prompt: str) -> Agent:
+        return Agent(FunctionModel(model_function), system_prompt=system_prompt)
+
+    monkeypatch.setattr(agents, "_build_agent_from_system_prompt", build_agent)
+    asyncio.run(
+        generate_brag_document(
+            "test",
+            chunks,
+            language="French",
+            input_brag_document=input_brag_document,
+            strategy=strategy,
+        )
+    )
+
+    # The language is part of the user prompt, so that system prompts never change
+    assert not any("French" in system_prompt for system_prompt in system_prompts)
+    prompts_by_kind: dict[str, list[str]] = {}
+    for prompt in user_prompts:
+        prompts_by_kind.setdefault(prompt.split(" ", 1)[0], []).append(prompt)
+    assert any(len(prompts) > 1 for prompts in prompts_by_kind.values())
+    for prompts in prompts_by_kind.values():
+        # Requests of the same kind share their instructions and language, which come
+        # before the content specific to each request
+        assert "French" in os.path.commonprefix(prompts)
+        assert not any("<" in prompt[: prompt.index("French")] for prompt in prompts)
+
+
+def test_generate_brag_document_refine_with_edits(
+    use_edits_model: Callable[[str], list[str]],
+) -> None:
+    calls = use_edits_model("Achievements")
+    texts: list[str] = []
+
+    result = asyncio.run(
+        generate_brag_document(
+            "test", ["a", "b", "c"], update_mode="edits", on_text=texts.append
+        )
+    )
+
+    assert result == "# Achievements\n\n- a\n- b\n- c"
+    assert calls == ["text", "edits", "edits"]
+    # The edited brag document is passed at once
+    assert texts == [result]
+
+
+def test_generate_brag_document_refine_rewrites_when_edits_do_not_apply(
+    use_edits_model: Callable[[str], list[str]],
+) -> None:
+    calls = use_edits_model("Unknown section")
+
+    result = asyncio.run(
+        generate_brag_document("test", ["a", "b"], update_mode="edits")
+    )
+
+    assert result == "# Achievements\n\n- a+b"
+    assert calls == ["text", "edits", "text"]
+
+
+def test_generate_brag_document_reuses_cached_edits(
+    use_edits_model: Callable[[str], list[str]], tmp_path: Path
+) -> None:
+    calls = use_edits_model("Achievements")
+    chunks = ["a", "b"]
+
+    with ResponseCache.in_directory(tmp_path) as cache:
+        first_result = asyncio.run(
+            generate_brag_document("test", chunks, update_mode="edits", cache=cache)
+        )
+        second_result = asyncio.run(
+            generate_brag_document("test", chunks, update_mode="edits", cache=cache)
+        )
+
+    assert first_result == second_result
+    assert calls == ["text", "edits"]
+
+
+@pytest.fixture
+def achievements_calls(monkeypatch: pytest.MonkeyPatch) -> list[str]:
+    """Replace the model used by the agents with a model extracting achievements.
+
+    Every chunk is a single achievement titled after its context, except for chunks with
+    an empty context, which have no achievements. Brag documents are written by joining
+    the titles of the achievements with "+". The kind of every call, "extract" or
+    "render", is recorded.
+    """
+    calls: list[str] = []
+
+    def model_function(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+        prompt = _last_user_prompt(messages)
+        if info.output_tools:
+            calls.append("extract")
+            (context,) = re.findall(r"<context>\n(.*?)\n?</context>", prompt)
+            achievements = [{"title": context, "impact": context}] if context else []
+            return ModelResponse(
+                parts=[
+                    ToolCallPart(
+                        info.output_tools[0].name, {"achievements": achievements}
+                    )
+                ]
+            )
+
+        calls.append("render")
+        (achievements_json,) = re.findall(
+            r"<achievements>\n(.*?)\n</achievements>", prompt, flags=re.DOTALL
+        )
+        achievements = json.loads(achievements_json)["achievements"]
+        return ModelResponse(
+            parts=[TextPart("+".join(item["title"] for item in achievements))]
+        )
+
+    async def stream_function(
+        messages: list[ModelMessage], info: AgentInfo
+    ) -> AsyncIterator[str]:
+        (part,) = model_function(messages, info).parts
+        assert isinstance(part, TextPart)
+        for character in part.content:
+            yield character
+
+    def build_agent(
+        model_name: str, system_prompt: str, output_type: type[object] = str
+    ) -> Agent:
+        return Agent(
+            FunctionModel(model_function, stream_function=stream_function),
+            system_prompt=system_prompt,
+            output_type=output_type,
+        )
+
+    monkeypatch.setattr(agents, "_build_agent_from_system_prompt", build_agent)
+    return calls
+
+
+def test_generate_brag_document_extract_renders_deduplicated_achievements(
+    achievements_calls: list[str],
+) -> None:
+    texts: list[str] = []
+
+    result = asyncio.run(
+        generate_brag_document(
+            "test", ["a", "b", "A", "c"], strategy="extract", on_text=texts.append
+        )
+    )
+
+    assert result == "a+b+c"
+    assert achievements_calls == ["extract"] * 4 + ["render"]
+    # The render call is streamed
+    assert texts == list(result)
+
+
+def test_generate_brag_document_extract_with_template(
+    achievements_calls: list[str],
+) -> None:
+    result = asyncio.run(
+        generate_brag_document(
+            "test",
+            ["a", "b"],
+            input_brag_document="# x",
+            strategy="extract",
+            render_mode="template",
+        )
+    )
+
+    assert result == "# x\n\n## a\n\na\n\n## b\n\nb"
+    assert achievements_calls == ["extract"] * 2
+
+
+def test_generate_brag_document_extract_without_chunks_returns_input_document(
+    achievements_calls: list[str],
+) -> None:
+    result = asyncio.run(
+        generate_brag_document("test", [], input_brag_document="x", strategy="extract")
+    )
+
+    assert result == "x"
+    assert not achievements_calls
+
+
+def test_generate_brag_document_extract_without_achievements(
+    achievements_calls: list[str],
+) -> None:
+    texts: list[str] = []
+
+    result = asyncio.run(
+        generate_brag_document(
+            "test", ["", ""], strategy="extract", on_text=texts.append
+        )
+    )
+
+    assert result == ""
+    assert texts == [""]
+    # No render call is made for an empty list of achievements
+    assert achievements_calls == ["extract"] * 2
+
+
+def test_generate_brag_document_extract_without_chunks_or_input_document(
+    achievements_calls: list[str],
+) -> None:
+    with pytest.raises(ValueError, match="at least one chunk"):
+        asyncio.run(generate_brag_document("test", [], strategy="extract"))
+
+
+def test_model_settings_mark_the_system_prompt_for_anthropic_caching() -> None:
+    settings = agents._model_settings("anthropic:claude-sonnet-4-0", "Be brief.")
+
+    assert settings.get("temperature") == 0.0
+    assert settings.get("extra_body") == {
+        "system": [
+            {
+                "type": "text",
+                "text": "Be brief.",
+                "cache_control": {"type": "ephemeral"},
+            }
+        ]
+    }
+    assert "extra_body" not in agents._model_settings("openai:gpt-4o", "Be brief.")
@@ -1,8 +1,21 @@
 """Tests for the batching module."""
 
+from collections.abc import Iterator
+
 import pytest
 
-from brag.batching import batch_chunks_by_token_limit
+from brag.batching import (
+    DEFAULT_BATCH_JOINER,
+    BatchingStrategy,
+    batch_chunks,
+    batch_chunks_by_token_limit,
+    batch_chunks_with_lookahead,
+    batch_fill_ratio,
+    pack_chunks_first_fit_decreasing,
+)
+from brag.models import TokenCount
+from brag.text_formatters import promptify
+from brag.tokens import DEFAULT_TOKEN_ESTIMATOR
 
 
 @pytest.mark.parametrize(
@@ -56,6 +69,18 @@ from brag.batching import batch_chunks_by_token_limit
             ["chunk1", "chunk2"],
             id="multiple consecutive empty chunks",
         ),
+        pytest.param(
+            ["\n    chunk1\n      indented\n", "  chunk2\n", "\n   \n"],
+            100,
+            ["chunk1\n  indented\n\n---\n\nchunk2"],
+            id="chunks are dedented and blank chunks are dropped",
+        ),
+        pytest.param(
+            ["chunk1", "  chunk2\n", "  chunk3\n"],
+            1,
+            ["chunk1", "  chunk2\n", "  chunk3\n"],
+            id="single chunk batches after the first are passed through",
+        ),
     ),
 )
 def test_batch_chunks_by_token_limit_basic_cases(
@@ -114,3 +139,155 @@ def test_batch_chunks_by_token_limit_max_tokens_must_be_positive(
     joiner = "|"
     with pytest.raises(ValueError, match="max_tokens_per_batch must be positive"):
         list(batch_chunks_by_token_limit(chunks, max_tokens, joiner=joiner))
+
+
+def _batch_chunks_by_re_joining(
+    chunks: list[str], max_tokens_per_batch: TokenCount
+) -> Iterator[str]:
+    """Batch chunks like `batch_chunks_by_token_limit` did before batches were joined once."""
+    joiner = DEFAULT_BATCH_JOINER
+    joiner_token_count = DEFAULT_TOKEN_ESTIMATOR.estimate(joiner)
+    current_batch = ""
+    current_batch_token_count = 0
+    for chunk in chunks:
+        chunk_token_count = DEFAULT_TOKEN_ESTIMATOR.estimate(chunk)
+        additional_token_count = joiner_token_count if current_batch else 0
+        if current_batch and (
+            current_batch_token_count + additional_token_count + chunk_token_count
+            > max_tokens_per_batch
+        ):
+            yield current_batch
+            current_batch = chunk
+            current_batch_token_count = chunk_token_count
+        else:
+            current_batch = promptify(current_batch, chunk, joiner=joiner)
+            current_batch_token_count += additional_token_count + chunk_token_count
+    if current_batch:
+        yield current_batch
+
+
+@pytest.mark.parametrize("max_tokens", (1, 5, 10, 20, 1_000))
+def test_batch_chunks_by_token_limit_matches_re_joining_batches(
+    max_tokens: int,
+) -> None:
+    chunks = [
+        "commit 1\n\n    Fix the parser\n",
+        "  indented chunk\n    with a deeper line\n",
+        "a much longer chunk " * 5,
+        "\n\n    surrounded by blank lines\n\n",
+        "short",
+        "  trailing spaces  ",
+    ]
+
+    assert list(batch_chunks_by_token_limit(chunks, max_tokens)) == list(
+        _batch_chunks_by_re_joining(chunks, max_tokens)
+    )
+
+
+def _chunk(token_count: int) -> str:
+    # Chunks of 3 characters per token, matching the overestimated token count
+    return "x" * (3 * token_count)
+
+
+@pytest.mark.parametrize(
+    ("token_counts", "max_tokens", "expected_batches"),
+    (
+        pytest.param([], 10, [], id="empty chunks"),
+        pytest.param(
+            [6, 6, 3, 3],
+            10,
+            [[6, 3], [6, 3]],
+            id="small chunks fill the gaps left by large ones",
+        ),
+        pytest.param(
+            [1, 9, 1, 9],
+            10,
+            [[1, 9], [1, 9]],
+            id="chunks keep their order within batches",
+        ),
+        pytest.param(
+            [20, 2, 2],
+            10,
+            [[20], [2, 2]],
+            id="oversized chunks get their own batch",
+        ),
+    ),
+)
+def test_pack_chunks_first_fit_decreasing(
+    token_counts: list[int],
+    max_tokens: int,
+    expected_batches: list[list[int]],
+) -> None:
+    chunks = [_chunk(token_count) for token_count in token_counts]
+
+    result = list(pack_chunks_first_fit_decreasing(chunks, max_tokens, joiner=""))
+
+    assert result == [
+        "".join(_chunk(token_count) for token_count in batch)
+        for batch in expected_batches
+    ]
+
+
+def test_pack_chunks_first_fit_decreasing_uses_fewer_batches_than_greedy() -> None:
+    chunks = [_chunk(token_count) for token_count in (6, 6, 6, 3, 3, 3)]
+
+    greedy = list(batch_chunks_by_token_limit(chunks, 10, joiner=""))
+    packed = list(pack_chunks_first_fit_decreasing(chunks, 10, joiner=""))
+
+    assert len(packed) < len(greedy)
+    assert batch_fill_ratio(packed, 10) > batch_fill_ratio(greedy, 10)
+
+
+@pytest.mark.parametrize(
+    ("token_counts", "window", "expected_batches"),
+    (
+        pytest.param([], 4, [], id="empty chunks"),
+        pytest.param(
+            [6, 6, 3, 3],
+            4,
+            [[6, 3], [6, 3]],
+            id="upcoming chunks fill the batch",
+        ),
+        pytest.param(
+            [6, 6, 6, 3],
+            2,
+            [[6], [6, 3], [6]],
+            id="chunks beyond the window are not considered",
+        ),
+        pytest.param(
+            [6, 6, 3, 3],
+            1,
+            [[6], [6, 3], [3]],
+            id="window of one is greedy",
+        ),
+    ),
+)
+def test_batch_chunks_with_lookahead(
+    token_counts: list[int],
+    window: int,
+    expected_batches: list[list[int]],
+) -> None:
+    chunks = [_chunk(token_count) for token_count in token_counts]
+
+    result = list(batch_chunks_with_lookahead(chunks, 10, joiner="", window=window))
+
+    assert result == [
+        "".join(_chunk(token_count) for token_count in batch)
+        for batch in expected_batches
+    ]
+
+
+@pytest.mark.parametrize("strategy", ("greedy", "lookahead", "first-fit-decreasing"))
+def test_batch_chunks_keeps_every_chunk(strategy: BatchingStrategy) -> None:
+    chunks = [f"chunk{i} " * (i % 7 + 1) for i in range(50)]
+
+    batches = list(batch_chunks(chunks, 40, joiner="|", strategy=strategy))
+
+    assert sorted(chunk for batch in batches for chunk in batch.split("|")) == sorted(
+        chunk.strip() for chunk in chunks
+    )
+
+
+def test_batch_fill_ratio() -> None:
+    assert batch_fill_ratio([], 10) == 0
+    assert batch_fill_ratio([_chunk(10), _chunk(5)], 10) == pytest.approx(0.75)
@@ -0,0 +1,106 @@
+"""Tests for the cache module."""
+
+import time
+from datetime import timedelta
+from pathlib import Path
+
+import pytest
+
+from brag.cache import ResponseCache, default_cache_dir
+
+
+@pytest.fixture
+def cache(tmp_path: Path) -> ResponseCache:
+    return ResponseCache.in_directory(tmp_path, max_size_bytes=None, max_age=None)
+
+
+def test_response_cache_roundtrip(cache: ResponseCache) -> None:
+    key = ResponseCache.key("model", "system", "user")
+
+    assert cache.get(key) is None
+    cache.set(key, "response")
+    assert cache.get(key) == "response"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_response_cache_persists_across_instances(tmp_path: Path) -> None:
+    key = ResponseCache.key("model", "system", "user")
+
+    with ResponseCache.in_directory(tmp_path) as cache:
+        cache.set(key, "response")
+
+    with ResponseCache.in_directory(tmp_path) as cache:
+        assert cache.get(key) == "response"
+
+
+@pytest.mark.parametrize(
+    "other_key",
+    (
+        pytest.param(ResponseCache.key("other", "system", "user"), id="model name"),
+        pytest.param(ResponseCache.key("model", "other", "user"), id="system prompt"),
+        pytest.param(ResponseCache.key("model", "system", "other"), id="user prompt"),
+        pytest.param(
+            ResponseCache.key("model", "system", "user", {"temperature": 1.0}),
+            id="model settings",
+        ),
+        pytest.param(
+            ResponseCache.key(
+                "model", "system", "user", {"temperature": 0.0}, {"type": "object"}
+            ),
+            id="output schema",
+        ),
+    ),
+)
+def test_response_cache_key_depends_on_every_input(other_key: str) -> None:
+    key = ResponseCache.key("model", "system", "user", {"temperature": 0.0})
+    assert key != other_key
+
+
+def test_response_cache_key_ignores_model_settings_order() -> None:
+    assert ResponseCache.key("m", "s", "u", {"a": 1, "b": 2}) == ResponseCache.key(
+        "m", "s", "u", {"b": 2, "a": 1}
+    )
+
+
+def test_response_cache_ignores_expired_entries(tmp_path: Path) -> None:
+    cache = ResponseCache.in_directory(tmp_path, max_age=timedelta(seconds=0.01))
+    key = ResponseCache.key("model", "system", "user")
+    cache.set(key, "response")
+
+    time.sleep(0.02)
+
+    assert cache.get(key) is None
+    assert cache.evict() == 1
+
+
+def test_response_cache_evicts_least_recently_used_entries(tmp_path: Path) -> None:
+    cache = ResponseCache.in_directory(tmp_path, max_size_bytes=20, max_age=None)
+    first, second, third = (ResponseCache.key("m", "s", str(i)) for i in range(3))
+
+    cache.set(first, "a" * 10)
+    time.sleep(0.001)
+    cache.set(second, "b" * 10)
+    time.sleep(0.001)
+    # Access the first entry so that the second one becomes the least recently used
+    assert cache.get(first) is not None
+    time.sleep(0.001)
+    cache.set(third, "c" * 10)
+
+    assert cache.get(first) == "a" * 10
+    assert cache.get(second) is None
+    assert cache.get(third) == "c" * 10
+
+
+def test_default_cache_dir_follows_xdg_cache_home(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    assert default_cache_dir() == tmp_path / "brag"
+
+
+def test_default_cache_dir_falls_back_to_home(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    monkeypatch.delenv("XDG_CACHE_HOME", raising=False)
+    monkeypatch.setenv("HOME", str(tmp_path))
+    assert default_cache_dir() == tmp_path / ".cache" / "brag"
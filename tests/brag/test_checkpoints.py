@@ -0,0 +1,72 @@
+"""Tests for the checkpoints module."""
+
+from functools import reduce
+from pathlib import Path
+
+from brag.checkpoints import (
+    INITIAL_CHUNKS_DIGEST,
+    CheckpointFile,
+    chain_chunks_digest,
+    fingerprint_run,
+)
+
+
+def test_checkpoint_file_roundtrip(tmp_path: Path) -> None:
+    checkpoint = CheckpointFile.in_directory(tmp_path, "fingerprint")
+    assert checkpoint.load() is None
+
+    checkpoint.save(completed_chunks=2, chunks_digest="digest", brag_document="doc")
+
+    saved = CheckpointFile.in_directory(tmp_path, "fingerprint").load()
+    assert saved is not None
+    assert (saved.completed_chunks, saved.chunks_digest, saved.brag_document) == (
+        2,
+        "digest",
+        "doc",
+    )
+
+
+def test_checkpoint_file_is_keyed_by_fingerprint(tmp_path: Path) -> None:
+    CheckpointFile.in_directory(tmp_path, "fingerprint").save(
+        completed_chunks=1, chunks_digest="digest", brag_document="doc"
+    )
+
+    assert CheckpointFile.in_directory(tmp_path, "other").load() is None
+
+
+def test_checkpoint_file_ignores_a_corrupt_checkpoint(tmp_path: Path) -> None:
+    checkpoint = CheckpointFile.in_directory(tmp_path, "fingerprint")
+    checkpoint.save(completed_chunks=1, chunks_digest="digest", brag_document="doc")
+    # A checkpoint truncated by a crash, and one written by another version
+    for content in (checkpoint.path.read_text()[:20], '{"fingerprint": 1}'):
+        checkpoint.path.write_text(content)
+
+        assert CheckpointFile.in_directory(tmp_path, "fingerprint").load() is None
+
+
+def test_checkpoint_file_clear(tmp_path: Path) -> None:
+    checkpoint = CheckpointFile.in_directory(tmp_path, "fingerprint")
+    checkpoint.save(completed_chunks=1, chunks_digest="digest", brag_document="doc")
+
+    checkpoint.clear()
+
+    assert checkpoint.latest is None
+    assert checkpoint.load() is None
+    # Clearing a missing checkpoint is a no-op
+    checkpoint.clear()
+
+
+def test_fingerprint_run_depends_on_inputs() -> None:
+    fingerprint = fingerprint_run(repo="owner/name", limit=None, path=Path("a"))
+
+    assert fingerprint == fingerprint_run(path=Path("a"), limit=None, repo="owner/name")
+    assert fingerprint != fingerprint_run(repo="owner/name", limit=10, path=Path("a"))
+
+
+def test_chain_chunks_digest_depends_on_order() -> None:
+    def digest(chunks: list[str]) -> str:
+        return reduce(chain_chunks_digest, chunks, INITIAL_CHUNKS_DIGEST)
+
+    assert digest(["a", "b"]) == digest(["a", "b"])
+    assert digest(["a", "b"]) != digest(["b", "a"])
+    assert digest(["ab"]) != digest(["a", "b"])
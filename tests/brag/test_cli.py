@@ -1,10 +1,21 @@
 """Tests for the CLI module."""
 
 from datetime import datetime
+from pathlib import Path
+from typing import Any
 
 import pytest
+from git import Actor, Repo
 
-from brag.cli import _maybe_parse_datetime
+from brag import cli
+from brag.checkpoints import CheckpointFile
+from brag.cli import (
+    _flush_partial_brag_document_on_interruption,
+    _maybe_parse_datetime,
+    _open_output,
+    app,
+)
+from brag.state import load_state, state_path_for
 
 
 @pytest.mark.parametrize(
@@ -98,3 +109,150 @@ def test_maybe_parse_datetime_iso_formats(
     """Test that ISO date formats are parsed correctly."""
     result = _maybe_parse_datetime(natural_language_date_str)
     assert result == expected_parsed_date
+
+
+def test_open_output_replaces_the_output_file_once_complete(tmp_path: Path) -> None:
+    output = tmp_path / "brag.md"
+    output.write_text("previous")
+
+    with _open_output(output) as write:
+        write("# Brag")
+        write(" document\n")
+        # The previous document is kept until the new one is complete
+        assert output.read_text() == "previous"
+
+    assert output.read_text() == "# Brag document\n"
+    assert list(tmp_path.iterdir()) == [output]
+
+
+def test_open_output_keeps_the_output_file_on_failure(tmp_path: Path) -> None:
+    output = tmp_path / "brag.md"
+    output.write_text("previous")
+
+    with pytest.raises(KeyboardInterrupt), _open_output(output) as write:
+        write("# Brag")
+        raise KeyboardInterrupt
+
+    assert output.read_text() == "previous"
+    assert list(tmp_path.iterdir()) == [output]
+
+
+def test_open_output_prints_complete_lines(capsys: pytest.CaptureFixture[str]) -> None:
+    with _open_output(None) as write:
+        write("# Brag")
+        assert capsys.readouterr().out == ""
+        write(" document\n- Sh")
+        assert capsys.readouterr().out == "# Brag document\n"
+        write("ipped")
+
+    assert capsys.readouterr().out == "- Shipped\n"
+
+
+def test_open_output_prints_a_complete_brag_document_as_is(
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    with _open_output(None) as write:
+        write("# Brag document\n")
+
+    assert capsys.readouterr().out == "# Brag document\n"
+
+
+def test_flush_partial_brag_document_next_to_the_output_on_interruption(
+    tmp_path: Path,
+) -> None:
+    output = tmp_path / "brag.md"
+    output.write_text("previous")
+    checkpoint = CheckpointFile(tmp_path / "checkpoint.json", "fingerprint")
+
+    with (
+        pytest.raises(KeyboardInterrupt),
+        _flush_partial_brag_document_on_interruption(checkpoint, output),
+        _open_output(output) as write,
+    ):
+        checkpoint.save(completed_chunks=1, chunks_digest="", brag_document="partial")
+        write("# Brag")
+        raise KeyboardInterrupt
+
+    partial_output = tmp_path / "brag.md.partial"
+    assert output.read_text() == "previous"
+    assert partial_output.read_text() == "partial"
+
+    # The partial brag document is removed once a later run completes
+    with _flush_partial_brag_document_on_interruption(checkpoint, output):
+        pass
+
+    assert not partial_output.exists()
+
+
+def test_interrupted_incremental_run_keeps_the_output_and_its_state(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    author = Actor("octocat", "octocat@example.com")
+    repo = Repo.init(tmp_path / "repo")
+    output = tmp_path / "brag.md"
+
+    def run() -> object:
+        with pytest.raises(SystemExit) as exit_info:
+            app(
+                [
+                    "from-local",
+                    repo.working_dir,
+                    "--user",
+                    "octocat",
+                    "--model",
+                    "test",
+                    "--context-window-size",
+                    "1000",
+                    "--incremental",
+                    "--output",
+                    str(output),
+                    "--cache-dir",
+                    str(tmp_path / "cache"),
+                ]
+            )
+        return exit_info.value.code
+
+    repo.index.commit("first", author=author, committer=author)
+    assert run() == 0
+    brag_document = output.read_text()
+    state = load_state(state_path_for(output))
+
+    async def interrupted_generation(*args: Any, **kwargs: Any) -> str:
+        kwargs["checkpoint"].save(
+            completed_chunks=1, chunks_digest="", brag_document="partial"
+        )
+        raise KeyboardInterrupt
+
+    second = repo.index.commit("second", author=author, committer=author)
+    with monkeypatch.context() as patch:
+        patch.setattr(cli, "generate_brag_document", interrupted_generation)
+        # Interrupted runs exit like SIGINT does
+        assert run() == 130  # noqa: PLR2004
+
+    # The output is not replaced by a partial brag document the next run would build on
+    assert output.read_text() == brag_document
+    assert load_state(state_path_for(output)) == state
+    assert output.with_name("brag.md.partial").read_text() == "partial"
+
+    assert run() == 0
+
+    (source_state,) = load_state(state_path_for(output)).sources.values()
+    assert source_state.last_commit_sha == second.hexsha
+    assert not output.with_name("brag.md.partial").exists()
+
+
+def test_incremental_runs_cannot_be_limited(tmp_path: Path) -> None:
+    with pytest.raises(ValueError, match="cannot be combined with `--limit`"):
+        app(
+            [
+                "from-local",
+                str(tmp_path),
+                "--user",
+                "octocat",
+                "--incremental",
+                "--limit",
+                "10",
+                "--output",
+                str(tmp_path / "brag.md"),
+            ]
+        )
@@ -0,0 +1,69 @@
+"""Tests for the concurrency module."""
+
+import threading
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from brag.concurrency import map_ordered
+
+
+def test_map_ordered_yields_results_in_input_order() -> None:
+    # Later items finish first
+    finished = [threading.Event() for _ in range(5)]
+
+    def process(index: int) -> int:
+        if index + 1 < len(finished):
+            finished[index + 1].wait(timeout=5)
+        finished[index].set()
+        return index * 10
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        results = list(map_ordered(executor, process, range(5), max_pending=5))
+
+    assert results == [0, 10, 20, 30, 40]
+
+
+def test_map_ordered_bounds_pending_items() -> None:
+    submitted: list[int] = []
+    max_pending = 3
+
+    def items() -> Iterator[int]:
+        for item in range(20):
+            submitted.append(item)
+            yield item
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for result in map_ordered(
+            executor, lambda item: item, items(), max_pending=max_pending
+        ):
+            # Only the items up to the next few ones have been submitted
+            assert len(submitted) <= result + 1 + max_pending
+
+
+def test_map_ordered_cancels_pending_items_when_stopped_early() -> None:
+    started: list[int] = []
+    release = threading.Event()
+
+    def process(item: int) -> int:
+        started.append(item)
+        release.wait(timeout=5)
+        return item
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        results = map_ordered(executor, process, range(10), max_pending=5)
+        release.set()
+        assert next(results) == 0
+        results.close()
+
+    assert len(started) < 10  # noqa: PLR2004
+
+
+@pytest.mark.parametrize("max_pending", (0, -1))
+def test_map_ordered_max_pending_must_be_positive(max_pending: int) -> None:
+    with (
+        ThreadPoolExecutor() as executor,
+        pytest.raises(ValueError, match="max_pending must be positive"),
+    ):
+        map_ordered(executor, str, [1], max_pending=max_pending)
@@ -0,0 +1,94 @@
+"""Tests for the dedup module."""
+
+import pytest
+
+from brag.dedup import PatchId, deduplicate_commits, diff_patch_id
+
+CHANGE = ("app.py", "@@ -1,2 +1,2 @@\n a\n-b\n+B")
+
+
+def test_diff_patch_id_ignores_line_numbers_whitespace_and_file_order() -> None:
+    other_file = ("lib.py", "@@ -3 +3 @@\n-x\n+y")
+    moved_change = ("app.py", "@@ -10,2 +11,2 @@\n a\n-  b\n+B  ")
+
+    assert diff_patch_id([CHANGE, other_file]) == diff_patch_id(
+        [other_file, moved_change]
+    )
+
+
+def test_diff_patch_id_of_a_revert_is_the_reverse_patch_id() -> None:
+    revert = ("app.py", "@@ -1,2 +1,2 @@\n a\n-B\n+b")
+
+    change_patch_id = diff_patch_id([CHANGE])
+    revert_patch_id = diff_patch_id([revert])
+
+    assert change_patch_id is not None and revert_patch_id is not None
+    assert revert_patch_id.forward == change_patch_id.reverse
+    assert revert_patch_id.reverse == change_patch_id.forward
+
+
+@pytest.mark.parametrize(
+    "file_diffs",
+    (
+        pytest.param([], id="no files"),
+        pytest.param([("uv.lock", "")], id="omitted diff"),
+        pytest.param([("app.py", "@@ -1 +1 @@\n a")], id="context only"),
+    ),
+)
+def test_diff_patch_id_without_changed_lines(
+    file_diffs: list[tuple[str, str]],
+) -> None:
+    assert diff_patch_id(file_diffs) is None
+
+
+# Commits named after their changes: "A" reverts "a", and "x" has no patch id
+def _patch_id(commit: str) -> PatchId | None:
+    name = commit.rstrip("'")
+    if name == "x":
+        return None
+    return PatchId(forward=name, reverse=name.swapcase())
+
+
+@pytest.mark.parametrize(
+    ("commits", "expected"),
+    (
+        pytest.param(["a", "b", "a'", "c"], ["a", "b", "c"], id="duplicate"),
+        pytest.param(["a", "b", "A", "c"], ["b", "c"], id="revert"),
+        pytest.param(["A", "b", "a"], ["b"], id="revert first"),
+        pytest.param(["a", "A", "a'"], ["a'"], id="re-applied after revert"),
+        pytest.param(["x", "x", "a"], ["x", "x", "a"], id="without patch ids"),
+    ),
+)
+def test_deduplicate_commits(commits: list[str], expected: list[str]) -> None:
+    assert list(deduplicate_commits(commits, patch_id=_patch_id)) == expected
+
+
+def test_deduplicate_commits_keeps_reverts_outside_the_window() -> None:
+    commits = ["a", "b", "c", "A"]
+
+    assert list(deduplicate_commits(commits, patch_id=_patch_id, window=2)) == commits
+    assert list(deduplicate_commits(commits, patch_id=_patch_id, window=3)) == [
+        "b",
+        "c",
+    ]
+
+
+def test_deduplicate_commits_yields_commits_a_window_late() -> None:
+    consumed: list[str] = []
+
+    def commits() -> list[str]:
+        return ["a", "b", "c", "d"]
+
+    def recording_patch_id(commit: str) -> PatchId | None:
+        consumed.append(commit)
+        return _patch_id(commit)
+
+    deduplicated = deduplicate_commits(commits(), patch_id=recording_patch_id, window=2)
+
+    assert next(deduplicated) == "a"
+    assert consumed == ["a", "b", "c"]
+
+
+def test_deduplicate_commits_window_must_be_positive() -> None:
+    with pytest.raises(ValueError, match="window must be positive"):
+        deduplicate_commits([], patch_id=_patch_id, window=0)
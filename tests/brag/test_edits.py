@@ -0,0 +1,153 @@
+"""Tests for the edits module."""
+
+import pytest
+from pydantic import ValidationError
+
+from brag.edits import (
+    AppendSection,
+    BragDocumentEdit,
+    BragDocumentEdits,
+    EditError,
+    InsertBullet,
+    ReplaceLine,
+    apply_edits,
+)
+
+BRAG_DOCUMENT = """\
+# Brag Document
+
+## Features
+
+- Added search
+- Added filters
+
+### Details
+
+- Indexed documents
+
+## Fixes
+
+Fixed several bugs.
+"""
+
+
+@pytest.mark.parametrize(
+    ("edit", "expected"),
+    (
+        pytest.param(
+            InsertBullet(section="Features", text="Added export"),
+            "- Added filters\n- Added export\n\n### Details",
+            id="after the bullets of a section",
+        ),
+        pytest.param(
+            InsertBullet(section="## features ", text="- Added export"),
+            "- Added filters\n- Added export\n\n### Details",
+            id="loosely matched section and bullet marker",
+        ),
+        pytest.param(
+            InsertBullet(section="Fixes", text="Fixed login"),
+            "Fixed several bugs.\n\n- Fixed login\n",
+            id="after a paragraph",
+        ),
+        pytest.param(
+            ReplaceLine(old="- Added search", new="- Added full-text search"),
+            "## Features\n\n- Added full-text search\n",
+            id="replace a line",
+        ),
+        pytest.param(
+            ReplaceLine(old="Added filters", new=""),
+            "- Added search\n\n### Details",
+            id="remove a line",
+        ),
+        pytest.param(
+            AppendSection(heading="Mentoring", body="- Onboarded two engineers"),
+            "Fixed several bugs.\n\n## Mentoring\n\n- Onboarded two engineers\n",
+            id="append a section",
+        ),
+    ),
+)
+def test_apply_edits(edit: BragDocumentEdit, expected: str) -> None:
+    assert expected in apply_edits(BRAG_DOCUMENT, [edit])
+
+
+def test_apply_edits_inserts_bullet_in_empty_section() -> None:
+    brag_document = "# Brag Document\n\n## Features\n\n## Fixes\n"
+
+    result = apply_edits(
+        brag_document, [InsertBullet(section="Features", text="Added search")]
+    )
+
+    assert result == "# Brag Document\n\n## Features\n\n- Added search\n\n## Fixes\n"
+
+
+def test_apply_edits_applies_edits_in_order() -> None:
+    result = apply_edits(
+        BRAG_DOCUMENT,
+        [
+            AppendSection(heading="Mentoring", body=""),
+            InsertBullet(section="Mentoring", text="Onboarded two engineers"),
+        ],
+    )
+
+    assert result.endswith("## Mentoring\n\n- Onboarded two engineers\n")
+
+
+def test_apply_edits_ignores_headings_in_code_blocks() -> None:
+    brag_document = "## Features\n\n```python\n# Features\n```\n"
+
+    result = apply_edits(
+        brag_document, [InsertBullet(section="Features", text="Added search")]
+    )
+
+    assert result == "## Features\n\n```python\n# Features\n```\n\n- Added search\n"
+
+
+@pytest.mark.parametrize(
+    ("edit", "message"),
+    (
+        pytest.param(
+            InsertBullet(section="Unknown", text="x"),
+            "Section not found",
+            id="unknown section",
+        ),
+        pytest.param(
+            ReplaceLine(old="- Unknown", new="x"),
+            "Line not found",
+            id="unknown line",
+        ),
+        pytest.param(
+            ReplaceLine(old="", new="x"),
+            "blank line",
+            id="blank line",
+        ),
+        pytest.param(
+            AppendSection(heading="Fixes", body="x"),
+            "Section already exists",
+            id="existing section",
+        ),
+    ),
+)
+def test_apply_edits_rejects_edits_that_do_not_apply(
+    edit: BragDocumentEdit, message: str
+) -> None:
+    with pytest.raises(EditError, match=message):
+        apply_edits(BRAG_DOCUMENT, [edit])
+
+
+def test_apply_edits_rejects_ambiguous_lines() -> None:
+    brag_document = "## A\n\n- Same\n\n## B\n\n- Same\n"
+
+    with pytest.raises(EditError, match="found 2 times"):
+        apply_edits(brag_document, [ReplaceLine(old="- Same", new="- Other")])
+
+
+def test_brag_document_edits_validates_json() -> None:
+    edits = BragDocumentEdits.model_validate_json(
+        '{"edits": [{"kind": "insert_bullet", "section": "Features", "text": "x"}]}'
+    )
+
+    assert edits.edits == [InsertBullet(section="Features", text="x")]
+    with pytest.raises(ValidationError):
+        BragDocumentEdits.model_validate_json(
+            '{"edits": [{"kind": "replace_line", "old": "a\\nb", "new": "c"}]}'
+        )
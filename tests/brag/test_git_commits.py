@@ -0,0 +1,280 @@
+"""Tests for the Git commits source."""
+
+import asyncio
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Any
+
+import pytest
+from git import Actor, Repo
+
+from brag.sources import CommitRef, git_commits
+from brag.sources.git_commits import GitCommitsSource, split_git_commit_by_file
+from brag.sources.path_filters import PathFilter
+
+AUTHOR = Actor("octocat", "octocat@example.com")
+
+
+@pytest.fixture
+def repo(tmp_path: Path) -> Repo:
+    repo = Repo.init(tmp_path)
+    for message in ("first", "second", "third"):
+        repo.index.commit(message, author=AUTHOR, committer=AUTHOR)
+    return repo
+
+
+async def _collect(source: GitCommitsSource) -> list[str]:
+    return [commit async for commit in source]
+
+
+def test_git_commits_source_yields_commits_newest_first(repo: Repo) -> None:
+    source = GitCommitsSource(path=Path(repo.working_dir), author=AUTHOR.name or "")
+
+    assert len(source) == len(list(repo.iter_commits()))
+    latest_commit = source.latest_commit()
+    assert latest_commit is not None
+    assert latest_commit.sha == repo.head.commit.hexsha
+
+
+def test_git_commits_source_skips_processed_commits(repo: Repo) -> None:
+    processed, *_ = reversed(list(repo.iter_commits()))
+    source = GitCommitsSource(
+        path=Path(repo.working_dir),
+        author=AUTHOR.name or "",
+        after_commit=CommitRef(
+            sha=processed.hexsha, committed_at=processed.committed_datetime
+        ),
+    )
+
+    assert [commit.splitlines()[0] for commit in source] == [
+        f"commit {commit.hexsha}"
+        for commit in repo.iter_commits()
+        if commit != processed
+    ]
+
+
+def test_git_commits_source_is_empty_if_up_to_date(repo: Repo) -> None:
+    head = repo.head.commit
+    source = GitCommitsSource(
+        path=Path(repo.working_dir),
+        author=AUTHOR.name or "",
+        after_commit=CommitRef(sha=head.hexsha, committed_at=head.committed_datetime),
+    )
+
+    assert len(source) == 0
+    assert source.latest_commit() is None
+
+
+@pytest.mark.parametrize("after_sha", (None, "head", "unknown"))
+def test_git_commits_source_estimates_its_length_without_listing_commits(
+    repo: Repo, after_sha: str | None
+) -> None:
+    head = repo.head.commit
+    after_commit = (
+        CommitRef(
+            sha=head.hexsha if after_sha == "head" else "deadbeef",
+            committed_at=head.committed_datetime,
+        )
+        if after_sha
+        else None
+    )
+
+    def source() -> GitCommitsSource:
+        return GitCommitsSource(
+            path=Path(repo.working_dir),
+            author=AUTHOR.name or "",
+            after_commit=after_commit,
+        )
+
+    listed = source()
+    estimated = source()
+
+    assert estimated.length_hint() == len(listed)
+    assert estimated.latest_commit() == listed.latest_commit()
+    if after_sha != "unknown":
+        assert "_commit_shas" not in estimated.__dict__
+
+
+@pytest.mark.parametrize("read_size", (1, 7, 1 << 16))
+def test_git_commits_source_streams_the_output_of_git_show(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, read_size: int
+) -> None:
+    monkeypatch.setattr(git_commits, "_STREAM_READ_SIZE", read_size)
+    repo = Repo.init(tmp_path)
+    (tmp_path / "shared.txt").write_text("base\n")
+    repo.index.add(["shared.txt"])
+    base = repo.index.commit("Add base", author=AUTHOR, committer=AUTHOR)
+    (tmp_path / "feature.txt").write_text("feature\n")
+    repo.index.add(["feature.txt"])
+    feature = repo.index.commit("Add feature", author=AUTHOR, committer=AUTHOR)
+    # A merge commit without a combined diff, then a commit without any diff
+    repo.index.commit(
+        "Merge feature",
+        parent_commits=(feature, base),
+        author=AUTHOR,
+        committer=AUTHOR,
+    )
+    repo.index.commit("Empty", author=AUTHOR, committer=AUTHOR)
+    (tmp_path / "shared.txt").write_text("base\n\xe9t\xe9\n")
+    repo.index.add(["shared.txt"])
+    repo.index.commit("Update base", author=AUTHOR, committer=AUTHOR)
+    source = GitCommitsSource(
+        path=Path(repo.working_dir),
+        author=AUTHOR.name or "",
+        path_filter=PathFilter(exclude=()),
+    )
+
+    expected = [repo.git.show(commit) for commit in repo.iter_commits()]
+    assert list(source) == expected
+    assert asyncio.run(_collect(source)) == expected
+
+
+def test_git_commits_source_extracts_commits_in_parallel(
+    repo: Repo, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    path = Path(repo.working_dir)
+    for index in range(6):
+        (path / f"module{index}.py").write_text(f"print({index})\n")
+        repo.index.add([f"module{index}.py"])
+        repo.index.commit(f"Add module {index}", author=AUTHOR, committer=AUTHOR)
+    expected = list(GitCommitsSource(path=path, author=AUTHOR.name or ""))
+    monkeypatch.setattr(git_commits, "_SHARD_SIZE", 2)
+
+    with GitCommitsSource(path=path, author=AUTHOR.name or "", jobs=2) as source:
+        assert list(source) == expected
+
+
+def test_git_commits_source_reuses_one_repository(
+    repo: Repo, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    opened_repos: list[Repo] = []
+
+    def open_repo(*args: Any, **kwargs: Any) -> Repo:
+        opened_repos.append(Repo(*args, **kwargs))
+        return opened_repos[-1]
+
+    monkeypatch.setattr(git_commits, "Repo", open_repo)
+
+    with GitCommitsSource(
+        path=Path(repo.working_dir), author=AUTHOR.name or ""
+    ) as source:
+        assert len(list(source)) == len(source)
+        assert source.latest_commit() is not None
+
+    (opened_repo,) = opened_repos
+    # Closing the repository stops its persistent `git cat-file` processes
+    assert opened_repo.git.cat_file_all is None
+    assert opened_repo.git.cat_file_header is None
+
+
+def test_split_git_commit_by_file(tmp_path: Path) -> None:
+    repo = Repo.init(tmp_path)
+    for name in ("first.py", "second.py"):
+        (tmp_path / name).write_text(f"print({name!r})\n")
+    repo.index.add(["first.py", "second.py"])
+    repo.index.commit("Add modules", author=AUTHOR, committer=AUTHOR)
+    commit = repo.git.show("HEAD")
+
+    split = split_git_commit_by_file(commit)
+
+    assert split is not None
+    assert split.header.endswith("    Add modules")
+    assert [section.splitlines()[0] for section in split.sections] == [
+        "diff --git a/first.py b/first.py",
+        "diff --git a/second.py b/second.py",
+    ]
+
+
+def test_git_commits_source_omits_excluded_file_diffs(tmp_path: Path) -> None:
+    repo = Repo.init(tmp_path)
+    (tmp_path / ".gitattributes").write_text("*.pb.go linguist-generated\n")
+    (tmp_path / "app.py").write_text("print('app')\n")
+    (tmp_path / "uv.lock").write_text("one\ntwo\n")
+    (tmp_path / "service.pb.go").write_text("package api\n")
+    repo.index.add([".gitattributes", "app.py", "uv.lock", "service.pb.go"])
+    repo.index.commit("Add app", author=AUTHOR, committer=AUTHOR)
+    source = GitCommitsSource(path=Path(repo.working_dir), author=AUTHOR.name or "")
+
+    (commit,) = source
+
+    assert "+print('app')" in commit
+    assert "ADDED uv.lock (+2 -0, diff omitted)" in commit
+    assert "ADDED service.pb.go (+1 -0, diff omitted)" in commit
+    assert "+one" not in commit
+    assert "+package api" not in commit
+
+
+@pytest.mark.parametrize("jobs", (1, 2))
+def test_git_commits_source_yields_the_same_commits_asynchronously(
+    repo: Repo, monkeypatch: pytest.MonkeyPatch, jobs: int
+) -> None:
+    path = Path(repo.working_dir)
+    for index in range(5):
+        (path / f"module{index}.py").write_text(f"print({index})\n")
+        repo.index.add([f"module{index}.py"])
+        repo.index.commit(f"Add module {index}", author=AUTHOR, committer=AUTHOR)
+    monkeypatch.setattr(git_commits, "_SHARD_SIZE", 2)
+
+    with GitCommitsSource(path=path, author=AUTHOR.name or "", jobs=jobs) as source:
+        assert asyncio.run(_collect(source)) == list(source)
+
+
+def test_git_commits_source_computes_patch_ids_of_cherry_picks_and_reverts(
+    tmp_path: Path,
+) -> None:
+    repo = Repo.init(tmp_path)
+    module = tmp_path / "app.py"
+
+    def commit(content: str, message: str) -> None:
+        module.write_text(content)
+        repo.index.add(["app.py"])
+        repo.index.commit(message, author=AUTHOR, committer=AUTHOR)
+
+    lines = [f"line {number}" for number in range(10)]
+    commit("\n".join(lines), "Add app")
+    commit("\n".join([*lines[:5], "changed", *lines[6:]]), "Change app")
+    commit("\n".join(["first", *lines[:5], "changed", *lines[6:]]), "Prepend to app")
+    commit("\n".join(["first", *lines]), "Revert the change")
+    # The same change as "Change app", at another line number
+    commit("\n".join(["first", *lines[:5], "changed", *lines[6:]]), "Change app again")
+    source = GitCommitsSource(path=Path(repo.working_dir), author=AUTHOR.name or "")
+
+    again, revert, prepend, change, add = (source.patch_id(c) for c in source)
+
+    assert change is not None and revert is not None and again is not None
+    assert again.forward == change.forward
+    assert revert.forward == change.reverse
+    assert revert.reverse == change.forward
+    assert prepend is not None and add is not None
+    assert len({add.forward, prepend.forward, change.forward}) == 3  # noqa: PLR2004
+
+
+def test_git_commits_source_computes_patch_ids_a_shard_at_a_time(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    repo = Repo.init(tmp_path)
+    for number in range(5):
+        (tmp_path / f"module{number}.py").write_text(f"{number}\n")
+        repo.index.add([f"module{number}.py"])
+        repo.index.commit(f"Add module {number}", author=AUTHOR, committer=AUTHOR)
+    shards: list[int] = []
+
+    def compute_patch_ids(
+        repo: Repo, commit_shas: Sequence[str], *, reverse: bool = False
+    ) -> dict[str, str]:
+        if not reverse:
+            shards.append(len(commit_shas))
+        return compute_all_patch_ids(repo, commit_shas, reverse=reverse)
+
+    compute_all_patch_ids = git_commits._compute_patch_ids
+    monkeypatch.setattr(git_commits, "_compute_patch_ids", compute_patch_ids)
+    monkeypatch.setattr(git_commits, "_PATCH_ID_SHARD_SIZE", 2)
+    source = GitCommitsSource(path=Path(repo.working_dir), author=AUTHOR.name or "")
+    commits = iter(source)
+
+    assert source.patch_id(next(commits)) is not None
+    # Only the patch ids of the first shard are computed
+    assert shards == [2]
+
+    assert all(source.patch_id(commit) is not None for commit in commits)
+    assert shards == [2, 2, 1]
@@ -0,0 +1,254 @@
+"""Tests for the Github client with a rate limiter and a persistent response cache."""
+
+from collections.abc import Iterator
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+
+import pytest
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+
+from brag.cache import ResponseCache
+from brag.github_client import (
+    GithubCacheStats,
+    GithubQuota,
+    GithubRateLimiter,
+    open_github_client,
+)
+from brag.repository import RepoReference
+from brag.sources.github_commits import GithubCommitsSource
+from tests.brag.github_stub import (
+    AUTHOR,
+    NAME,
+    OWNER,
+    GithubStub,
+    StubCommit,
+    StubFile,
+    serve_github_stub,
+)
+
+
+@pytest.fixture
+def github_stub() -> Iterator[GithubStub]:
+    commits = [
+        StubCommit(
+            sha=f"{index:040x}",
+            message=f"Commit {index}",
+            committed_at=datetime(2025, 1, 1, tzinfo=UTC) - timedelta(hours=index),
+            files=(StubFile(f"module{index}.py", patch=f"@@ -0,0 +1 @@\n+{index}"),),
+        )
+        for index in range(1, 41)
+    ]
+    with serve_github_stub(GithubStub(commits=commits)) as stub:
+        yield stub
+
+
+def _load_commits(
+    stub: GithubStub, cache_path: Path, stats: GithubCacheStats
+) -> list[str]:
+    with (
+        ResponseCache(cache_path) as cache,
+        open_github_client(
+            auth=None,
+            cache=cache,
+            stats=stats,
+            base_url=stub.base_url,
+            seconds_between_requests=None,
+            seconds_between_writes=None,
+            retry=None,
+        ) as github,
+    ):
+        source = GithubCommitsSource(
+            github=github, repo=RepoReference(owner=OWNER, name=NAME), author=AUTHOR
+        )
+        return list(source)
+
+
+def test_github_client_serves_commits_from_the_cache(
+    github_stub: GithubStub, tmp_path: Path
+) -> None:
+    cache_path = tmp_path / "github.sqlite3"
+    first_stats, second_stats = GithubCacheStats(), GithubCacheStats()
+
+    first_run = _load_commits(github_stub, cache_path, first_stats)
+    first_requests = len(github_stub.requests)
+    second_run = _load_commits(github_stub, cache_path, second_stats)
+
+    assert second_run == first_run
+    assert first_stats == GithubCacheStats(fetched=first_requests)
+    # Commits are served from disk, and the other responses are revalidated
+    second_paths = github_stub.requested_paths()[first_requests:]
+    assert not any("/commits/" in path for path in second_paths)
+    assert second_stats.served == len(github_stub.commits)
+    assert second_stats.not_modified + second_stats.fetched == len(second_paths)
+    # Only the missing `.gitattributes` file cannot be revalidated
+    assert second_stats.fetched == 1
+
+
+def test_github_client_refetches_modified_responses(
+    github_stub: GithubStub, tmp_path: Path
+) -> None:
+    cache_path = tmp_path / "github.sqlite3"
+    _load_commits(github_stub, cache_path, GithubCacheStats())
+    github_stub.commits = [
+        StubCommit(
+            sha="f" * 40,
+            message="New commit",
+            committed_at=datetime(2025, 1, 2, tzinfo=UTC),
+        ),
+        *github_stub.commits,
+    ]
+
+    requests_before = len(github_stub.requests)
+    stats = GithubCacheStats()
+    commits = _load_commits(github_stub, cache_path, stats)
+
+    assert "New commit" in commits
+    # Only the new commit is fetched, the others are served from disk
+    assert stats.served == len(github_stub.commits) - 1
+    assert [
+        path
+        for path in github_stub.requested_paths()[requests_before:]
+        if "/commits/" in path
+    ] == [f"/repos/{OWNER}/{NAME}/commits/{'f' * 40}"]
+
+
+def test_github_client_without_cache_sends_every_request(
+    github_stub: GithubStub,
+) -> None:
+    with open_github_client(
+        auth=None, base_url=github_stub.base_url, retry=None
+    ) as github:
+        github.get_repo(f"{OWNER}/{NAME}")
+        github.get_repo(f"{OWNER}/{NAME}")
+
+    assert github_stub.requested_paths() == [f"/repos/{OWNER}/{NAME}"] * 2
+
+
+class _FakeClock:
+    """A clock that only moves when sleeping."""
+
+    def __init__(self) -> None:
+        self.now = 1_000_000.0
+        self.sleeps: list[float] = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock() -> _FakeClock:
+    return _FakeClock()
+
+
+@pytest.fixture
+def rate_limiter(clock: _FakeClock) -> GithubRateLimiter:
+    return GithubRateLimiter(clock=clock, sleep=clock.sleep)
+
+
+def _response(
+    clock: _FakeClock,
+    *,
+    remaining: int,
+    status: int = 200,
+    reset_in: float = 1000,
+    headers: dict[str, str] | None = None,
+) -> Response:
+    response = Response()
+    response.status_code = status
+    response.headers = CaseInsensitiveDict(
+        {
+            "X-RateLimit-Limit": "5000",
+            "X-RateLimit-Remaining": str(remaining),
+            "X-RateLimit-Reset": str(int(clock.now + reset_in)),
+            "X-RateLimit-Resource": "core",
+            **(headers or {}),
+        }
+    )
+    response._content = b"{}"
+    return response
+
+
+def test_rate_limiter_sends_requests_freely_while_the_quota_is_plentiful(
+    clock: _FakeClock, rate_limiter: GithubRateLimiter
+) -> None:
+    rate_limiter.record(_response(clock, remaining=4000))
+
+    for _ in range(100):
+        rate_limiter.acquire("core")
+
+    assert clock.sleeps == []
+    assert rate_limiter.quota() == GithubQuota(
+        resource="core", limit=5000, remaining=3900, reset_at=clock.now + 1000
+    )
+
+
+def test_rate_limiter_spreads_requests_once_the_quota_runs_low(
+    clock: _FakeClock, rate_limiter: GithubRateLimiter
+) -> None:
+    rate_limiter.record(_response(clock, remaining=100))
+
+    for _ in range(3):
+        rate_limiter.acquire("core")
+
+    # The remaining requests are spread over the time until the reset
+    assert clock.sleeps == [pytest.approx(1000 / 99)] * 2
+
+
+def test_rate_limiter_waits_for_the_reset_once_the_quota_is_exhausted(
+    clock: _FakeClock, rate_limiter: GithubRateLimiter
+) -> None:
+    start = clock.now
+    rate_limiter.record(_response(clock, remaining=0))
+
+    assert "waiting 1001s" in rate_limiter.describe()
+    rate_limiter.acquire("core")
+    # Other resources have their own quota
+    rate_limiter.acquire("graphql")
+
+    assert clock.now == start + 1001
+    assert rate_limiter.describe() == "GitHub core quota: 0/5000"
+
+
+def test_rate_limiter_asks_to_retry_requests_rejected_by_a_rate_limit(
+    clock: _FakeClock, rate_limiter: GithubRateLimiter
+) -> None:
+    start = clock.now
+
+    assert rate_limiter.record(_response(clock, remaining=10)) is None
+    assert (
+        rate_limiter.record(
+            _response(clock, remaining=10, status=403, headers={"Retry-After": "30"})
+        )
+        == 30  # noqa: PLR2004
+    )
+    assert rate_limiter.record(_response(clock, remaining=0, status=403)) == 1001  # noqa: PLR2004
+    assert rate_limiter.record(_response(clock, remaining=10, status=429)) == 60  # noqa: PLR2004
+    # Forbidden requests unrelated to rate limits are not retried
+    assert rate_limiter.record(_response(clock, remaining=10, status=403)) is None
+
+    # Secondary rate limits pause every resource
+    rate_limiter.acquire("graphql")
+    assert clock.now == start + 60
+
+
+def test_github_client_retries_rate_limited_requests(
+    github_stub: GithubStub,
+) -> None:
+    github_stub.rate_limited_requests = 2
+    rate_limiter = GithubRateLimiter()
+
+    with open_github_client(
+        auth=None, rate_limiter=rate_limiter, base_url=github_stub.base_url, retry=None
+    ) as github:
+        repo = github.get_repo(f"{OWNER}/{NAME}")
+
+    assert repo.full_name == f"{OWNER}/{NAME}"
+    assert github_stub.requested_paths() == [f"/repos/{OWNER}/{NAME}"] * 3
+    quota = rate_limiter.quota()
+    assert quota is not None
+    assert quota.remaining == github_stub.quota
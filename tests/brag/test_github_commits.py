@@ -0,0 +1,288 @@
+"""Tests for the Github commits source."""
+
+import asyncio
+from collections.abc import Iterator
+from datetime import UTC, datetime, timedelta
+from typing import Any
+
+import pytest
+
+from brag.dedup import PatchId
+from brag.repository import RepoReference
+from brag.sources import CommitRef
+from brag.sources.github_commits import (
+    GithubApi,
+    GithubCommitsSource,
+    github_commit_patch_id,
+    split_github_commit_by_file,
+)
+from tests.brag.github_stub import (
+    AUTHOR,
+    NAME,
+    OWNER,
+    GithubStub,
+    StubCommit,
+    StubFile,
+    serve_github_stub,
+)
+
+
+def test_split_github_commit_by_file() -> None:
+    commit = "\n\n".join(
+        (
+            "Add modules\n\nMODIFIED the description: not a file",
+            "ADDED first.py:\n@@ -0,0 +1 @@\n+print('first')",
+            "REMOVED docs/old notes.md: no diff",
+            "MODIFIED uv.lock (+12 -3, diff omitted)",
+        )
+    )
+
+    split = split_github_commit_by_file(commit)
+
+    assert split is not None
+    assert split.header == "Add modules\n\nMODIFIED the description: not a file"
+    assert split.sections == [
+        "ADDED first.py:\n@@ -0,0 +1 @@\n+print('first')",
+        "REMOVED docs/old notes.md: no diff",
+        "MODIFIED uv.lock (+12 -3, diff omitted)",
+    ]
+    assert split_github_commit_by_file("Add modules") is None
+
+
+def test_github_commit_patch_id() -> None:
+    change = "Change app\n\nMODIFIED app.py:\n@@ -1,2 +1,2 @@\n a\n-b\n+B"
+    cherry_pick = (
+        "Change app (cherry picked)\n\nMODIFIED app.py:\n@@ -8,2 +8,2 @@\n a\n-b\n+B"
+    )
+    revert = 'Revert "Change app"\n\nMODIFIED app.py:\n@@ -1,2 +1,2 @@\n a\n-B\n+b'
+
+    change_patch_id = github_commit_patch_id(change)
+
+    assert change_patch_id is not None
+    assert github_commit_patch_id(cherry_pick) == change_patch_id
+    assert github_commit_patch_id(revert) == PatchId(
+        forward=change_patch_id.reverse, reverse=change_patch_id.forward
+    )
+    assert github_commit_patch_id("Add modules") is None
+    assert (
+        github_commit_patch_id("Bump\n\nMODIFIED uv.lock (+12 -3, diff omitted)")
+        is None
+    )
+
+
+def _stub_commits(count: int) -> list[StubCommit]:
+    # Every third commit changes no file
+    return [
+        StubCommit(
+            sha=f"{index:040x}",
+            message=f"Commit {index}",
+            committed_at=datetime(2025, 1, 1, tzinfo=UTC) - timedelta(hours=index),
+            files=()
+            if index % 3 == 0
+            else (StubFile(f"module{index}.py", patch=f"@@ -0,0 +1 @@\n+{index}"),),
+        )
+        for index in range(count)
+    ]
+
+
+@pytest.fixture
+def github_stub() -> Iterator[GithubStub]:
+    with serve_github_stub(GithubStub(commits=_stub_commits(150))) as stub:
+        yield stub
+
+
+def _source(stub: GithubStub, **kwargs: Any) -> GithubCommitsSource:
+    return GithubCommitsSource(
+        github=stub.client(),
+        repo=RepoReference(owner=OWNER, name=NAME),
+        author=AUTHOR,
+        **kwargs,
+    )
+
+
+def test_github_commits_source_formats_commits(github_stub: GithubStub) -> None:
+    github_stub.commits = _stub_commits(2)
+
+    assert list(_source(github_stub)) == [
+        "Commit 0",
+        "Commit 1\n\nMODIFIED module1.py:\n@@ -0,0 +1 @@\n+1",
+    ]
+
+
+def test_github_commits_source_lists_commits_in_bulk_with_graphql(
+    github_stub: GithubStub,
+) -> None:
+    expected = list(_source(github_stub))
+    github_stub.requests.clear()
+
+    source = _source(github_stub, api="graphql")
+
+    assert len(source) == len(github_stub.commits)
+    assert list(source) == expected
+    # One request for the author, and one per 100 commits
+    assert len(github_stub.requested_paths("POST")) == 3  # noqa: PLR2004
+    # Only the commits that change files are fetched on their own
+    assert [
+        path
+        for path in github_stub.requested_paths()
+        if path.startswith(f"/repos/{OWNER}/{NAME}/commits/")
+    ] == [
+        f"/repos/{OWNER}/{NAME}/commits/{commit.sha}"
+        for commit in github_stub.commits
+        if commit.files
+    ]
+
+
+@pytest.mark.parametrize("api", ("rest", "graphql"))
+def test_github_commits_source_omits_the_diffs_of_large_commits(
+    github_stub: GithubStub, api: GithubApi
+) -> None:
+    github_stub.commits = [
+        StubCommit(
+            sha=f"{index:040x}",
+            message=f"Commit {index}",
+            committed_at=datetime(2025, 1, 1, tzinfo=UTC) - timedelta(hours=index),
+            files=(
+                StubFile(
+                    "app.py", patch="@@ -1 +1 @@\n-a\n+b", additions=1, deletions=1
+                ),
+                StubFile("data.csv", patch="@@ -0,0 +1 @@\n+x", additions=index),
+            ),
+        )
+        for index in range(3)
+    ]
+
+    source = _source(github_stub, api=api, max_diff_lines=3)
+
+    assert list(source) == [
+        "Commit 0\n\nMODIFIED app.py:\n@@ -1 +1 @@\n-a\n+b\n\nMODIFIED data.csv:\n@@ -0,0 +1 @@\n+x",
+        "Commit 1\n\nMODIFIED app.py:\n@@ -1 +1 @@\n-a\n+b\n\nMODIFIED data.csv:\n@@ -0,0 +1 @@\n+x",
+        "Commit 2\n\n2 files changed (+3 -1, diffs omitted)",
+    ]
+    fetched = [
+        path
+        for path in github_stub.requested_paths()
+        if path.startswith(f"/repos/{OWNER}/{NAME}/commits/")
+    ]
+    # With GraphQL, the commits whose diffs are omitted are not fetched
+    assert fetched == [
+        f"/repos/{OWNER}/{NAME}/commits/{commit.sha}"
+        for commit in (
+            github_stub.commits if api == "rest" else github_stub.commits[:2]
+        )
+    ]
+
+
+@pytest.mark.parametrize(
+    ("commits_count", "length_hint"), ((0, 0), (20, 20), (150, 150), (140, 150))
+)
+def test_github_commits_source_estimates_its_length_from_the_first_page(
+    github_stub: GithubStub, commits_count: int, length_hint: int
+) -> None:
+    github_stub.commits = github_stub.commits[:commits_count]
+    source = _source(github_stub)
+
+    assert source.length_hint() == length_hint
+    # The first page is reused by the iteration, and the commits are not counted
+    assert sum(1 for _ in source) == commits_count
+    pages_count = max(1, -(-commits_count // 30))
+    assert (
+        github_stub.requested_paths().count(f"/repos/{OWNER}/{NAME}/commits")
+        == pages_count
+    )
+
+
+@pytest.mark.parametrize("api", ("rest", "graphql"))
+def test_github_commits_source_skips_processed_commits(
+    github_stub: GithubStub, api: GithubApi
+) -> None:
+    processed = github_stub.commits[3]
+
+    source = _source(
+        github_stub,
+        api=api,
+        after_commit=CommitRef(sha=processed.sha, committed_at=processed.committed_at),
+    )
+
+    assert list(source) == list(_source(github_stub, api=api))[:3]
+    latest_commit = source.latest_commit()
+    assert latest_commit is not None
+    assert latest_commit.sha == github_stub.commits[0].sha
+
+
+def test_github_commits_source_lists_commits_lazily_with_graphql(
+    github_stub: GithubStub,
+) -> None:
+    source = _source(github_stub, api="graphql")
+
+    latest_commit = source.latest_commit()
+
+    assert latest_commit is not None
+    assert latest_commit.sha == github_stub.commits[0].sha
+    # One request for the author, and one for the first 100 commits
+    assert len(github_stub.requested_paths("POST")) == 2  # noqa: PLR2004
+    assert source.length_hint() is None
+    assert len(list(source)) == len(github_stub.commits)
+    assert len(github_stub.requested_paths("POST")) == 3  # noqa: PLR2004
+
+
+def test_github_commits_source_lists_new_commits_lazily(
+    github_stub: GithubStub,
+) -> None:
+    processed = github_stub.commits[100]
+    source = _source(
+        github_stub,
+        after_commit=CommitRef(sha=processed.sha, committed_at=processed.committed_at),
+    )
+    commits_path = f"/repos/{OWNER}/{NAME}/commits"
+
+    latest_commit = source.latest_commit()
+
+    assert latest_commit is not None
+    assert latest_commit.sha == github_stub.commits[0].sha
+    # Only the first page was listed
+    assert github_stub.requested_paths().count(commits_path) == 1
+    assert len(list(source)) == 100  # noqa: PLR2004
+    assert github_stub.requested_paths().count(commits_path) == 4  # noqa: PLR2004
+
+
+@pytest.mark.parametrize("api", ("rest", "graphql"))
+def test_github_commits_source_fetches_commits_concurrently_in_order(
+    github_stub: GithubStub, api: GithubApi
+) -> None:
+    expected = list(_source(github_stub, api=api))
+    github_stub.commits = github_stub.commits[:40]
+    github_stub.commit_delay = 0.01
+    max_concurrent_requests = 4
+
+    source = _source(
+        github_stub, api=api, max_concurrent_requests=max_concurrent_requests
+    )
+
+    assert list(source) == expected[:40]
+    assert 1 < github_stub.max_commits_in_flight <= max_concurrent_requests
+
+
+@pytest.mark.parametrize("api", ("rest", "graphql"))
+def test_github_commits_source_yields_the_same_commits_asynchronously(
+    github_stub: GithubStub, api: GithubApi
+) -> None:
+    github_stub.commits = github_stub.commits[:20]
+    expected = list(_source(github_stub, api=api))
+    source = _source(github_stub, api=api, max_concurrent_requests=4)
+
+    async def collect() -> list[str]:
+        return [commit async for commit in source]
+
+    assert asyncio.run(collect()) == expected
+
+
+def test_github_commits_source_respects_gitattributes(
+    github_stub: GithubStub,
+) -> None:
+    github_stub.commits = _stub_commits(2)
+    github_stub.files[".gitattributes"] = "module*.py linguist-generated\n"
+
+    assert list(_source(github_stub))[1] == (
+        "Commit 1\n\nMODIFIED module1.py (+1 -0, diff omitted)"
+    )
@@ -0,0 +1,105 @@
+"""Tests for the path filters module."""
+
+import pytest
+
+from brag.sources.path_filters import (
+    GitAttributesRule,
+    PathFilter,
+    format_omitted_file_diff,
+    matches_path,
+    parse_gitattributes,
+)
+
+
+@pytest.mark.parametrize(
+    ("pattern", "path", "expected"),
+    (
+        pytest.param("uv.lock", "uv.lock", True, id="file name at the root"),
+        pytest.param("uv.lock", "backend/uv.lock", True, id="file name at any depth"),
+        pytest.param("uv.lock", "uv.lock.bak", False, id="whole file name"),
+        pytest.param("*.min.js", "static/app.min.js", True, id="star"),
+        pytest.param("docs/*.md", "docs/index.md", True, id="anchored pattern"),
+        pytest.param(
+            "docs/*.md", "src/docs/index.md", False, id="anchored at the root"
+        ),
+        pytest.param(
+            "docs/*.md", "docs/api/index.md", False, id="star is not recursive"
+        ),
+        pytest.param("**/vendor/**", "vendor/lib/a.go", True, id="leading double star"),
+        pytest.param("**/vendor/**", "src/vendor/a.go", True, id="nested directory"),
+        pytest.param("**/vendor/**", "src/vendors/a.go", False, id="directory name"),
+        pytest.param("/generated/**", "generated/a.py", True, id="leading slash"),
+        pytest.param("file?.py", "file1.py", True, id="question mark"),
+        pytest.param("file?.py", "file/.py", False, id="question mark and slash"),
+    ),
+)
+def test_matches_path(pattern: str, path: str, expected: bool) -> None:
+    assert matches_path(pattern, path) is expected
+
+
+def test_parse_gitattributes() -> None:
+    text = "\n".join(
+        (
+            "# Generated code",
+            "*.pb.go linguist-generated=true",
+            "api/*.ts linguist-generated -linguist-vendored",
+            "*.png binary",
+            "*.sql -diff",
+            "docs/** linguist-documentation",
+            "",
+            "*.py text eol=lf",
+        )
+    )
+
+    assert parse_gitattributes(text) == (
+        GitAttributesRule("*.pb.go", excluded=True),
+        GitAttributesRule("api/*.ts", excluded=True),
+        GitAttributesRule("api/*.ts", excluded=False),
+        GitAttributesRule("*.png", excluded=True),
+        GitAttributesRule("*.sql", excluded=True),
+    )
+
+
+@pytest.mark.parametrize(
+    ("path_filter", "path", "expected"),
+    (
+        pytest.param(PathFilter(), "src/app.py", False, id="regular file"),
+        pytest.param(PathFilter(), "poetry.lock", True, id="lockfile"),
+        pytest.param(PathFilter(), "web/node_modules/a/index.js", True, id="vendored"),
+        pytest.param(PathFilter(exclude=()), "poetry.lock", False, id="no excludes"),
+        pytest.param(
+            PathFilter(include=("src/**",)),
+            "tests/test_app.py",
+            True,
+            id="not included",
+        ),
+        pytest.param(
+            PathFilter(include=("src/**",)), "src/uv.lock", True, id="included excluded"
+        ),
+        pytest.param(
+            PathFilter().with_gitattributes("*.pb.go linguist-generated"),
+            "api/service.pb.go",
+            True,
+            id="generated",
+        ),
+        pytest.param(
+            PathFilter().with_gitattributes(
+                "api/** linguist-generated\napi/handwritten.go -linguist-generated"
+            ),
+            "api/handwritten.go",
+            False,
+            id="last gitattributes rule wins",
+        ),
+    ),
+)
+def test_path_filter_is_excluded(
+    path_filter: PathFilter, path: str, expected: bool
+) -> None:
+    assert path_filter.is_excluded(path) is expected
+
+
+def test_format_omitted_file_diff() -> None:
+    assert (
+        format_omitted_file_diff("modified", "uv.lock", 12, 3)
+        == "MODIFIED uv.lock (+12 -3, diff omitted)"
+    )
@@ -0,0 +1,230 @@
+"""Tests for the pipeline module."""
+
+import asyncio
+import threading
+import time
+from collections.abc import AsyncIterator, Iterator
+from contextlib import aclosing
+
+import pytest
+
+from brag.pipeline import iterate_in_thread, map_async, prefetch
+
+
+async def _collect[T](items: Iterator[T], *, max_pending: int) -> list[T]:
+    return [item async for item in iterate_in_thread(items, max_pending=max_pending)]
+
+
+def test_iterate_in_thread_yields_items_in_order() -> None:
+    assert asyncio.run(_collect(iter(range(100)), max_pending=3)) == list(range(100))
+
+
+def test_iterate_in_thread_runs_the_iterable_in_another_thread() -> None:
+    threads: set[int] = set()
+
+    def items() -> Iterator[int]:
+        for item in range(3):
+            threads.add(threading.get_ident())
+            yield item
+
+    asyncio.run(_collect(items(), max_pending=1))
+
+    assert threads and threading.get_ident() not in threads
+
+
+def test_iterate_in_thread_bounds_the_items_produced_ahead() -> None:
+    max_pending = 2
+    produced: list[int] = []
+
+    def items() -> Iterator[int]:
+        for item in range(20):
+            produced.append(item)
+            yield item
+
+    async def consume() -> list[int]:
+        lead: list[int] = []
+        async for item in iterate_in_thread(items(), max_pending=max_pending):
+            # Give the worker thread time to run ahead as far as it can
+            await asyncio.sleep(0.01)
+            lead.append(len(produced) - item - 1)
+        return lead
+
+    lead = asyncio.run(consume())
+
+    # The worker waits for room before producing each item
+    assert max(lead) == max_pending
+
+
+def test_iterate_in_thread_raises_errors_after_the_previous_items() -> None:
+    def items() -> Iterator[int]:
+        yield 1
+        yield 2
+        raise RuntimeError("extraction failed")
+
+    received: list[int] = []
+
+    async def consume() -> None:
+        async for item in iterate_in_thread(items(), max_pending=4):
+            received.append(item)
+
+    with pytest.raises(RuntimeError, match="extraction failed"):
+        asyncio.run(consume())
+    assert received == [1, 2]
+
+
+def test_iterate_in_thread_closes_the_iterator_when_stopped_early() -> None:
+    closed = threading.Event()
+
+    def items() -> Iterator[int]:
+        try:
+            yield from range(1000)
+        finally:
+            closed.set()
+
+    async def consume() -> int:
+        async with aclosing(iterate_in_thread(items(), max_pending=2)) as stream:
+            async for item in stream:
+                return item
+        raise AssertionError("No item received")
+
+    assert asyncio.run(consume()) == 0
+    assert closed.is_set()
+
+
+def test_iterate_in_thread_does_not_wait_for_the_worker_when_cancelled() -> None:
+    resumed = threading.Event()
+
+    def items() -> Iterator[int]:
+        yield 0
+        # Producing the next item blocks, like waiting for a rate limit to reset
+        resumed.wait(timeout=10)
+        yield 1
+
+    async def consume() -> None:
+        async for _ in iterate_in_thread(items(), max_pending=1):
+            pass
+
+    async def cancel_consumer() -> float:
+        start = time.monotonic()
+        with pytest.raises(TimeoutError):
+            await asyncio.wait_for(consume(), timeout=0.1)
+        return time.monotonic() - start
+
+    try:
+        assert asyncio.run(cancel_consumer()) < 1
+    finally:
+        resumed.set()
+
+
+def test_iterate_in_thread_max_pending_must_be_positive() -> None:
+    with pytest.raises(ValueError, match="max_pending must be positive"):
+        iterate_in_thread([], max_pending=0)
+
+
+async def _arange(
+    count: int, *, produced: list[int] | None = None
+) -> AsyncIterator[int]:
+    for item in range(count):
+        if produced is not None:
+            produced.append(item)
+        yield item
+
+
+def test_prefetch_reads_ahead_of_the_consumer() -> None:
+    max_pending = 3
+    produced: list[int] = []
+
+    async def consume() -> tuple[list[int], list[int]]:
+        items: list[int] = []
+        lead: list[int] = []
+        async for item in prefetch(
+            _arange(20, produced=produced), max_pending=max_pending
+        ):
+            await asyncio.sleep(0.001)
+            items.append(item)
+            lead.append(len(produced) - item - 1)
+        return items, lead
+
+    items, lead = asyncio.run(consume())
+
+    assert items == list(range(20))
+    # The queue holds `max_pending` items, and the producer holds one more
+    assert max(lead) == max_pending + 1
+
+
+def test_prefetch_raises_errors_after_the_previous_items() -> None:
+    async def items() -> AsyncIterator[int]:
+        yield 1
+        raise RuntimeError("listing failed")
+
+    received: list[int] = []
+
+    async def consume() -> None:
+        async for item in prefetch(items(), max_pending=2):
+            received.append(item)
+
+    with pytest.raises(RuntimeError, match="listing failed"):
+        asyncio.run(consume())
+    assert received == [1]
+
+
+def test_prefetch_max_pending_must_be_positive() -> None:
+    with pytest.raises(ValueError, match="max_pending must be positive"):
+        prefetch(_arange(1), max_pending=0)
+
+
+@pytest.mark.parametrize("ordered", (True, False))
+def test_map_async_bounds_the_concurrent_calls(ordered: bool) -> None:
+    concurrency = 3
+    running = 0
+    max_running = 0
+
+    async def double(item: int) -> int:
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        # Later items finish first
+        await asyncio.sleep(0.001 * (10 - item % 10))
+        running -= 1
+        return item * 2
+
+    async def consume() -> list[int]:
+        mapped = map_async(
+            double, _arange(30), concurrency=concurrency, ordered=ordered
+        )
+        return [item async for item in mapped]
+
+    results = asyncio.run(consume())
+
+    expected = [item * 2 for item in range(30)]
+    assert (results if ordered else sorted(results)) == expected
+    assert (results == expected) is ordered
+    assert max_running == concurrency
+
+
+def test_map_async_cancels_pending_calls_when_stopped_early() -> None:
+    cancelled: list[int] = []
+
+    async def slow(item: int) -> int:
+        if item == 0:
+            return item
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(item)
+            raise
+        return item
+
+    async def consume() -> int:
+        async with aclosing(map_async(slow, range(10), concurrency=4)) as mapped:
+            async for item in mapped:
+                return item
+        raise AssertionError("No item received")
+
+    assert asyncio.run(consume()) == 0
+    assert sorted(cancelled) == [1, 2, 3]
+
+
+def test_map_async_concurrency_must_be_positive() -> None:
+    with pytest.raises(ValueError, match="concurrency must be positive"):
+        map_async(asyncio.sleep, [], concurrency=0)
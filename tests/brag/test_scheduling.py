@@ -0,0 +1,317 @@
+"""Tests for the scheduling module."""
+
+import asyncio
+from collections.abc import AsyncIterator
+
+import pytest
+from pydantic_ai import Agent
+from pydantic_ai.exceptions import ModelHTTPError
+from pydantic_ai.messages import ModelMessage, ModelResponse, TextPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+from pydantic_ai.usage import RequestUsage
+
+from brag.scheduling import AIMDConcurrencyLimiter, LLMScheduler, TokenBucket
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_token_bucket_grants_tokens_up_to_capacity() -> None:
+    clock = FakeClock()
+    bucket = TokenBucket(capacity=10, refill_rate=1, clock=clock)
+
+    assert bucket.try_acquire(6) == 0
+    assert bucket.try_acquire(4) == 0
+    assert bucket.try_acquire(2) == pytest.approx(2)
+
+
+def test_token_bucket_refills_over_time() -> None:
+    clock = FakeClock()
+    bucket = TokenBucket(capacity=10, refill_rate=2, clock=clock)
+    assert bucket.try_acquire(10) == 0
+
+    clock.now = 2.5
+    assert bucket.try_acquire(6) == pytest.approx(0.5)
+    assert bucket.try_acquire(5) == 0
+
+
+def test_token_bucket_does_not_refill_beyond_capacity() -> None:
+    clock = FakeClock()
+    bucket = TokenBucket(capacity=10, refill_rate=1, clock=clock)
+
+    clock.now = 100
+    assert bucket.try_acquire(10) == 0
+    assert bucket.try_acquire(1) == pytest.approx(1)
+
+
+def test_token_bucket_clamps_requests_larger_than_capacity() -> None:
+    clock = FakeClock()
+    bucket = TokenBucket(capacity=10, refill_rate=1, clock=clock)
+
+    assert bucket.try_acquire(1_000) == 0
+
+
+def test_token_bucket_refunds_tokens_up_to_capacity() -> None:
+    clock = FakeClock()
+    bucket = TokenBucket(capacity=10, refill_rate=1, clock=clock)
+
+    assert bucket.try_acquire(8) == 0
+    bucket.refund(8)
+    assert bucket.try_acquire(10) == 0
+    bucket.refund(100)
+    assert bucket.try_acquire(10) == 0
+
+
+@pytest.mark.parametrize(
+    ("capacity", "refill_rate", "message"),
+    (
+        pytest.param(0, 1, "capacity must be positive", id="zero capacity"),
+        pytest.param(1, 0, "refill_rate must be positive", id="zero refill rate"),
+    ),
+)
+def test_token_bucket_validates_arguments(
+    capacity: float, refill_rate: float, message: str
+) -> None:
+    with pytest.raises(ValueError, match=message):
+        TokenBucket(capacity=capacity, refill_rate=refill_rate)
+
+
+def test_aimd_concurrency_limiter_decreases_multiplicatively() -> None:
+    limiter = AIMDConcurrencyLimiter(16, decrease_factor=0.5)
+
+    limiter.on_overload()
+    assert limiter.limit == 8  # noqa: PLR2004
+    limiter.on_overload()
+    assert limiter.limit == 4  # noqa: PLR2004
+
+
+def test_aimd_concurrency_limiter_never_goes_below_min_limit() -> None:
+    limiter = AIMDConcurrencyLimiter(4, min_limit=2)
+
+    for _ in range(10):
+        limiter.on_overload()
+
+    assert limiter.limit == limiter.min_limit
+
+
+def test_aimd_concurrency_limiter_increases_additively_up_to_max_limit() -> None:
+    limiter = AIMDConcurrencyLimiter(4)
+    limiter.on_overload()
+    limiter.on_overload()
+    assert limiter.limit == 1
+
+    # The limit grows by roughly one slot per round of requests
+    limiter.on_success()
+    assert limiter.limit == 2  # noqa: PLR2004
+    limiter.on_success()
+    limiter.on_success()
+    limiter.on_success()
+    assert limiter.limit == 3  # noqa: PLR2004
+
+    for _ in range(100):
+        limiter.on_success()
+    assert limiter.limit == limiter.max_limit
+
+
+def test_aimd_concurrency_limiter_decreases_once_per_window() -> None:
+    limiter = AIMDConcurrencyLimiter(8)
+    window = limiter.window
+
+    # Requests that started before the first decrease fail from the same overload
+    for _ in range(8):
+        limiter.on_overload(window)
+    assert limiter.limit == 4  # noqa: PLR2004
+
+    limiter.on_overload(limiter.window)
+    assert limiter.limit == 2  # noqa: PLR2004
+
+
+def test_scheduler_bounds_concurrency() -> None:
+    max_concurrency = 3
+    running = 0
+    max_running = 0
+
+    async def model_function(
+        messages: list[ModelMessage], info: AgentInfo
+    ) -> ModelResponse:
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return ModelResponse(parts=[TextPart("ok")])
+
+    agent = Agent(FunctionModel(model_function))
+    scheduler = LLMScheduler(max_concurrency)
+
+    async def run_all() -> list[str]:
+        results = await asyncio.gather(
+            *(scheduler.run(agent, f"prompt {i}") for i in range(10))
+        )
+        return [result.output for result in results]
+
+    assert asyncio.run(run_all()) == ["ok"] * 10
+    assert max_running == max_concurrency
+
+
+@pytest.mark.parametrize("status_code", (429, 503, 529))
+def test_scheduler_retries_rate_limited_requests(status_code: int) -> None:
+    failures = 2
+    calls = 0
+
+    def model_function(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+        nonlocal calls
+        calls += 1
+        if calls <= failures:
+            raise ModelHTTPError(status_code=status_code, model_name="test")
+        return ModelResponse(parts=[TextPart("ok")])
+
+    agent = Agent(FunctionModel(model_function))
+    scheduler = LLMScheduler(8, initial_backoff=0)
+
+    result = asyncio.run(scheduler.run(agent, "prompt"))
+
+    assert result.output == "ok"
+    assert calls == failures + 1
+    assert scheduler.concurrency_limit < scheduler.max_concurrency
+
+
+def test_scheduler_gives_up_after_max_retries() -> None:
+    calls = 0
+
+    def model_function(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+        nonlocal calls
+        calls += 1
+        raise ModelHTTPError(status_code=429, model_name="test")
+
+    agent = Agent(FunctionModel(model_function))
+    scheduler = LLMScheduler(max_retries=2, initial_backoff=0)
+
+    with pytest.raises(ModelHTTPError):
+        asyncio.run(scheduler.run(agent, "prompt"))
+
+    assert calls == scheduler.max_retries + 1
+
+
+def test_scheduler_does_not_retry_other_errors() -> None:
+    calls = 0
+
+    def model_function(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+        nonlocal calls
+        calls += 1
+        raise ModelHTTPError(status_code=400, model_name="test")
+
+    agent = Agent(FunctionModel(model_function))
+    scheduler = LLMScheduler(initial_backoff=0)
+
+    with pytest.raises(ModelHTTPError):
+        asyncio.run(scheduler.run(agent, "prompt"))
+
+    assert calls == 1
+
+
+def test_scheduler_streams_text_and_retries_before_any_text() -> None:
+    calls = 0
+
+    async def stream_function(
+        messages: list[ModelMessage], info: AgentInfo
+    ) -> AsyncIterator[str]:
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise ModelHTTPError(status_code=429, model_name="test")
+        for text in ("o", "k"):
+            yield text
+
+    agent = Agent(FunctionModel(stream_function=stream_function))
+    scheduler = LLMScheduler(initial_backoff=0)
+    texts: list[str] = []
+
+    async def run() -> str:
+        result = await scheduler.run_stream(agent, "prompt", on_text=texts.append)
+        return await result.get_output()
+
+    assert asyncio.run(run()) == "ok"
+    assert texts == ["o", "k"]
+    assert calls == 2  # noqa: PLR2004
+
+
+def test_scheduler_does_not_retry_streams_after_text() -> None:
+    calls = 0
+
+    async def stream_function(
+        messages: list[ModelMessage], info: AgentInfo
+    ) -> AsyncIterator[str]:
+        nonlocal calls
+        calls += 1
+        yield "partial"
+        raise ModelHTTPError(status_code=429, model_name="test")
+
+    agent = Agent(FunctionModel(stream_function=stream_function))
+    scheduler = LLMScheduler(initial_backoff=0)
+    texts: list[str] = []
+
+    with pytest.raises(ModelHTTPError):
+        asyncio.run(scheduler.run_stream(agent, "prompt", on_text=texts.append))
+
+    assert texts == ["partial"]
+    assert calls == 1
+
+
+def test_scheduler_accumulates_usage_of_completed_requests() -> None:
+    def model_function(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+        return ModelResponse(
+            parts=[TextPart("ok")],
+            usage=RequestUsage(
+                input_tokens=100, cache_read_tokens=80, output_tokens=10
+            ),
+        )
+
+    agent = Agent(FunctionModel(model_function))
+    scheduler = LLMScheduler()
+
+    async def run_all() -> None:
+        await asyncio.gather(*(scheduler.run(agent, f"prompt {i}") for i in range(3)))
+
+    asyncio.run(run_all())
+
+    assert scheduler.usage.requests == 3  # noqa: PLR2004
+    assert scheduler.usage.input_tokens == 300  # noqa: PLR2004
+    assert scheduler.usage.cache_read_tokens == 240  # noqa: PLR2004
+    assert scheduler.usage.output_tokens == 30  # noqa: PLR2004
+
+
+def test_scheduler_decreases_the_limit_once_for_concurrent_failures() -> None:
+    max_concurrency = 8
+    calls = 0
+    limits_after_failures: list[int] = []
+
+    async def model_function(
+        messages: list[ModelMessage], info: AgentInfo
+    ) -> ModelResponse:
+        nonlocal calls
+        calls += 1
+        if calls <= max_concurrency:
+            # Let every request start before any of them fails
+            await asyncio.sleep(0.01)
+            raise ModelHTTPError(status_code=429, model_name="test")
+        limits_after_failures.append(scheduler.concurrency_limit)
+        return ModelResponse(parts=[TextPart("ok")])
+
+    agent = Agent(FunctionModel(model_function))
+    scheduler = LLMScheduler(max_concurrency, initial_backoff=0)
+
+    async def run_all() -> None:
+        await asyncio.gather(
+            *(scheduler.run(agent, f"prompt {i}") for i in range(max_concurrency))
+        )
+
+    asyncio.run(run_all())
+
+    # The failures of the requests in flight count as a single overload
+    assert limits_after_failures[0] == max_concurrency // 2
@@ -0,0 +1,102 @@
+"""Tests for the data source adapters."""
+
+import asyncio
+from collections.abc import AsyncIterator, Iterator
+
+import pytest
+
+from brag.sources import AsyncDataSource, DataSource
+
+
+class _RangeSource(DataSource[int]):
+    def __init__(self, count: int) -> None:
+        self.count = count
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self.count))
+
+    def __len__(self) -> int:
+        return self.count
+
+
+async def _collect[T](source: AsyncDataSource[T]) -> list[T]:
+    return [item async for item in source]
+
+
+def test_data_source_can_be_iterated_over_asynchronously() -> None:
+    count = 20
+    source = _RangeSource(count).to_async(max_pending=2).prefetch(3)
+
+    assert len(source) == count
+    assert asyncio.run(_collect(source)) == list(range(count))
+
+
+@pytest.mark.parametrize("ordered", (True, False))
+def test_async_data_source_maps_coroutine_functions(ordered: bool) -> None:
+    async def square(item: int) -> int:
+        await asyncio.sleep(0.001 * (5 - item % 5))
+        return item**2
+
+    count = 10
+    source = _RangeSource(count).to_async().amap(square, concurrency=3, ordered=ordered)
+
+    results = asyncio.run(_collect(source))
+
+    assert len(source) == count
+    assert sorted(results) == [item**2 for item in range(count)]
+    assert (results == sorted(results)) is ordered
+
+
+def test_async_data_source_adapters_validate_their_arguments() -> None:
+    async def identity(item: int) -> int:
+        return item
+
+    source = _RangeSource(1)
+
+    with pytest.raises(ValueError, match="max_pending must be positive"):
+        source.to_async(max_pending=0)
+    with pytest.raises(ValueError, match="count must be positive"):
+        source.to_async().prefetch(0)
+    with pytest.raises(ValueError, match="concurrency must be positive"):
+        source.to_async().amap(identity, concurrency=0)
+
+
+def test_async_data_source_iteration_is_lazy() -> None:
+    class _Source(AsyncDataSource[int]):
+        def __init__(self) -> None:
+            self.produced = 0
+
+        async def _items(self) -> AsyncIterator[int]:
+            for item in range(100):
+                self.produced += 1
+                yield item
+
+        def __aiter__(self) -> AsyncIterator[int]:
+            return self._items()
+
+        def __len__(self) -> int:
+            return 100
+
+    max_pending = 2
+    inner = _Source()
+
+    async def first() -> int:
+        async for item in inner.prefetch(max_pending):
+            return item
+        raise AssertionError("No item received")
+
+    assert asyncio.run(first()) == 0
+    # The prefetched items, the item held by the producer and the consumed item
+    assert inner.produced <= max_pending + 2
+
+
+def test_data_source_adapters_forward_the_length_hint() -> None:
+    class _EstimatedSource(_RangeSource):
+        def length_hint(self) -> int | None:
+            return self.count
+
+    limit = 5
+
+    assert _RangeSource(10).limit(limit).length_hint() is None
+    assert _EstimatedSource(10).limit(limit).length_hint() == limit
+    assert _EstimatedSource(3).limit(limit).map(str).length_hint() == 3  # noqa: PLR2004
@@ -0,0 +1,129 @@
+"""Tests for the splitting module."""
+
+import pytest
+
+from brag.splitting import (
+    ChunkSplit,
+    split_at,
+    split_diff_by_hunk,
+    split_oversized_chunk,
+    split_oversized_chunks,
+)
+from brag.tokens import estimate_token_count
+
+DIFF = """\
+--- a/module.py
++++ b/module.py
+@@ -1,2 +1,2 @@
+-old line
++new line
+@@ -10,2 +10,2 @@
+-another old line
++another new line
+"""
+
+
+def _split_by_paragraph(text: str) -> ChunkSplit | None:
+    header, *sections = text.split("\n\n")
+    return ChunkSplit(header, sections, separator="\n\n") if sections else None
+
+
+def _token_count(text: str) -> int:
+    return estimate_token_count(text, approximation_mode="overestimate")
+
+
+def test_split_at() -> None:
+    assert split_at("header\nfirst\nsecond\n", [7, 13]) == ChunkSplit(
+        header="header", sections=["first", "second"]
+    )
+    assert split_at("no sections", []) is None
+
+
+def test_split_diff_by_hunk() -> None:
+    split = split_diff_by_hunk(DIFF)
+
+    assert split is not None
+    assert split.header == "--- a/module.py\n+++ b/module.py"
+    assert [section.splitlines()[0] for section in split.sections] == [
+        "@@ -1,2 +1,2 @@",
+        "@@ -10,2 +10,2 @@",
+    ]
+
+
+def test_chunks_that_fit_are_unchanged() -> None:
+    chunks = ["small chunk", DIFF]
+
+    assert list(split_oversized_chunks(chunks, _token_count(DIFF))) == chunks
+
+
+def test_sections_are_grouped_under_a_repeated_header() -> None:
+    chunk = "header\n\naaaaaa\n\nbbbbbb\n\ncccccc"
+
+    pieces = split_oversized_chunk(chunk, 9, [_split_by_paragraph])
+
+    assert pieces == ["header\n\naaaaaa\n\nbbbbbb", "header\n\ncccccc"]
+
+
+def test_oversized_sections_are_split_with_the_next_splitter() -> None:
+    chunk = f"commit message\n\n{DIFF}"
+    expected_pieces = [
+        f"commit message\n\n--- a/module.py\n+++ b/module.py\n{hunk}"
+        for hunk in (
+            "@@ -1,2 +1,2 @@\n-old line\n+new line",
+            "@@ -10,2 +10,2 @@\n-another old line\n+another new line",
+        )
+    ]
+    # Leave some room for the rounding of the token estimates of every part
+    max_tokens = max(map(_token_count, expected_pieces)) + 5
+
+    pieces = split_oversized_chunk(
+        chunk, max_tokens, [_split_by_paragraph, split_diff_by_hunk]
+    )
+
+    assert pieces == expected_pieces
+
+
+def test_a_single_oversized_hunk_is_split_by_lines_under_its_headers() -> None:
+    hunk = "@@ -1,20 +1,20 @@\n" + "\n".join(f"+line {i}" for i in range(20))
+    chunk = f"commit message\n\n--- a/module.py\n+++ b/module.py\n{hunk}"
+    headers = "commit message\n\n--- a/module.py\n+++ b/module.py\n"
+    max_tokens = _token_count(headers) + 20
+
+    pieces = split_oversized_chunk(
+        chunk, max_tokens, [_split_by_paragraph, split_diff_by_hunk]
+    )
+
+    assert len(pieces) > 1
+    assert all(_token_count(piece) <= max_tokens for piece in pieces)
+    assert all(piece.startswith(headers) for piece in pieces)
+    assert "\n".join(piece.removeprefix(headers) for piece in pieces) == hunk
+
+
+def test_chunks_without_the_structure_of_their_level_are_split_by_lines() -> None:
+    # A single oversized hunk, without the paragraphs of the first level
+    chunk = "@@ -1,20 +1,20 @@\n" + "\n".join(f"+line {i}" for i in range(20))
+    max_tokens = 20
+
+    pieces = split_oversized_chunk(
+        chunk, max_tokens, [_split_by_paragraph, split_diff_by_hunk]
+    )
+
+    assert len(pieces) > 1
+    assert all(_token_count(piece) <= max_tokens for piece in pieces)
+    # The hunk splitter of the next level is not applied to the whole chunk
+    assert "\n".join(pieces) == chunk
+
+
+@pytest.mark.parametrize("max_tokens", (1, 3, 10))
+def test_chunks_without_structure_are_split_by_lines(max_tokens: int) -> None:
+    chunk = "\n".join(f"line {i} " * i for i in range(20))
+
+    pieces = split_oversized_chunk(chunk, max_tokens)
+
+    assert all(_token_count(piece) <= max_tokens for piece in pieces)
+    assert "".join(pieces).replace("\n", "") == chunk.replace("\n", "")
+
+
+def test_max_tokens_per_chunk_must_be_positive() -> None:
+    with pytest.raises(ValueError, match="max_tokens_per_chunk must be positive"):
+        list(split_oversized_chunks(["chunk"], 0))
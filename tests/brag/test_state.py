@@ -0,0 +1,46 @@
+"""Tests for the state module."""
+
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+from brag.sources import CommitRef
+from brag.state import (
+    BragDocumentState,
+    SourceState,
+    load_state,
+    save_state,
+    source_key,
+    state_path_for,
+)
+
+
+def test_state_path_is_next_to_the_brag_document() -> None:
+    assert state_path_for(Path("docs/brag.md")) == Path("docs/brag.md.brag-state.json")
+
+
+def test_load_state_returns_an_empty_state_if_missing(tmp_path: Path) -> None:
+    assert load_state(tmp_path / "missing.json") == BragDocumentState()
+
+
+def test_state_roundtrip(tmp_path: Path) -> None:
+    commit = CommitRef(
+        sha="abc123",
+        committed_at=datetime(2024, 6, 15, 12, tzinfo=timezone(timedelta(hours=-3))),
+    )
+    key = source_key("git", "/path/to/repo", "octocat")
+    state = BragDocumentState(sources={key: SourceState.from_commit_ref(commit)})
+    path = state_path_for(tmp_path / "brag.md")
+
+    save_state(path, state)
+
+    assert load_state(path).sources[key].to_commit_ref() == commit
+
+
+def test_load_state_rejects_an_invalid_state_file(tmp_path: Path) -> None:
+    path = state_path_for(tmp_path / "brag.md")
+    path.write_text('{"sources": {"git:repo@octocat": {"last_commit_sha": "abc123"}}')
+
+    with pytest.raises(ValueError, match="delete it to process all commits again"):
+        load_state(path)
@@ -0,0 +1,127 @@
+"""Tests for the tokens module."""
+
+from pathlib import Path
+
+import pytest
+
+from brag.tokens import (
+    MIN_CALIBRATION_OBSERVATIONS,
+    CalibratedTokenEstimator,
+    HeuristicTokenEstimator,
+    count_prose_and_code_characters,
+)
+
+PROSE_TOKENS_PER_CHARACTER = 0.25
+CODE_TOKENS_PER_CHARACTER = 0.5
+
+COMMIT = """\
+commit 0123456789abcdef
+Author: Octocat <octocat@example.com>
+
+    Add a module
+
+diff --git a/module.py b/module.py
+new file mode 100644
+index 0000000..e69de29
+--- /dev/null
++++ b/module.py
+@@ -0,0 +1,2 @@
++def main():
++    pass
+
+---
+
+Another commit message
+"""
+
+
+def _text(prose_characters: int, code_characters: int) -> str:
+    return "p" * prose_characters + "\n@@ " + "c" * (code_characters - 4)
+
+
+def _observe_exact_usage(
+    estimator: CalibratedTokenEstimator, count: int = MIN_CALIBRATION_OBSERVATIONS
+) -> None:
+    for i in range(count):
+        prose_characters, code_characters = 100 * (i + 1), 300 * (count - i)
+        estimator.observe(
+            _text(prose_characters, code_characters),
+            round(
+                PROSE_TOKENS_PER_CHARACTER * (prose_characters + 1)
+                + CODE_TOKENS_PER_CHARACTER * code_characters
+            ),
+        )
+
+
+def test_count_prose_and_code_characters() -> None:
+    prose, code = count_prose_and_code_characters(COMMIT)
+
+    diff_start = COMMIT.index("diff --git")
+    diff_end = COMMIT.index("\n\n---") + 1
+    assert code == diff_end - diff_start
+    assert prose == len(COMMIT) - code
+
+
+def test_calibrated_estimator_falls_back_until_calibrated() -> None:
+    fallback = HeuristicTokenEstimator()
+    estimator = CalibratedTokenEstimator("test", fallback=fallback)
+    _observe_exact_usage(estimator, MIN_CALIBRATION_OBSERVATIONS - 1)
+
+    assert not estimator.calibrated
+    assert estimator.estimate(COMMIT) == fallback.estimate(COMMIT)
+
+
+def test_calibrated_estimator_learns_prose_and_code_ratios() -> None:
+    estimator = CalibratedTokenEstimator("test", safety_quantile=1.0)
+    _observe_exact_usage(estimator)
+
+    assert estimator.calibrated
+    prose, code = 1_000, 5_000
+    expected = (
+        PROSE_TOKENS_PER_CHARACTER * (prose + 1) + CODE_TOKENS_PER_CHARACTER * code
+    )
+    assert estimator.estimate(_text(prose, code)) == pytest.approx(expected, rel=0.01)
+
+
+def test_calibrated_estimator_covers_the_safety_quantile() -> None:
+    estimator = CalibratedTokenEstimator("test", safety_quantile=1.0)
+    text = "prose only"
+    token_counts = [10, 10, 10, 10, 20]
+    for token_count in token_counts:
+        estimator.observe(text, token_count)
+
+    assert estimator.estimate(text) >= max(token_counts)
+
+
+def test_calibrated_estimator_persists_observations_per_model(tmp_path: Path) -> None:
+    estimator = CalibratedTokenEstimator.in_directory(tmp_path, "model-a")
+    _observe_exact_usage(estimator)
+    estimator.save()
+    CalibratedTokenEstimator.in_directory(tmp_path, "model-b").save()
+
+    assert CalibratedTokenEstimator.in_directory(tmp_path, "model-a").calibrated
+    assert not CalibratedTokenEstimator.in_directory(tmp_path, "model-b").calibrated
+
+
+def test_calibrated_estimator_snapshot_ignores_later_observations(
+    tmp_path: Path,
+) -> None:
+    estimator = CalibratedTokenEstimator.in_directory(tmp_path, "test")
+    _observe_exact_usage(estimator)
+    snapshot = estimator.snapshot()
+    estimate = snapshot.estimate(COMMIT)
+
+    for _ in range(MIN_CALIBRATION_OBSERVATIONS):
+        estimator.observe(COMMIT, 10 * estimate)
+    snapshot.save()
+
+    assert snapshot.estimate(COMMIT) == estimate
+    assert estimator.estimate(COMMIT) > estimate
+    # Only the estimator persists its observations
+    assert not (tmp_path / "token_calibration.json").exists()
+
+
+@pytest.mark.parametrize("safety_quantile", (0, 1.5))
+def test_calibrated_estimator_validates_safety_quantile(safety_quantile: float) -> None:
+    with pytest.raises(ValueError, match="safety_quantile must be between 0 and 1"):
+        CalibratedTokenEstimator("test", safety_quantile=safety_quantile)